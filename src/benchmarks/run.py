@@ -0,0 +1,206 @@
+"""
+Benchmark runner
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to measure the download, the read of the downloaded parts and the biome assignment against a local
+    stub GeoServer with synthetic focuses, so two versions of the tasks can be compared without the production service.
+
+    cd src
+    python3 -m benchmarks.run --sizes 10000,100000,1000000 --formats SHAPE-ZIP,application/json
+    python3 -m benchmarks.run --sizes 10000 --latency 0.05 --bandwidth 5000000 --compare ../data/benchmarks/benchmark_<date>.json
+
+    The results are written as JSON, one item per benchmark, size and output format, with the time in seconds
+    and the features per second.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from benchmarks.synthetic_data import generateFocuses, generateBiomes
+from benchmarks.stub_geoserver import StubGeoServer
+from tasks.metrics import resetRunMetrics, getPeakMemory
+
+GEOSERVER_CFG="""[geoserver]
+geoserver_base_url: {base_url}
+geoserver_base_path: geoserver
+workspace: terrabrasilis
+layer: focos
+default_epsg: 4674
+sort_attribute: fid
+date_attribute: datahora
+user: benchmark
+password: benchmark
+download_workers: {workers}
+output_format: {output_format}
+paging_mode: {paging_mode}
+cache_dir: {work_dir}/cache
+hits_ttl: 0
+"""
+
+def _result(benchmark, size, output_format, seconds, features, **extra):
+    result={
+        "benchmark":benchmark,
+        "size":size,
+        "format":output_format,
+        "seconds":round(seconds, 3),
+        "features":features,
+        "features_per_second":round(features/seconds, 1) if seconds else None,
+        "peak_memory_mb":round(getPeakMemory(), 1)
+    }
+    result.update(extra)
+    return result
+
+def benchmarkDownload(server, work_dir, output_format, args):
+    """
+    Time WFS.download of the whole period. Return the result, the WFS client and the part file names.
+    """
+    from tasks.wfs import WFS
+
+    with open(f"{work_dir}/geoserver.cfg", 'w') as f:
+        f.write(GEOSERVER_CFG.format(base_url=server.base_url, workers=args.workers, output_format=output_format,
+                                     paging_mode=args.paging_mode, work_dir=work_dir))
+    wfs=WFS(f"{work_dir}/", 'geoserver.cfg', 'geoserver')
+    wfs.setPeriod(start_date=args.start_date, end_date=args.end_date)
+
+    metrics=resetRunMetrics("benchmark")
+    start=time.time()
+    rows, base_file_name, total_files=wfs.download(output_dir=work_dir)
+    seconds=time.time()-start
+
+    file_names=[wfs.getPartFileName(base_file_name, n) for n in range(1, total_files)]
+    size=sum(os.path.getsize(f"{work_dir}/{name}") for name in file_names)
+    stages={stage:value["seconds"] for stage, value in metrics.getReport()["stages"].items()}
+    return _result("download", len(server.focuses), output_format, seconds, rows, pages=len(file_names), bytes=size, stages=stages), wfs, file_names
+
+def benchmarkLoad(work_dir, output_format, file_names, batch_size=0):
+    """
+    Time ImportData.__load_input_data of each part, or ImportData.__iter_input_data if a batch size is defined.
+    Return the result and the parsed parts or batches.
+    """
+    from tasks.import_data import ImportData
+
+    # only the file reader is measured, so the import is created without its database connection
+    import_data=ImportData.__new__(ImportData)
+    import_data.input_dir=work_dir
+    import_data._input_data=None
+    import_data._read_batch_size=batch_size
+
+    parts=[]
+    start=time.time()
+    for name in file_names:
+        if batch_size:
+            parts.extend(import_data._ImportData__iter_input_data(file_name=name))
+            continue
+        import_data._ImportData__load_input_data(file_name=name)
+        parts.append(import_data._input_data)
+    seconds=time.time()-start
+    return _result("load", None, output_format, seconds, sum(len(p) for p in parts)), parts
+
+def benchmarkBiome(work_dir, output_format, parts, args):
+    """
+    Time the local biome assignment (BiomeCache.assign) of each part against the synthetic biome polygons.
+    """
+    import geopandas as gpd
+    from shapely import wkt
+    from tasks.biome_cache import BiomeCache
+
+    names, geometries=zip(*generateBiomes(vertices=args.biome_vertices, seed=args.seed))
+    cache=BiomeCache(None, f"{work_dir}/cache")
+    cache.biomes=gpd.GeoDataFrame({"bioma":list(names)}, geometry=[wkt.loads(g) for g in geometries], crs="EPSG:4674")
+    # the spatial index is built once per process by BiomeCache.load, so it is not measured
+    cache.biomes.sindex
+
+    start=time.time()
+    for part in parts:
+        part.set_crs(crs="EPSG:4674", inplace=True, allow_override=True)
+        cache.assign(part)
+    seconds=time.time()-start
+    return _result("biome_assign", None, output_format, seconds, sum(len(p) for p in parts))
+
+def compare(results, previous_file):
+    """
+    Print the ratio between the time of each result and the time of the same benchmark in a previous report.
+    """
+    with open(previous_file, 'r') as f:
+        previous={(r["benchmark"], r["size"], r["format"]):r for r in json.load(f)["results"]}
+    print("\n{0:<14}{1:>10}  {2:<18}{3:>10}{4:>10}{5:>9}".format("benchmark", "size", "format", "before", "after", "ratio"))
+    for r in results:
+        before=previous.get((r["benchmark"], r["size"], r["format"]))
+        if before is None:
+            continue
+        ratio=r["seconds"]/before["seconds"] if before["seconds"] else float("nan")
+        print("{0:<14}{1:>10}  {2:<18}{3:>10.3f}{4:>10.3f}{5:>8.2f}x".format(r["benchmark"], r["size"], r["format"], before["seconds"], r["seconds"], ratio))
+
+def main():
+    parser=argparse.ArgumentParser(description="Benchmark the download and import against a local stub GeoServer.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="the numbers of synthetic focuses, comma separated")
+    parser.add_argument("--formats", default="SHAPE-ZIP,application/json", help="the output formats, comma separated")
+    parser.add_argument("--start-date", default="2024-08-01")
+    parser.add_argument("--end-date", default="2024-08-31")
+    parser.add_argument("--page-limit", type=int, default=10000, help="the CountDefault of the stub server")
+    parser.add_argument("--latency", type=float, default=0.0, help="the seconds before each response")
+    parser.add_argument("--bandwidth", type=int, default=0, help="the maximum bytes per second of each response, 0 is unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the share of GetFeature requests answered with HTTP 503")
+    parser.add_argument("--workers", type=int, default=4, help="the download_workers of the WFS client")
+    parser.add_argument("--paging-mode", default="offset", choices=["offset", "window", "keyset"])
+    parser.add_argument("--batch-size", type=int, default=0, help="read the parts in batches of this number of features, see IMPORT_BATCH_SIZE")
+    parser.add_argument("--biome-vertices", type=int, default=2000, help="the number of vertices of each synthetic biome")
+    parser.add_argument("--skip-biome", action="store_true", help="do not run the biome assignment benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="the JSON report. Default is data/benchmarks/benchmark_<date>.json")
+    parser.add_argument("--compare", default=None, help="a previous JSON report to compare with")
+    args=parser.parse_args()
+
+    # the configuration of the WFS client is read from the work directory, not from the docker paths
+    os.environ.pop("DOCKER_ENV", None)
+
+    results=[]
+    for size in [int(s) for s in args.sizes.split(",")]:
+        focuses=generateFocuses(size, start_date=args.start_date, end_date=args.end_date, seed=args.seed)
+        server=StubGeoServer(focuses, page_limit=args.page_limit, latency=args.latency,
+                             bandwidth=args.bandwidth, error_rate=args.error_rate).start()
+        try:
+            for output_format in args.formats.split(","):
+                work_dir=tempfile.mkdtemp(prefix="fires_benchmark_")
+                try:
+                    download, wfs, file_names=benchmarkDownload(server, work_dir, output_format, args)
+                    load, parts=benchmarkLoad(work_dir, output_format, file_names, batch_size=args.batch_size)
+                    load["size"]=size
+                    case=[download, load]
+                    if not args.skip_biome:
+                        biome=benchmarkBiome(work_dir, output_format, parts, args)
+                        biome["size"]=size
+                        case.append(biome)
+                    for r in case:
+                        print("{benchmark:<14}{size:>10}  {format:<18}{seconds:>10.3f}s {features_per_second:>12} features/s".format(**r))
+                    results.extend(case)
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+        finally:
+            server.stop()
+
+    data_dir=os.getenv("DATA_DIR", os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data')
+    output=args.output if args.output else "{0}/benchmarks/benchmark_{1}.json".format(data_dir, datetime.now().strftime('%Y%m%d%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report={
+        "created_at":datetime.now().isoformat(timespec="seconds"),
+        "environment":{"python":sys.version.split()[0], "platform":platform.platform(), "cpus":os.cpu_count()},
+        "parameters":vars(args),
+        "results":results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Benchmark report: {0}".format(output))
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__=="__main__":
+    main()
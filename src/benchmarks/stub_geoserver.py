@@ -0,0 +1,324 @@
+"""
+Stub GeoServer
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    A local WFS 2.0 server over a list of synthetic focuses, used by the benchmarks instead of the production service.
+
+    server=StubGeoServer(generateFocuses(10000), latency=0.05, bandwidth=10*1024*1024)
+    server.start()
+    ... use server.base_url as the geoserver_base_url and "geoserver" as the geoserver_base_path ...
+    server.stop()
+
+    It answers GetCapabilities, DescribeFeatureType and GetFeature, with resultType=hits or with pages of
+    SHAPE-ZIP, application/json or csv, filtered by the CQL filters written by the WFS client: the period
+    (between), the time window (>= and <), the keyset (sort attribute >) and the list of identifiers (IN).
+"""
+import io
+import re
+import json
+import time
+import random
+import struct
+import bisect
+import zipfile
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the attributes of the layer, as (name, DBF type, DBF size, DBF decimals)
+FIELDS=[
+    ("fid", "N", 10, 0),
+    ("foco_id", "C", 36, 0),
+    ("datahora", "C", 19, 0),
+    ("satelite", "C", 20, 0),
+    ("pais", "C", 20, 0),
+    ("estado", "C", 40, 0),
+    ("municipio", "C", 60, 0),
+    ("bioma", "C", 30, 0),
+    ("latitude", "N", 12, 5),
+    ("longitude", "N", 12, 5),
+]
+
+# the SIRGAS 2000 (EPSG:4674) projection file of each shapefile
+PRJ='GEOGCS["SIRGAS 2000",DATUM["Sistema_de_Referencia_Geocentrico_para_las_AmericaS_2000",SPHEROID["GRS 1980",6378137,298.257222101]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'
+
+def _toDatetime(value, end=False):
+    """
+    Parse a CQL date or timestamp literal. A date as the upper bound includes the whole day.
+    """
+    value=value.strip("'")
+    if len(value)==10:
+        day=datetime.strptime(value, '%Y-%m-%d')
+        return day + timedelta(days=1) - timedelta(seconds=1) if end else day
+    return datetime.fromisoformat(value.rstrip("Z"))
+
+def writeShapeZip(features, layer_name):
+    """
+    Write the features as a point shapefile inside a ZIP file, the same layout as the GeoServer SHAPE-ZIP output.
+    """
+    xs=[f["longitude"] for f in features] or [0.0]
+    ys=[f["latitude"] for f in features] or [0.0]
+    bbox=struct.pack("<4d", min(xs), min(ys), max(xs), max(ys))+struct.pack("<4d", 0, 0, 0, 0)
+
+    # each point record is the 8 bytes record header and 20 bytes of content, the lengths are 16-bit words
+    shp_length=(100+28*len(features))//2
+    shx_length=(100+8*len(features))//2
+    shp=io.BytesIO()
+    shx=io.BytesIO()
+    shp.write(struct.pack(">6iI", 9994, 0, 0, 0, 0, 0, shp_length)+struct.pack("<2i", 1000, 1)+bbox)
+    shx.write(struct.pack(">6iI", 9994, 0, 0, 0, 0, 0, shx_length)+struct.pack("<2i", 1000, 1)+bbox)
+    for number, f in enumerate(features, start=1):
+        shx.write(struct.pack(">2i", (100+28*(number-1))//2, 10))
+        shp.write(struct.pack(">2i", number, 10)+struct.pack("<i2d", 1, f["longitude"], f["latitude"]))
+
+    record_size=1+sum(field[2] for field in FIELDS)
+    header_size=32+32*len(FIELDS)+1
+    today=datetime.today()
+    dbf=io.BytesIO()
+    dbf.write(struct.pack("<4BIHH20x", 3, today.year-1900, today.month, today.day, len(features), header_size, record_size))
+    for name, kind, size, decimals in FIELDS:
+        dbf.write(name.encode("ascii").ljust(11, b"\x00")+kind.encode("ascii")+b"\x00"*4+bytes([size, decimals])+b"\x00"*14)
+    dbf.write(b"\x0d")
+    for f in features:
+        dbf.write(b" ")
+        for name, kind, size, decimals in FIELDS:
+            value=f[name]
+            if kind=="N":
+                dbf.write(("{0:.{1}f}".format(value, decimals) if decimals else str(value)).encode("ascii").rjust(size)[:size])
+            else:
+                value=value.strftime('%Y-%m-%dT%H:%M:%S') if isinstance(value, datetime) else str(value)
+                dbf.write(value.encode("utf-8")[:size].ljust(size))
+    dbf.write(b"\x1a")
+
+    output=io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"{layer_name}.shp", shp.getvalue())
+        zip_file.writestr(f"{layer_name}.shx", shx.getvalue())
+        zip_file.writestr(f"{layer_name}.dbf", dbf.getvalue())
+        zip_file.writestr(f"{layer_name}.prj", PRJ)
+        zip_file.writestr(f"{layer_name}.cpg", "UTF-8")
+    return output.getvalue()
+
+def writeGeoJSON(features, number_matched, properties=None):
+    """
+    Write the features as a GeoServer GeoJSON document, with numberReturned after the features array.
+    """
+    names=properties if properties else [field[0] for field in FIELDS]
+    items=[]
+    for f in features:
+        items.append({
+            "type":"Feature",
+            "id":"focos.{0}".format(f["fid"]),
+            "geometry":None if properties else {"type":"Point", "coordinates":[f["longitude"], f["latitude"]]},
+            "properties":{n:(f[n].strftime('%Y-%m-%dT%H:%M:%SZ') if isinstance(f[n], datetime) else f[n]) for n in names}
+        })
+    document={"type":"FeatureCollection", "features":items, "totalFeatures":number_matched,
+              "numberMatched":number_matched, "numberReturned":len(items),
+              "crs":{"type":"name", "properties":{"name":"urn:ogc:def:crs:EPSG::4674"}}}
+    return json.dumps(document).encode("utf-8")
+
+def writeCSV(features):
+    """
+    Write the features as the GeoServer CSV output, with the geometry as WKT.
+    """
+    lines=["FID,{0},the_geom".format(",".join(field[0] for field in FIELDS))]
+    for f in features:
+        values=[(f[n].strftime('%Y-%m-%dT%H:%M:%S') if isinstance(f[n], datetime) else str(f[n])) for n,_,_,_ in FIELDS]
+        lines.append("focos.{0},{1},POINT ({2} {3})".format(f["fid"], ",".join(values), f["longitude"], f["latitude"]))
+    return ("\n".join(lines)+"\n").encode("utf-8")
+
+"""
+    The stub WFS server. It runs in a background thread and serves the focuses sorted by fid.
+
+    The network is simulated by a fixed latency before each response, a maximum bandwidth of each
+    response, and an optional rate of responses with HTTP 503, to exercise the retries of the client.
+"""
+class StubGeoServer:
+
+    def __init__(self, focuses, layer_name="focos", page_limit=10000, latency=0.0, bandwidth=0, error_rate=0.0, port=0):
+        """
+        Constructor
+
+            - focuses, the list of focuses, see synthetic_data.generateFocuses.
+            - layer_name, the layer name of the capabilities and of the files inside the SHAPE-ZIP.
+            - page_limit, the CountDefault of the capabilities, the maximum number of features of one page.
+            - latency, the time in seconds before each response.
+            - bandwidth, the maximum bytes per second of each response, 0 is unlimited.
+            - error_rate, the share of GetFeature requests answered with HTTP 503.
+            - port, the local port, 0 chooses a free one.
+        """
+        self.focuses=sorted(focuses, key=lambda f: f["fid"])
+        self.layer_name=layer_name
+        self.page_limit=page_limit
+        self.latency=latency
+        self.bandwidth=bandwidth
+        self.error_rate=error_rate
+        self.port=port
+
+        # the focuses sorted by datahora, to find the focuses of a period without a full scan
+        self.__by_time=sorted(range(len(self.focuses)), key=lambda i: self.focuses[i]["datahora"])
+        self.__times=[self.focuses[i]["datahora"] for i in self.__by_time]
+        self.__fids=[f["fid"] for f in self.focuses]
+        # the filtered and sorted result of the last filters, reused by the next pages of the same filter
+        self.__results={}
+        self.__lock=threading.Lock()
+        self.stats={"requests":0, "bytes":0, "errors":0}
+        self.__server=None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{0}".format(self.port)
+
+    def __select(self, cql):
+        """
+        Return the positions of the focuses that match the CQL filter, sorted by fid, and the keyset lower bound.
+        """
+        after=None
+        match=re.search(r"\bfid > (\S+)", cql)
+        if match:
+            after=float(match.group(1).strip("'"))
+            cql=cql.replace(match.group(0), "")
+
+        with self.__lock:
+            result=self.__results.get(cql)
+        if result is None:
+            start, end=datetime.min, datetime.max
+            match=re.search(r"datahora between (\S+) AND (\S+)", cql)
+            if match:
+                start, end=_toDatetime(match.group(1)), _toDatetime(match.group(2), end=True)
+            match=re.search(r"datahora >= ([^\s)]+)", cql)
+            window_start=_toDatetime(match.group(1)) if match else datetime.min
+            match=re.search(r"datahora < ([^\s)]+)", cql)
+            window_end=_toDatetime(match.group(1)) if match else datetime.max
+
+            first=bisect.bisect_left(self.__times, max(start, window_start))
+            last=bisect.bisect_right(self.__times, end)
+            result=[i for i in self.__by_time[first:last] if self.focuses[i]["datahora"]<window_end]
+
+            match=re.search(r"foco_id IN \((.*?)\)", cql)
+            if match:
+                ids=set(v.strip().strip("'") for v in match.group(1).split(","))
+                result=[i for i in result if self.focuses[i]["foco_id"] in ids]
+            result.sort()
+            with self.__lock:
+                self.__results[cql]=result
+
+        if after is not None:
+            # the positions are in fid order, so the keyset is a binary search
+            result=result[self.__searchAfter(result, after):]
+        return result
+
+    def __searchAfter(self, result, after):
+        low, high=0, len(result)
+        while low<high:
+            middle=(low+high)//2
+            if self.__fids[result[middle]]<=after:
+                low=middle+1
+            else:
+                high=middle
+        return low
+
+    def __capabilities(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:ows="http://www.opengis.net/ows/1.1">'
+                '<ows:OperationsMetadata><ows:Operation name="GetFeature">'
+                '<ows:Constraint name="CountDefault"><ows:NoValues/><ows:DefaultValue>{0}</ows:DefaultValue></ows:Constraint>'
+                '</ows:Operation></ows:OperationsMetadata></wfs:WFS_Capabilities>').format(self.page_limit).encode("utf-8")
+
+    def __describe(self):
+        elements="".join('<xsd:element name="{0}" nillable="true" type="xsd:string"/>'.format(field[0]) for field in FIELDS)
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"><xsd:complexType name="{0}Type">'
+                '<xsd:complexContent><xsd:extension base="gml:AbstractFeatureType"><xsd:sequence>'
+                '<xsd:element name="geom" nillable="true" type="gml:PointPropertyType"/>{1}'
+                '</xsd:sequence></xsd:extension></xsd:complexContent></xsd:complexType></xsd:schema>').format(self.layer_name, elements).encode("utf-8")
+
+    def __hits(self, number_matched):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" numberMatched="{0}" numberReturned="0" timeStamp="{1}"/>'
+                ).format(number_matched, datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')).encode("utf-8")
+
+    def handle(self, query):
+        """
+        Answer one WFS request. Return the HTTP status, the content type and the body.
+        """
+        params={k.lower():v for k,v in parse_qsl(query, keep_blank_values=True)}
+        request=params.get("request", "").lower()
+        if request=="getcapabilities":
+            return 200, "text/xml", self.__capabilities()
+        if request=="describefeaturetype":
+            return 200, "text/xml", self.__describe()
+        if request!="getfeature":
+            return 400, "text/plain", b"Unsupported request"
+
+        if self.error_rate and random.random()<self.error_rate:
+            with self.__lock:
+                self.stats["errors"]+=1
+            return 503, "text/plain", b"Service Unavailable"
+
+        result=self.__select(params.get("cql_filter", ""))
+        if params.get("resulttype", "").lower()=="hits":
+            return 200, "text/xml", self.__hits(len(result))
+
+        start=int(params.get("startindex", 0))
+        count=min(int(params.get("count", self.page_limit)), self.page_limit)
+        features=[self.focuses[i] for i in result[start:start+count]]
+        output_format=params.get("outputformat", "SHAPE-ZIP").lower()
+        if output_format=="shape-zip":
+            return 200, "application/zip", writeShapeZip(features, self.layer_name)
+        if output_format=="application/json":
+            properties=params.get("propertyname")
+            return 200, "application/json", writeGeoJSON(features, len(result), properties.split(",") if properties else None)
+        if output_format=="csv":
+            return 200, "text/csv", writeCSV(features)
+        return 400, "text/plain", b"Unsupported output format"
+
+    def countResponse(self, size):
+        with self.__lock:
+            self.stats["requests"]+=1
+            self.stats["bytes"]+=size
+
+    def start(self):
+        """
+        Start the server in a background thread.
+        """
+        stub=self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version="HTTP/1.1"
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, content_type, body=stub.handle(urlsplit(self.path).query)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                # send the body in pieces, waiting so each response is not faster than the bandwidth
+                piece=64*1024
+                for start in range(0, len(body), piece):
+                    self.wfile.write(body[start:start+piece])
+                    if stub.bandwidth:
+                        time.sleep(min(piece, len(body)-start)/float(stub.bandwidth))
+                stub.countResponse(len(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server=ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.__server.daemon_threads=True
+        self.port=self.__server.server_address[1]
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server=None
+
+# end of class
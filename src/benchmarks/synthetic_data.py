@@ -0,0 +1,116 @@
+"""
+Synthetic fire focuses
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used by the benchmarks to generate fire focuses and biome polygons with a realistic distribution over Brazil,
+    without reading the production service.
+
+    focuses=generateFocuses(100000, start_date="2024-08-01", end_date="2024-08-10", seed=1)
+"""
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+
+# the bounding box of Brazil, as (min longitude, min latitude, max longitude, max latitude)
+BRAZIL_BBOX=(-73.99, -33.75, -34.79, 5.27)
+
+# the fire hotspots, as (longitude, latitude, standard deviation in degrees, weight, state, biome)
+# most focuses are on the arc of deforestation and on the Cerrado, as in the dry season series
+HOTSPOTS=[
+    (-52.0, -6.5, 2.0, 0.20, "PARÁ", "Amazônia"),
+    (-55.5, -11.5, 2.5, 0.20, "MATO GROSSO", "Amazônia"),
+    (-63.0, -10.0, 1.8, 0.10, "RONDÔNIA", "Amazônia"),
+    (-67.5, -9.0, 1.5, 0.05, "ACRE", "Amazônia"),
+    (-45.5, -5.5, 1.8, 0.10, "MARANHÃO", "Cerrado"),
+    (-48.0, -10.5, 1.8, 0.10, "TOCANTINS", "Cerrado"),
+    (-44.5, -12.0, 2.0, 0.07, "BAHIA", "Cerrado"),
+    (-43.0, -8.0, 1.5, 0.05, "PIAUÍ", "Caatinga"),
+    (-57.0, -19.0, 1.2, 0.05, "MATO GROSSO DO SUL", "Pantanal"),
+]
+# the share of focuses spread over the whole bounding box
+BACKGROUND_WEIGHT=0.08
+
+# the satellites of the reference series and of the other sensors
+SATELLITES=["AQUA_M-T", "AQUA_M-T", "AQUA_M-T", "NOAA-20", "NPP-375", "GOES-16"]
+
+def _hour():
+    # most detections are in the early afternoon overpass, the rest is spread over the day
+    if random.random()<0.8:
+        return min(max(random.gauss(17.5, 1.0), 0.0), 23.99)
+    return random.uniform(0.0, 23.99)
+
+def generateFocuses(size, start_date="2024-08-01", end_date="2024-08-31", seed=None):
+    """
+    Return a list of focuses, sorted by fid, as dictionaries with the attributes of the focos layer.
+
+        - size, the number of focuses.
+        - start_date, end_date, the period of the datahora attribute, as YYYY-MM-DD.
+        - seed, optional - the seed of the random generator, so two runs generate the same data.
+    """
+    random.seed(seed)
+    start=datetime.strptime(start_date,'%Y-%m-%d')
+    days=(datetime.strptime(end_date,'%Y-%m-%d')-start).days+1
+    # the dry season grows along the period, so the last days have more focuses
+    day_weights=[1.0+2.0*d/max(days-1,1) for d in range(days)]
+    weights=[h[3] for h in HOTSPOTS]+[BACKGROUND_WEIGHT]
+
+    focuses=[]
+    for fid in range(1, size+1):
+        hotspot=random.choices(range(len(weights)), weights=weights)[0]
+        if hotspot<len(HOTSPOTS):
+            lon, lat, sd, weight, state, biome=HOTSPOTS[hotspot]
+            lon=random.gauss(lon, sd)
+            lat=random.gauss(lat, sd)
+        else:
+            state, biome=None, None
+            lon=random.uniform(BRAZIL_BBOX[0], BRAZIL_BBOX[2])
+            lat=random.uniform(BRAZIL_BBOX[1], BRAZIL_BBOX[3])
+        lon=min(max(lon, BRAZIL_BBOX[0]), BRAZIL_BBOX[2])
+        lat=min(max(lat, BRAZIL_BBOX[1]), BRAZIL_BBOX[3])
+
+        day=random.choices(range(days), weights=day_weights)[0]
+        datahora=start + timedelta(days=day, hours=_hour())
+        focuses.append({
+            "fid":fid,
+            "foco_id":str(uuid.UUID(int=random.getrandbits(128))),
+            "datahora":datahora.replace(microsecond=0),
+            "satelite":random.choice(SATELLITES),
+            "pais":"Brasil",
+            "estado":state or "",
+            "municipio":"MUNICIPIO {0}".format(random.randint(1, 5570)),
+            "bioma":biome or "",
+            "latitude":round(lat, 5),
+            "longitude":round(lon, 5),
+        })
+    return focuses
+
+def generateBiomes(columns=6, vertices=2000, seed=None):
+    """
+    Return the synthetic biome polygons as a list of (name, WKT) tuples.
+
+    The bounding box of Brazil is split into vertical strips with jagged borders, so each polygon has about
+    the given number of vertices and the point in polygon tests cost about the same as with the real biome borders.
+    """
+    random.seed(seed)
+    min_lon, min_lat, max_lon, max_lat=BRAZIL_BBOX
+    width=(max_lon-min_lon)/columns
+    steps=max(vertices//2, 2)
+    lats=[min_lat+(max_lat-min_lat)*i/steps for i in range(steps+1)]
+
+    # the shared borders between the strips, so the polygons do not overlap and do not leave gaps
+    borders=[[(min_lon, lat) for lat in lats]]
+    for column in range(1, columns):
+        base=min_lon+width*column
+        borders.append([(base+0.3*width*math.sin(lat*3.0)+random.uniform(-0.05, 0.05)*width, lat) for lat in lats])
+    borders.append([(max_lon, lat) for lat in lats])
+
+    names=["Amazônia", "Cerrado", "Caatinga", "Mata Atlântica", "Pantanal", "Pampa"]
+    biomes=[]
+    for column in range(columns):
+        ring=borders[column]+list(reversed(borders[column+1]))+[borders[column][0]]
+        wkt="POLYGON(({0}))".format(", ".join("{0} {1}".format(x, y) for x, y in ring))
+        biomes.append((names[column % len(names)], wkt))
+    return biomes
@@ -1,61 +1,156 @@
 import sys
-from airflow.operators.python import PythonVirtualenvOperator
+from airflow.operators.python import PythonVirtualenvOperator, ExternalPythonOperator
 from airflow.operators.email import EmailOperator
 
+# the exit code of the pre-check task when there is nothing to download, the task is marked as skipped
+SKIP_EXIT_CODE = 99
 
 class BaseDagOperators:
 
-    def __init__(self, venv_path, project_dir):
+    def __init__(self, venv_path, project_dir, python_path=None):
+        """
+        - venv_path, the cache directory of the virtual environments built by the PythonVirtualenvOperator.
+        - project_dir, the directory of the task modules.
+        - python_path, optional - the python binary of a prebuilt, persistent environment with the requirements.
+          If it is defined, the tasks run in that interpreter with the ExternalPythonOperator and no
+          virtual environment is built or checked on each run.
+        """
         self.project_dir = project_dir
         self.venv_path = venv_path
+        self.python_path = python_path
         self.requirements = [
             "requests",
             "psycopg2-binary",
             "geopandas==0.13.2",
             "fiona==1.9.6",
-            "geoalchemy2",
+            "pyarrow",
         ]
 
-    def update_current_task_operator(self):
+    def __python_operator(self, task_id, python_callable, **kwargs):
+        """Run the callable in the persistent environment if it is defined, or in a cached virtual environment."""
 
-        def fnc_operator(project_dir):
-            sys.path.append(project_dir)
-            from tasks.update_database import UpdateDatabase
-
-            try:
-                aTask = UpdateDatabase()
-                aTask.updateCurrentData()
-            except Exception:
-                raise Exception("updateLastData was failure")
+        if self.python_path:
+            return ExternalPythonOperator(
+                task_id=task_id,
+                python=self.python_path,
+                python_callable=python_callable,
+                op_args=[f"{self.project_dir}"],
+                **kwargs,
+            )
 
         return PythonVirtualenvOperator(
-            task_id="update_current_data_task",
+            task_id=task_id,
             requirements=self.requirements,
             venv_cache_path=f"{self.venv_path}",
-            python_callable=fnc_operator,
+            python_callable=python_callable,
             provide_context=True,
             op_args=[f"{self.project_dir}"],
+            **kwargs,
         )
 
-    def update_last_task_operator(self):
+    def __python_operator_mapped(self, task_id, python_callable, expand_kwargs, **kwargs):
+        """Map the callable over a list of keyword arguments, one task instance for each item."""
+
+        if self.python_path:
+            return ExternalPythonOperator.partial(
+                task_id=task_id,
+                python=self.python_path,
+                python_callable=python_callable,
+                op_args=[f"{self.project_dir}"],
+                **kwargs,
+            ).expand(op_kwargs=expand_kwargs)
+
+        return PythonVirtualenvOperator.partial(
+            task_id=task_id,
+            requirements=self.requirements,
+            venv_cache_path=f"{self.venv_path}",
+            python_callable=python_callable,
+            op_args=[f"{self.project_dir}"],
+            **kwargs,
+        ).expand(op_kwargs=expand_kwargs)
+
+    def check_new_data_task_operator(self):
+        """
+        A cheap task that only reads the last imported date. It is skipped when the data is up to date,
+        so the plan task is skipped too, without requests to the WFS or loading the geographic libraries.
+        """
 
         def fnc_operator(project_dir):
+            import sys
             sys.path.append(project_dir)
-            from tasks.update_database import UpdateDatabase
+            from tasks.download_data import DownloadData
 
-            try:
-                aTask = UpdateDatabase()
-                aTask.updateLastData()
-            except Exception:
-                raise Exception("updateLastData was failure")
+            if DownloadData().isUpToDate():
+                print("Nothing to download, the data is up to date.")
+                sys.exit(99)
 
-        return PythonVirtualenvOperator(
-            task_id="update_last_data_task",
-            requirements=self.requirements,
-            venv_cache_path=f"{self.venv_path}",
+        return self.__python_operator(
+            task_id="check_new_data_task",
             python_callable=fnc_operator,
-            provide_context=True,
-            op_args=[f"{self.project_dir}"],
+            skip_on_exit_code=SKIP_EXIT_CODE,
+        )
+
+    def plan_task_operator(self):
+        """
+        Plan the chunks of the run, the new days and the periods to reload, with the number of focuses of each one.
+        The returned list is the input of the mapped staging tasks, see ChunkPlan.
+        """
+
+        def fnc_operator(project_dir):
+            import sys
+            sys.path.append(project_dir)
+            from tasks.chunk_plan import ChunkPlan
+
+            return ChunkPlan().getPlan()
+
+        return self.__python_operator(
+            task_id="plan_task",
+            python_callable=fnc_operator,
+        )
+
+    def stage_chunk_task_operator(self, plan, max_active_tasks=4):
+        """
+        One task for each planned chunk, it downloads the chunk and commits it to its own staging table.
+
+        - plan, the output of the plan task.
+        - max_active_tasks, the maximum number of chunks downloaded at once, to bound the load on the WFS.
+        """
+
+        def fnc_operator(project_dir, chunk):
+            import sys
+            sys.path.append(project_dir)
+            from tasks.chunk_plan import ChunkPlan
+
+            return ChunkPlan().stageChunk(chunk)
+
+        return self.__python_operator_mapped(
+            task_id="stage_chunk_task",
+            python_callable=fnc_operator,
+            expand_kwargs=plan,
+            max_active_tis_per_dag=max_active_tasks,
+        )
+
+    def merge_chunks_task_operator(self, plan):
+        """
+        The barrier task, it merges the staged chunks into the final table once every staging task succeeded.
+
+        - plan, the output of the plan task. It must run after the staging tasks.
+        """
+
+        def fnc_operator(project_dir, plan):
+            import sys
+            sys.path.append(project_dir)
+            from tasks.chunk_plan import ChunkPlan
+
+            # the plan is None when the plan task was skipped by the pre-check
+            ChunkPlan().mergeChunks([item["chunk"] for item in plan or []])
+
+        # also runs when there is nothing to stage, to drop the staging tables of a failed run
+        return self.__python_operator(
+            task_id="merge_chunks_task",
+            python_callable=fnc_operator,
+            op_kwargs={"plan": plan},
+            trigger_rule="none_failed",
         )
 
     def email_operator(self, updated_date, email_to: list):
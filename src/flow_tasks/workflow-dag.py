@@ -25,6 +25,10 @@ if not EMAIL_TO:
 
 DAG_KEY = "active_fires_update"
 venv_path = f"/opt/airflow/venv/inpe/{DAG_KEY}"
+# optional, the python binary of a prebuilt environment with the requirements, used instead of the virtualenv
+python_path = Variable.get("ACTIVE_FIRES_PYTHON", default_var=None)
+# the maximum number of chunks staged at once, across the workers
+max_chunk_tasks = int(Variable.get("ACTIVE_FIRES_MAX_CHUNK_TASKS", default_var=4))
 
 EMAIL_TO = str(EMAIL_TO).split(",")
 # Default arguments for all tasks. Precedence is the value at task instantiation.
@@ -48,9 +52,13 @@ with DAG(
     default_args=task_default_args,
 ) as dag:
 
-    baseDag = BaseDagOperators(venv_path=venv_path, project_dir=project_dir)
+    baseDag = BaseDagOperators(venv_path=venv_path, project_dir=project_dir, python_path=python_path)
 
-    update_current_task = baseDag.update_current_task_operator()
-    update_last_task = baseDag.update_last_task_operator()
+    # skipped when the data is up to date, so no request is sent to the WFS
+    check_new_data_task = baseDag.check_new_data_task_operator()
+    # the work is planned up front and each chunk is staged by its own mapped task, on any worker
+    plan_task = baseDag.plan_task_operator()
+    stage_chunk_task = baseDag.stage_chunk_task_operator(plan_task.output, max_active_tasks=max_chunk_tasks)
+    merge_chunks_task = baseDag.merge_chunks_task_operator(plan_task.output)
     email_operator = baseDag.email_operator(datetime.today().strftime("%Y-%m-%d"), email_to=EMAIL_TO)
-    update_current_task >> update_last_task >> email_operator
+    check_new_data_task >> plan_task >> stage_chunk_task >> merge_chunks_task >> email_operator
@@ -0,0 +1,148 @@
+"""
+Historical backfill
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to reload a long date range, split into day or week chunks that are imported by a pool of processes.
+
+    python3 -m tasks.backfill 2023-01-01 2023-12-31 --chunk week --workers 4
+
+    Each imported chunk is checkpointed as one row of the acquisition_data_control table with
+    origin_data='backfill', so an interrupted backfill resumes from the chunks not imported yet.
+"""
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from tasks.psqldb import PsqlDB
+
+# the DownloadData and ImportData of each worker process, created once by the pool initializer
+_worker={}
+
+def _initWorker(output_table, slots):
+    # imported here, so only the worker processes load the import dependencies
+    from tasks.download_data import DownloadData
+    from tasks.import_data import ImportData
+
+    # each worker stages its chunk into its own table, reused by the next backfill runs
+    slot=slots.get()
+    _worker["down"]=DownloadData()
+    _worker["import_data"]=ImportData(tmp_output_table=f"focuses_backfill_{slot}", output_table=output_table)
+
+def _runChunk(start_date, end_date):
+    """
+    Download and import one chunk in the worker process. Return the number of rows.
+    """
+    from tasks.import_pipeline import ImportPipeline
+
+    down=_worker["down"]
+    down.setPeriod(start_date=start_date, end_date=end_date)
+    return ImportPipeline(down, _worker["import_data"]).run(period=(start_date, end_date), origin=Backfill.ORIGIN)
+
+"""
+    The Backfill splits a date range into chunks and imports them in parallel.
+
+    Each worker process has its own WFS client, database connection and staging table.
+"""
+class Backfill:
+
+    ORIGIN="backfill"
+
+    def __init__(self, start_date, end_date, chunk="week", workers=None, output_table="focos_aqua_referencia"):
+        """
+        Constructor
+
+            - start_date, end_date, the first and last day of the range, as YYYY-MM-DD.
+            - chunk, the size of each chunk, day or week.
+            - workers, optional - the number of worker processes. Default is the BACKFILL_WORKERS env var or 2.
+            - output_table, the final table of focuses.
+        """
+        if chunk not in ("day", "week"):
+            raise Exception("Unsupported chunk size: {0}".format(chunk))
+        self.START_DATE=datetime.strptime(str(start_date),'%Y-%m-%d').date()
+        self.END_DATE=datetime.strptime(str(end_date),'%Y-%m-%d').date()
+        if self.START_DATE>self.END_DATE:
+            raise Exception("The start date {0} is after the end date {1}.".format(start_date, end_date))
+        self.CHUNK_DAYS=1 if chunk=="day" else 7
+        self.WORKERS=int(workers if workers else os.getenv("BACKFILL_WORKERS", 2))
+        self.output_table=output_table
+
+        db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
+        self.db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
+
+    def getChunks(self):
+        """
+        The list of (start_date, end_date) chunks of the range. The last chunk ends on the end date.
+        """
+        chunks=[]
+        start=self.START_DATE
+        while start<=self.END_DATE:
+            end=min(start + timedelta(days=self.CHUNK_DAYS-1), self.END_DATE)
+            chunks.append((start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+            start=end + timedelta(days=1)
+        return chunks
+
+    def __getCheckpoints(self):
+        """
+        The chunks already imported by a previous backfill, read from the acquisition_data_control table.
+        """
+        checkpoints="SELECT start_date, end_date FROM public.acquisition_data_control "
+        checkpoints=f"{checkpoints} WHERE origin_data='{self.ORIGIN}' AND NOT reloaded "
+        checkpoints=f"{checkpoints} AND start_date>='{self.START_DATE}'::date AND end_date<='{self.END_DATE}'::date"
+        self.db.connect()
+        try:
+            rows=self.db.fetchData(checkpoints)
+        finally:
+            self.db.close()
+        return set((row[0].strftime('%Y-%m-%d'), row[1].strftime('%Y-%m-%d')) for row in rows)
+
+    def run(self):
+        """
+        Import the chunks that have no checkpoint. Raise an exception at the end if any chunk failed,
+        the failed chunks are imported again by the next run.
+        """
+        chunks=self.getChunks()
+        done=self.__getCheckpoints()
+        pending=[c for c in chunks if c not in done]
+        print("Backfill from {0} to {1}: {2} chunks, {3} already imported.".format(
+            self.START_DATE, self.END_DATE, len(chunks), len(chunks)-len(pending)))
+        if not pending:
+            return 0
+
+        rows, failed=0, []
+        # spawn, so the workers never inherit the database connections of this process
+        context=multiprocessing.get_context("spawn")
+        slots=context.Manager().Queue()
+        for slot in range(self.WORKERS):
+            slots.put(slot)
+        with ProcessPoolExecutor(max_workers=self.WORKERS, mp_context=context,
+                                 initializer=_initWorker, initargs=(self.output_table, slots)) as executor:
+            futures={executor.submit(_runChunk, start, end):(start, end) for start, end in pending}
+            for future in as_completed(futures):
+                start, end=futures[future]
+                try:
+                    chunk_rows=future.result()
+                    rows+=chunk_rows
+                    print("Chunk {0} to {1} imported: {2} rows.".format(start, end, chunk_rows))
+                except Exception as e:
+                    failed.append((start, end))
+                    print('Error on backfill the chunk {0} to {1}'.format(start, end))
+                    print(e.__str__())
+
+        print("Backfill finished: {0} rows, {1} of {2} chunks failed.".format(rows, len(failed), len(pending)))
+        if failed:
+            raise Exception("The backfill has failed for {0} chunks, run it again to resume.".format(len(failed)))
+        return rows
+
+# end of class
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Reload the fire focuses of a date range.")
+    parser.add_argument("start_date", help="the first day of the range, YYYY-MM-DD")
+    parser.add_argument("end_date", help="the last day of the range, YYYY-MM-DD")
+    parser.add_argument("--chunk", choices=["day", "week"], default="week")
+    parser.add_argument("--workers", type=int, default=None)
+    args=parser.parse_args()
+    Backfill(args.start_date, args.end_date, chunk=args.chunk, workers=args.workers).run()
@@ -0,0 +1,99 @@
+"""
+Biome cache
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to assign the biome to the fire focuses on the client side, using a local copy of the biome table.
+"""
+import os
+from glob import glob
+import pandas as pd
+import geopandas as gpd
+
+def getBiomeChecksum(db, biome_table="lm_bioma_250"):
+    """
+    A checksum of the biome table. It changes when any geometry or biome name changes.
+    """
+    checksum=f"SELECT md5(string_agg(id::text||':'||coalesce(bioma,'')||':'||md5(ST_AsEWKB(geom)), ',' ORDER BY id))"
+    checksum=f"{checksum} FROM public.{biome_table};"
+    row=db.fetchData(checksum)
+    return row[0][0] if row and row[0][0] else "empty"
+
+"""
+    Local cache of the biome table, keyed by a checksum of the table content.
+
+    The polygons are read from the database only when the checksum changes, and the
+    spatial index (STRtree) is built once per process.
+"""
+class BiomeCache:
+
+    def __init__(self, db, cache_dir, biome_table="lm_bioma_250"):
+        """
+        Constructor
+
+            - db, a connected PsqlDB instance.
+            - cache_dir, the directory where the cache files are written.
+            - biome_table, the name of the biome table in the public schema.
+        """
+        self.db=db
+        self.cache_dir=cache_dir
+        self.biome_table=biome_table
+        self.biomes=None
+
+    def __read_from_database(self):
+        query=f"SELECT bioma, ST_SRID(geom), ST_AsBinary(geom) FROM public.{self.biome_table}"
+        names, geometries, srid=[], [], None
+        # read through a server-side cursor, so only one batch of raw rows is in memory with the parsed polygons
+        for rows in self.db.fetchBatches(query, batch_size=1000):
+            for row in rows:
+                names.append(row[0])
+                srid=row[1]
+                geometries.append(bytes(row[2]))
+        geometry=gpd.GeoSeries.from_wkb(geometries, crs=f"EPSG:{srid}" if srid else None)
+        return gpd.GeoDataFrame({"bioma":names}, geometry=geometry)
+
+    def load(self):
+        """
+        Load the biome polygons from the cache file, rebuilding it if the biome table has changed.
+        """
+        checksum=getBiomeChecksum(self.db, self.biome_table)
+        cache_file=f"{self.cache_dir}{os.sep}{self.biome_table}_{checksum}.pkl"
+
+        if os.path.isfile(cache_file):
+            try:
+                self.biomes=pd.read_pickle(cache_file)
+            except Exception as e:
+                print('Ignoring an unreadable biome cache file')
+                print(e.__str__())
+                self.biomes=None
+
+        if self.biomes is None:
+            self.biomes=self.__read_from_database()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # drop the cache files of previous versions of the biome table
+            for old_file in glob(f"{self.cache_dir}{os.sep}{self.biome_table}_*.pkl"):
+                os.remove(old_file)
+            self.biomes.to_pickle(cache_file)
+
+        # build the STRtree now, so it is shared by every assignment
+        self.biomes.sindex
+
+    def assign(self, data, column="bioma_nb"):
+        """
+        Set the biome column of the data with one vectorized spatial join against the cached polygons.
+        """
+        if self.biomes is None:
+            self.load()
+
+        biomes=self.biomes
+        if data.crs is not None and biomes.crs is not None and data.crs!=biomes.crs:
+            biomes=biomes.to_crs(data.crs)
+
+        points=data[[data.geometry.name]]
+        joined=gpd.sjoin(points, biomes, how="left", predicate="covered_by")
+        # a point on the border of two biomes is covered by both, only one of them is kept
+        joined=joined[~joined.index.duplicated(keep="first")]
+        data[column]=joined["bioma"].reindex(data.index)
+
+# end of class
@@ -0,0 +1,75 @@
+"""
+Biome index
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to keep a subdivided and indexed copy of the biome table, so the biome of each focus
+    can be resolved by an indexed lookup inside the database.
+"""
+from tasks.biome_cache import getBiomeChecksum
+
+"""
+    Subdivided copy of the biome table with a GiST index.
+
+    The large biome polygons are split by ST_Subdivide into small pieces, so each point-in-polygon
+    test touches only a few vertices. The copy is rebuilt when the checksum of the biome table,
+    stored as the comment of the subdivided table, does not match.
+"""
+class BiomeIndex:
+
+    def __init__(self, db, biome_table="lm_bioma_250", max_vertices=256):
+        """
+        Constructor
+
+            - db, a connected PsqlDB instance.
+            - biome_table, the name of the biome table in the public schema.
+            - max_vertices, the maximum number of vertices of each subdivided piece.
+        """
+        self.db=db
+        self.biome_table=biome_table
+        self.index_table=f"{biome_table}_subdivided"
+        self.max_vertices=max_vertices
+        self.__prepared=False
+
+    def prepare(self):
+        """
+        Build the subdivided table if it is missing or older than the biome table.
+        """
+        if self.__prepared:
+            return
+
+        try:
+            # serialize the rebuild between concurrent imports
+            self.db.execQuery(f"SELECT pg_advisory_xact_lock(hashtext('public.{self.index_table}'));")
+
+            checksum=getBiomeChecksum(self.db, self.biome_table)
+            row=self.db.fetchData(f"SELECT obj_description(to_regclass('public.{self.index_table}'), 'pg_class');")
+            if not row or row[0][0]!=checksum:
+                print("Rebuilding the subdivided biome table: public.{0}".format(self.index_table))
+                self.db.execQuery(f"DROP TABLE IF EXISTS public.{self.index_table};")
+
+                create=f"CREATE TABLE public.{self.index_table} AS "
+                create=f"{create} SELECT id AS biome_id, bioma, ST_Subdivide(geom, {self.max_vertices}) AS geom "
+                create=f"{create} FROM public.{self.biome_table};"
+                self.db.execQuery(create)
+                self.db.execQuery(f"CREATE INDEX {self.index_table}_geom_idx ON public.{self.index_table} USING gist (geom);")
+                self.db.execQuery(f"ANALYZE public.{self.index_table};")
+                self.db.execQuery(f"COMMENT ON TABLE public.{self.index_table} IS '{checksum}';")
+
+            self.db.commit()
+            self.__prepared=True
+        except Exception as e:
+            print('Error on prepare the subdivided biome table')
+            print(e.__str__())
+            raise e
+
+    def getLateralJoin(self, geometry_column, alias="b"):
+        """
+        The LATERAL join that resolves the biome of each row by the indexed table. The biome is in the "{alias}.bioma" column.
+        """
+        lateral=f"LEFT JOIN LATERAL (SELECT s.bioma FROM public.{self.index_table} s "
+        lateral=f"{lateral} WHERE ST_CoveredBy({geometry_column}, s.geom) LIMIT 1) {alias} ON true"
+        return lateral
+
+# end of class
@@ -0,0 +1,174 @@
+"""
+Chunk plan
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used by the Airflow DAG to split the daily work into chunks, staged in parallel by mapped tasks and
+    merged by one barrier task.
+
+    plan=ChunkPlan().getPlan()
+    for item in plan:
+        ChunkPlan().stageChunk(item["chunk"])
+    ChunkPlan().mergeChunks([item["chunk"] for item in plan])
+
+    Each chunk is a dictionary with the period, the control row to reload, if any, the number of focuses
+    counted by the WFS and the name of its staging table, so it can be sent to other workers as a task argument.
+"""
+import os
+import math
+from datetime import timedelta
+from tasks.psqldb import PsqlDB
+from tasks.metrics import resetRunMetrics
+
+"""
+    The plan, the staging and the merge of the chunks of one run.
+
+    The new days, from the day after the last imported period to yesterday, are split into chunks of
+    chunk_days days. Each period that the DataChecker finds incomplete is one more chunk, downloaded again in full.
+    The chunks are staged into their own staging tables, public.focuses_chunk_<key>, so they can be downloaded
+    and loaded by many workers at once, and only the merge writes to the final table.
+"""
+class ChunkPlan:
+
+    ORIGIN="dag"
+    STAGING_PREFIX="focuses_chunk_"
+
+    def __init__(self, chunk_days=None, max_chunks=None):
+        """
+        Constructor
+
+            - chunk_days, optional - the number of days of each chunk of new days. Default is the PLAN_CHUNK_DAYS env var or 1.
+            - max_chunks, optional - the maximum number of chunks of new days. If a catch-up has more chunks,
+              the chunks are made longer. Default is the PLAN_MAX_CHUNKS env var or 64.
+        """
+        self.CHUNK_DAYS=int(chunk_days if chunk_days else os.getenv("PLAN_CHUNK_DAYS", 1))
+        self.MAX_CHUNKS=int(max_chunks if max_chunks else os.getenv("PLAN_MAX_CHUNKS", 64))
+
+    def __getChunk(self, start_date, end_date, hits, reloaded_id=None):
+        key="{0}_{1}".format(str(start_date).replace("-", ""), str(end_date).replace("-", ""))
+        if reloaded_id is not None:
+            key="{0}_r{1}".format(key, reloaded_id)
+        return {
+            "key":key,
+            "start_date":str(start_date),
+            "end_date":str(end_date),
+            "reloaded_id":reloaded_id,
+            "hits":hits,
+            "staging_table":f"{self.STAGING_PREFIX}{key}"
+        }
+
+    def __getNewPeriods(self, down):
+        """
+        The chunks of new days, as (start_date, end_date), or an empty list if the data is up to date.
+        """
+        previous_date=down.getPreviousDateFromDB()
+        if previous_date is not None and previous_date>=down.YESTERDAY_DATE:
+            return []
+        start=previous_date+timedelta(days=1) if previous_date is not None else down.YESTERDAY_DATE
+        days=(down.YESTERDAY_DATE-start).days+1
+        chunk_days=max(self.CHUNK_DAYS, math.ceil(days/max(self.MAX_CHUNKS,1)))
+
+        periods=[]
+        while start<=down.YESTERDAY_DATE:
+            end=min(start+timedelta(days=chunk_days-1), down.YESTERDAY_DATE)
+            periods.append((start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+            start=end+timedelta(days=1)
+        return periods
+
+    def getPlan(self):
+        """
+        Plan the chunks of the run. Return a list of {"chunk": chunk}, the keyword arguments of each staging task.
+        """
+        from tasks.download_data import DownloadData
+        from tasks.data_checker import DataChecker
+
+        metrics=resetRunMetrics("plan")
+        try:
+            down=DownloadData()
+            periods=self.__getNewPeriods(down)
+            counts=down.wfs.countPeriods(periods) if periods else {}
+            chunks=[self.__getChunk(start, end, counts[(start, end)]) for start, end in periods]
+
+            for registry in DataChecker().check():
+                chunks.append(self.__getChunk(registry["start_date"], registry["end_date"], registry["num_rows"], reloaded_id=registry["id"]))
+
+            print("Planned {0} chunks with {1} focuses: {2} of new days and {3} to reload.".format(
+                len(chunks), sum(c["hits"] for c in chunks), len(periods), len(chunks)-len(periods)))
+            for chunk in chunks:
+                print("Chunk {key}: {start_date} to {end_date}, {hits} focuses".format(**chunk))
+            return [{"chunk":chunk} for chunk in chunks]
+        finally:
+            metrics.write()
+
+    def stageChunk(self, chunk):
+        """
+        Download one chunk and commit it to its staging table. Return the chunk, with the number of downloaded focuses.
+        """
+        from tasks.download_data import DownloadData
+        from tasks.import_data import ImportData
+        from tasks.import_pipeline import ImportPipeline
+
+        metrics=resetRunMetrics("stage_{0}".format(chunk["key"]))
+        try:
+            down=DownloadData()
+            down.setPeriod(start_date=chunk["start_date"], end_date=chunk["end_date"])
+            if chunk["reloaded_id"] is not None:
+                # the period is reloaded because its data changed, so the parts of a previous download are never reused
+                down.wfs.setResume(False)
+            import_data=ImportData(tmp_output_table=chunk["staging_table"])
+            period=(chunk["start_date"], chunk["end_date"])
+            rows=ImportPipeline(down, import_data).run(period=period, stage_only=True)
+            chunk=dict(chunk, rows=rows)
+            print("Chunk {key} staged: {rows} focuses.".format(**chunk))
+            return chunk
+        finally:
+            metrics.write()
+
+    def mergeChunks(self, chunks):
+        """
+        Merge the staged chunks into the final table, in date order, one transaction and one control row for each chunk.
+        The staging tables of the chunks, and the ones left by failed runs, are dropped. Return the number of merged chunks.
+
+        Without chunks, only the staging tables are dropped and the geographic libraries are not loaded.
+        """
+        metrics=resetRunMetrics("merge_chunks")
+        try:
+            chunks=sorted(chunks, key=lambda c: (c["start_date"], c["end_date"]))
+            if chunks:
+                from tasks.import_data import ImportData
+
+                import_data=ImportData()
+                for chunk in chunks:
+                    import_data.tmp_output_table=chunk["staging_table"]
+                    import_data.mergePeriod(reloaded_id=chunk["reloaded_id"], period=(chunk["start_date"], chunk["end_date"]),
+                                            origin=self.ORIGIN, complete=True)
+                    print("Chunk {key} merged.".format(**chunk))
+            self.__dropStagingTables()
+            return len(chunks)
+        finally:
+            metrics.write()
+
+    def __dropStagingTables(self):
+        """
+        Drop the staging tables of the merged chunks and the ones of the chunks of a failed run, that are never merged.
+        """
+        db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
+        db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
+        db.connect()
+        try:
+            left="SELECT tablename FROM pg_tables WHERE schemaname='public' "
+            left=f"{left} AND tablename LIKE 'focuses\\_chunk\\_%';"
+            for row in db.fetchData(left):
+                print("Dropping the staging table {0}.".format(row[0]))
+                db.execQuery(f"DROP TABLE IF EXISTS public.{row[0]};")
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print('Error on drop the staging tables')
+            print(e.__str__())
+            raise e
+        finally:
+            db.close()
+
+# end of class
@@ -9,6 +9,7 @@ Usage:
 import os
 from tasks.psqldb import PsqlDB
 from tasks.wfs import WFS
+from tasks.metrics import getRunMetrics
 
 """
     The Data Checker is used to verify that previously imported data is complete.
@@ -26,7 +27,6 @@ class DataChecker:
 
         db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
         self.db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
-        self.db.connect()
 
         gs_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
         self.wfs = WFS(gs_conf_file,'geoserver.cfg','geoserver')
@@ -42,12 +42,13 @@ class DataChecker:
         log=self.db.fetchData(query=check_data)
         return log
 
-    def __getRegistryFromSource(self, start_date, end_date):
+    def __getRegistryFromSource(self, periods):
         """
-        Get the number of available registers from the official data source using the previous period of imported data as a filter.
+        Get the number of available registers from the official data source using the previous periods of imported data as filters.
+
+        The periods are counted with concurrent requests. Return a dictionary of (start_date, end_date) to number of registers.
         """
-        self.wfs.setPeriod(start_date=start_date,end_date=end_date)
-        return self.wfs.countMax()
+        return self.wfs.countPeriods(periods)
     
     def check(self):
         """
@@ -64,15 +65,23 @@ class DataChecker:
         
         reload=[]
 
-        rows=self.__getRegistryFromLog()
+        # the connection is only held while the log is read
+        self.db.connect()
+        try:
+            rows=self.__getRegistryFromLog()
+        finally:
+            self.db.close()
+        # get official number of rows of all periods at once
+        with getRunMetrics().timer("check"):
+            official=self.__getRegistryFromSource([(row[1], row[2]) for row in rows])
+        print("WFS cache: {0}".format(self.wfs.getCacheStats()))
         for row in rows:
             # prepare the parameters to request the count number of rows for a specific period over the WFS
             id=row[0]
             start_date=row[1]
             end_date=row[2]
             imported_num_rows=row[3]
-            # get official number of rows
-            official_num_rows=self.__getRegistryFromSource(start_date=start_date,end_date=end_date)
+            official_num_rows=official[(start_date, end_date)]
 
             if imported_num_rows<official_num_rows:
                 print("we need reimport data to this period")
@@ -0,0 +1,127 @@
+"""
+Reconcile data via WFS
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to complete a previously imported period by downloading only the missing focuses.
+"""
+import os
+from datetime import datetime, timedelta
+from tasks.psqldb import PsqlDB
+
+"""
+    The Data Reconciler completes one period found by the DataChecker.
+
+    The number of focuses of each day is compared between the WFS and the final table. For the days that
+    differ, only the identifiers are read from the WFS and compared to the stored uuid values. The missing
+    focuses are downloaded by identifier or, if there are too many, by the window of that day.
+"""
+class DataReconciler:
+
+    def __init__(self, down, import_data, output_table="focos_aqua_referencia", ids_per_request=100, max_missing_ids=1000):
+        """
+        Constructor.
+
+            - down, a DownloadData instance, used for its WFS client and data directory.
+            - import_data, an ImportData instance.
+            - output_table, the final table of focuses.
+            - ids_per_request, the number of identifiers in the CQL filter of each download by identifier.
+            - max_missing_ids, above this number of missing focuses in one day, the whole day is downloaded.
+        """
+        self.down=down
+        self.wfs=down.wfs
+        self.import_data=import_data
+        self.output_table=output_table
+        self.IDS_PER_REQUEST=ids_per_request
+        self.MAX_MISSING_IDS=max_missing_ids
+        # the downloads of the period being reconciled, their manifests are removed after the commit
+        self.__base_file_names=[]
+
+        db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
+        self.db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
+        self.db.connect()
+
+    def __getDays(self, start_date, end_date):
+        start=datetime.strptime(str(start_date),'%Y-%m-%d').date()
+        end=datetime.strptime(str(end_date),'%Y-%m-%d').date()
+        return [(start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range((end-start).days+1)]
+
+    def __getImportedCounts(self, start_date, end_date):
+        """
+        Get the number of stored focuses of each day of the period.
+        """
+        count_data=f"SELECT data, count(*) FROM public.{self.output_table} "
+        count_data=f"{count_data} WHERE data BETWEEN %s::date AND %s::date GROUP BY data"
+        rows=self.db.execPrepared(f"{self.output_table}_day_counts", count_data, (str(start_date), str(end_date)), fetch=True)
+        return {row[0].strftime('%Y-%m-%d'):row[1] for row in rows}
+
+    def __getImportedIds(self, day):
+        ids_data=f"SELECT uuid FROM public.{self.output_table} WHERE data=%s::date"
+        rows=self.db.execPrepared(f"{self.output_table}_day_ids", ids_data, (day,), fetch=True)
+        return set(row[0] for row in rows)
+
+    def __downloadAndLoad(self, day, ids=None):
+        """
+        Download the focuses of one day, or only the ones with the given identifiers, and append them to the staging table.
+
+        The identifiers are downloaded in pages of ids_per_request identifiers, without a hits request or a manifest.
+        The whole day has the same output name as the daily download of that day, so the parts of a previous
+        download are never reused, they may not have the missing focuses.
+        """
+        self.wfs.setPeriod(start_date=day, end_date=day)
+        if ids is not None:
+            rows, base_file_name, total_files=self.wfs.downloadByIds(ids, output_dir=self.down.DATA_DIR, ids_per_request=self.IDS_PER_REQUEST)
+        else:
+            self.wfs.setResume(False)
+            try:
+                rows, base_file_name, total_files=self.wfs.download(output_dir=self.down.DATA_DIR)
+            finally:
+                self.wfs.setResume(True)
+            self.__base_file_names.append(base_file_name)
+
+        for file_number in range(1, total_files):
+            self.import_data.loadPart(file_name=self.wfs.getPartFileName(base_file_name, file_number), default_crs=self.wfs.getDefaultEPSG())
+        return rows
+
+    def reconcile(self, registry):
+        """
+        Import the focuses missing in one period and write a new control row to it.
+
+            - registry, one item returned by DataChecker.check.
+        """
+        start_date=registry["start_date"]
+        end_date=registry["end_date"]
+        days=self.__getDays(start_date, end_date)
+
+        if self.wfs.ID_ATTRIBUTE not in self.wfs.getAttributes():
+            raise Exception("The layer has no {0} attribute to compare the focuses.".format(self.wfs.ID_ATTRIBUTE))
+
+        official=self.wfs.countPeriods([(day, day) for day in days])
+        imported=self.__getImportedCounts(start_date, end_date)
+        incomplete=[day for day in days if imported.get(day, 0)<official[(day, day)]]
+
+        self.__base_file_names=[]
+        try:
+            self.import_data.beginPeriod()
+            downloaded=0
+            for day in incomplete:
+                missing=sorted(set(self.wfs.getFeatureIds((day, day)))-self.__getImportedIds(day))
+                print("Day {0}: {1} of {2} focuses are missing.".format(day, len(missing), official[(day, day)]))
+                if len(missing)>self.MAX_MISSING_IDS:
+                    downloaded+=self.__downloadAndLoad(day)
+                elif missing:
+                    downloaded+=self.__downloadAndLoad(day, ids=missing)
+
+            print("Reconciled the period {0} to {1}: {2} of {3} days were incomplete, {4} focuses were downloaded.".format(
+                start_date, end_date, len(incomplete), len(days), downloaded))
+            self.import_data.finishPeriod(reloaded_id=registry["id"], period=(start_date, end_date))
+            for base_file_name in self.__base_file_names:
+                self.wfs.removeManifest(base_file_name)
+        except Exception as e:
+            self.import_data.rollback()
+            print('Error on reconcile the period')
+            print(e.__str__())
+            raise e
+
+# end of class
@@ -14,6 +14,7 @@ import os
 from datetime import datetime, timedelta
 from tasks.psqldb import PsqlDB
 from tasks.wfs import WFS
+from tasks.metrics import getRunMetrics
 
 """
   Used to perform the download of shapefiles using WFS service.
@@ -73,15 +74,33 @@ class DownloadData:
   def getPreviousDateFromDB(self):
     pdate=None
     self.db.connect()
-    prev_date="SELECT MAX(end_date) FROM public.acquisition_data_control;"
-    row=self.db.fetchData(query=prev_date)
+    try:
+      prev_date="SELECT MAX(end_date) FROM public.acquisition_data_control;"
+      row=self.db.fetchData(query=prev_date)
+    finally:
+      # give the connection back to the pool
+      self.db.close()
     if len(row[0])==1:
       pdate=datetime.strptime(str(row[0][0]),'%Y-%m-%d').date()
 
     return pdate
 
 
-  def getFocuses(self):
+  def isUpToDate(self):
+    """
+    True if the last imported period already ends yesterday, so there is nothing to download.
+    It only reads the acquisition_data_control table, used as a cheap check before loading the import modules.
+    """
+    previous_date=self.getPreviousDateFromDB()
+    return previous_date is not None and previous_date>=self.YESTERDAY_DATE
+
+  def getFocuses(self, on_page=None):
+    """
+    Download the focuses of the period and return the number of rows, the base file name, the number of parts plus one
+    and the default CRS.
+
+      - on_page, optional - a function called with the name of each downloaded part, see WFS.download.
+    """
     # use to abort if download is not needed
     escape=False
 
@@ -104,15 +123,17 @@ class DownloadData:
       # download Focuses of fire using start and end date from call
       default_crs=self.wfs.getDefaultEPSG()
       self.wfs.setPeriod(start_date=self.START_DATE,end_date=self.END_DATE)
-      rows, file_name, pagNumber=self.wfs.download(output_dir=self.DATA_DIR)
+      with getRunMetrics().timer("download"):
+        rows, file_name, pagNumber=self.wfs.download(output_dir=self.DATA_DIR, on_page=on_page)
 
     return rows, file_name, pagNumber, default_crs
 
-  def get(self):
+  def get(self, on_page=None):
     try:
-      return self.getFocuses()
+      return self.getFocuses(on_page=on_page)
     except Exception as error:
       print("There was an error when trying to download data.")
       print(error)
+      raise error
 
 # end of class
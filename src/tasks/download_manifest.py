@@ -0,0 +1,122 @@
+"""
+Download manifest
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+  Keep track of the pages already downloaded for one period, so a restarted
+  download only fetches the missing or corrupt pages.
+"""
+
+import os, json, hashlib, threading
+
+"""
+    Per-period manifest of downloaded pages, stored as a JSON file next to the part files.
+
+    The manifest also has the number of features matched by the period and the number of pages of the download.
+    If the source changes, like late focuses published for a period, the pages are downloaded again.
+
+    Each page entry has the following information:
+        {
+            'query_hash':the hash of the request used to download the page,
+            'file':the part file name,
+            'size':the file size in bytes,
+            'checksum':the SHA-256 of the file content,
+            'features':the number of features in the page
+        }
+"""
+class DownloadManifest:
+
+    def __init__(self, manifest_file):
+        """
+        Constructor
+
+            - manifest_file, the path and full name of the manifest file. It is created on the first recorded page.
+        """
+        self.manifest_file=manifest_file
+        self.__lock=threading.Lock()
+        self.number_matched=None
+        self.page_count=None
+        self.pages=self.__read()
+
+    def __read(self):
+        pages={}
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    manifest=json.load(f)
+                pages=manifest.get("pages", {})
+                self.number_matched=manifest.get("number_matched")
+                self.page_count=manifest.get("page_count")
+            except ValueError:
+                print("Ignoring an unreadable download manifest: {0}".format(self.manifest_file))
+        return pages
+
+    def __write(self):
+        tmp_file="{0}.tmp".format(self.manifest_file)
+        with open(tmp_file, 'w') as f:
+            json.dump({"number_matched":self.number_matched, "page_count":self.page_count, "pages":self.pages}, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    def setPlan(self, number_matched, page_count):
+        """
+        Define the number of matched features and of pages of the current download. If any of them differs from
+        the stored ones, or the manifest has pages without them, the stored pages are discarded.
+        """
+        with self.__lock:
+            if self.pages and (self.number_matched!=number_matched or self.page_count!=page_count):
+                print("The source has changed since the last download ({0} features in {1} pages, now {2} in {3}), downloading all pages again.".format(
+                    self.number_matched, self.page_count, number_matched, page_count))
+                self.pages={}
+            self.number_matched=number_matched
+            self.page_count=page_count
+            if os.path.isfile(self.manifest_file):
+                self.__write()
+
+    def remove(self):
+        """
+        Remove the manifest file, used when the downloaded period was committed and its pages are not reused.
+        """
+        with self.__lock:
+            self.pages={}
+            if os.path.isfile(self.manifest_file):
+                os.remove(self.manifest_file)
+
+    @staticmethod
+    def checksum(file_path, chunk_size=1024*1024):
+        sha=hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def queryHash(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def isComplete(self, page_number, query_hash, file_path):
+        """
+        Return True if the page was downloaded by the same query and the file on disk is intact.
+        """
+        page=self.pages.get(str(page_number))
+        if page is None or page["query_hash"]!=query_hash:
+            return False
+        if not os.path.isfile(file_path) or os.path.getsize(file_path)!=page["size"]:
+            return False
+        return self.checksum(file_path)==page["checksum"]
+
+    def add(self, page_number, query_hash, file_path, size, checksum, features):
+        """
+        Record one completed page and persist the manifest.
+        """
+        with self.__lock:
+            self.pages[str(page_number)]={
+                'query_hash':query_hash,
+                'file':os.path.basename(file_path),
+                'size':size,
+                'checksum':checksum,
+                'features':features
+            }
+            self.__write()
+
+# end of class
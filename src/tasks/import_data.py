@@ -7,12 +7,21 @@ Usage:
     Used to update the previous uncompleted imported data.
 """
 import os
+import io
+import gc
+import time
+import struct
 import zipfile
+from itertools import islice
+import pandas as pd
 import geopandas as gpd
-from glob import glob
-from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
 from tasks.psqldb import PsqlDB
+from tasks.output_formats import getOutputFormat
+from tasks.biome_cache import BiomeCache
+from tasks.biome_index import BiomeIndex
+from tasks.partition_manager import PartitionManager
+from tasks.parquet_archive import ParquetArchive
+from tasks.metrics import getRunMetrics, getMemoryUsage, getPeakMemory
 
 
 class ImportData():
@@ -21,7 +30,28 @@ class ImportData():
 
     """
 
-    def __init__(self, data_dir=None, tmp_output_table="focuses", output_table="focos_aqua_referencia"):
+    def __init__(self, data_dir=None, tmp_output_table="focuses", output_table="focos_aqua_referencia", biome_engine=None):
+        """
+        Constructor
+
+            - biome_engine, optional - how the biome is assigned to each focus. Default is the BIOME_ENGINE env var or "database".
+                - database, the biome is updated into the staging table with ST_CoveredBy against the biome table;
+                - local, the biome is assigned before the load, using a local cache of the biome table and a spatial join;
+                - subdivided, the biome is resolved while copying to the final table, by an indexed lookup on a subdivided biome table;
+
+        Optional env vars to bound the memory of the import:
+            - IMPORT_BATCH_SIZE, the number of features read and loaded at a time from each part. Default is 0, the whole part.
+            - IMPORT_MEMORY_LIMIT_MB, a soft ceiling of the resident memory. When it is exceeded, the batch size is halved.
+              If it is defined without IMPORT_BATCH_SIZE, the batch size starts at 50000.
+
+        Optional env var to choose how the staged period is merged into the final table:
+            - MERGE_MODE, "insert" (default) adds the new focuses only; "upsert" also updates the stored focuses whose
+              row hash changed; "sync" also deletes the focuses of a complete period that are not in the source anymore.
+
+        Optional env vars of the local archive of the downloaded focuses, see ParquetArchive:
+            - ARCHIVE_ENABLED, if "true", the focuses of each imported period are written to the GeoParquet archive.
+            - ARCHIVE_DIR, the directory of the archive. Default is data/archive.
+        """
 
         # Data directory for reading data
         self.input_dir=data_dir if data_dir else os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data'
@@ -30,53 +60,219 @@ class ImportData():
         self.tmp_output_table=tmp_output_table
         self.output_table=output_table
 
+        self.biome_engine=biome_engine if biome_engine else os.getenv("BIOME_ENGINE", "database")
+        if self.biome_engine not in ("database", "local", "subdivided"):
+            raise Exception("Unsupported biome engine: {0}".format(self.biome_engine))
+
         db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
         self.db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
         self.db.connect()
 
-        self._dbparams = self.db.getDBParameters()
-        dburl=URL.create(drivername=self._dbparams["drivername"],host=self._dbparams["host"],database=self._dbparams["database"],
-                         port=self._dbparams["port"],username=self._dbparams["username"],password=self._dbparams["password"])
-        self._engine = create_engine(dburl)
+        self._biome_cache=BiomeCache(self.db, f"{self.input_dir}{os.sep}cache") if self.biome_engine=="local" else None
+        self._biome_index=BiomeIndex(self.db) if self.biome_engine=="subdivided" else None
+
+        self.merge_mode=os.getenv("MERGE_MODE", "insert")
+        if self.merge_mode not in ("insert", "upsert", "sync"):
+            raise Exception("Unsupported merge mode: {0}".format(self.merge_mode))
+        if self.merge_mode!="insert":
+            self.__check_hash_column()
+
+        self._archive=ParquetArchive()
+        self._archive_enabled=os.getenv("ARCHIVE_ENABLED", "false").lower()=="true"
+        # the monthly partitions of the final table, if it is partitioned
+        self._partitions=PartitionManager(self.db, self.output_table)
+
+        # the attributes loaded into the staging table, in the COPY column order, followed by the geometry
+        self._staging_columns=["foco_id", "datahora", "satelite", "pais", "estado", "municipio", "bioma", "latitude", "longitude", "bioma_nb"]
+        # the number of rows sent by each COPY statement
+        self._copy_batch_size=50000
+        # the number of features read at a time from each part, 0 reads the whole part
+        self._memory_limit=float(os.getenv("IMPORT_MEMORY_LIMIT_MB", 0))
+        self._read_batch_size=int(os.getenv("IMPORT_BATCH_SIZE", 50000 if self._memory_limit else 0))
+        self._min_read_batch_size=1000
 
         self._input_data=None
+        # the foco_id values already staged in the current period, used to drop the duplicates between pages
+        self._staged_ids=set()
+        # the summary of the current period, stored with its control row
+        self._period_started=time.time()
+        self._period_rows=0
+        # the bytes downloaded by the run when the previous period ended, see __get_period_bytes
+        self.__mark_period_bytes()
+        self.__prepare_metrics_table()
 
 
     def __load_input_data(self, file_name):
         """
-        Used to unpack the shapefile from a ZIP file.
+        Used to read the shapefile inside a ZIP file, or to parse the features of a streaming output format.
 
         file_name, is the name of ZIP file, with extension, where the shapefile is.
         """
         try:
-            output_dir=f"{self.input_dir}{os.sep}tmp"
-            # create the output directory, if it not exists, to unpack zip
-            os.makedirs(output_dir, exist_ok=True)
-            
-            with zipfile.ZipFile(f"{self.input_dir}{os.sep}{file_name}","r") as zip_ref:
-                zip_ref.extractall(output_dir)
-            
-            file_name=glob(f"{output_dir}{os.sep}*.shp")[0]
-            if os.path.isfile(file_name):
-                self._input_data=gpd.read_file(file_name)
+            output_format=getOutputFormat(os.path.splitext(file_name)[1][1:])
+            if output_format.streaming:
+                # GeoJSON and CSV are parsed chunk by chunk, without unpacking and without the DBF column name limit
+                chunks=output_format.readChunks(f"{self.input_dir}{os.sep}{file_name}")
+                self._input_data=gpd.GeoDataFrame.from_features(output_format.iterFeatures(chunks))
+                return
+
+            file_path=f"{self.input_dir}{os.sep}{file_name}"
+            # each part has its own shapefile, so it is found by name inside the archive
+            with zipfile.ZipFile(file_path,"r") as zip_ref:
+                shp_name=[name for name in zip_ref.namelist() if name.lower().endswith(".shp")][0]
+
+            # read the layer straight from the ZIP file through the GDAL virtual file system
+            self._input_data=gpd.read_file(f"zip://{file_path}!{shp_name}")
+        except Exception as e:
+            print('Error on read data from file')
+            print(e.__str__())
+            raise e
+
+    def __iter_input_data(self, file_name):
+        """
+        Read one part in batches of at most _read_batch_size features, as GeoDataFrames.
+        Only one batch is in memory, the batch size is read again before each batch, see __check_memory.
+        """
+        file_path=f"{self.input_dir}{os.sep}{file_name}"
+        output_format=getOutputFormat(os.path.splitext(file_name)[1][1:])
+        try:
+            if output_format.streaming:
+                features=output_format.iterFeatures(output_format.readChunks(file_path))
+                while True:
+                    batch=list(islice(features, self._read_batch_size))
+                    if not batch:
+                        return
+                    yield gpd.GeoDataFrame.from_features(batch)
+            else:
+                with zipfile.ZipFile(file_path,"r") as zip_ref:
+                    shp_name=[name for name in zip_ref.namelist() if name.lower().endswith(".shp")][0]
+                total=output_format.countFeatures(file_path)
+                start=0
+                while start<total:
+                    size=self._read_batch_size
+                    yield gpd.read_file(f"zip://{file_path}!{shp_name}", rows=slice(start, start+size))
+                    start+=size
         except Exception as e:
             print('Error on read data from file')
             print(e.__str__())
             raise e
 
+    def __check_memory(self):
+        """
+        Halve the read batch size while the resident memory is above the memory limit.
+        """
+        if not self._memory_limit:
+            return
+        used=getMemoryUsage()
+        if used>self._memory_limit:
+            gc.collect()
+            if self._read_batch_size>self._min_read_batch_size:
+                self._read_batch_size=max(self._read_batch_size//2, self._min_read_batch_size)
+                print("Memory usage {0:.0f}MB is above the limit of {1:.0f}MB, reading {2} features at a time.".format(used, self._memory_limit, self._read_batch_size))
+            else:
+                print("Memory usage {0:.0f}MB is above the limit of {1:.0f}MB with the smallest batch size.".format(used, self._memory_limit))
+
+    def __prepare_staging_table(self):
+        """
+        Create the UNLOGGED staging table once and truncate it before each load.
+        """
+        try:
+            # the staging table left by the previous loader is a regular table with other columns, so it is replaced once
+            persistence=f"SELECT relpersistence FROM pg_class WHERE oid=to_regclass('public.{self.tmp_output_table}');"
+            row=self.db.fetchData(persistence)
+            if row and row[0][0]!='u':
+                self.db.execQuery(f"DROP TABLE public.{self.tmp_output_table};")
+
+            create=f"CREATE UNLOGGED TABLE IF NOT EXISTS public.{self.tmp_output_table} ("
+            create=f"{create} foco_id character varying, datahora timestamp, satelite character varying, "
+            create=f"{create} pais character varying, estado character varying, municipio character varying, "
+            create=f"{create} bioma character varying, latitude double precision, longitude double precision, "
+            create=f"{create} bioma_nb character varying, geometry geometry);"
+            self.db.execQuery(create)
+            self.db.execQuery(f"TRUNCATE public.{self.tmp_output_table};")
+        except Exception as e:
+            print('Error on prepare the staging table')
+            print(e.__str__())
+            raise e
+
+    @staticmethod
+    def __to_ewkb(wkb, srid):
+        """
+        Add the SRID to a WKB geometry and return it as the hex EWKB text accepted by PostGIS.
+        """
+        if wkb is None:
+            return None
+        byte_order='<' if wkb[0]==1 else '>'
+        geometry_type=struct.unpack(f"{byte_order}I", wkb[1:5])[0]
+        ewkb=wkb[0:1]+struct.pack(f"{byte_order}II", geometry_type|0x20000000, srid)+wkb[5:]
+        return ewkb.hex()
+
+    def __copy_into_staging(self, data):
+        """
+        Stream the rows to the staging table through COPY, as CSV with the geometry as hex EWKB.
+        """
+        srid=data.crs.to_epsg() if data.crs is not None else 0
+        rows=pd.DataFrame(data.drop(columns=data.geometry.name)).reindex(columns=self._staging_columns)
+        rows["geometry"]=[self.__to_ewkb(wkb, srid) for wkb in data.geometry.to_wkb()]
+
+        columns=", ".join(self._staging_columns+["geometry"])
+        copy=f"COPY public.{self.tmp_output_table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+        for start in range(0, len(rows), self._copy_batch_size):
+            buffer=io.StringIO()
+            rows.iloc[start:start+self._copy_batch_size].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            self.db.copyFrom(copy, buffer)
+
+        return len(rows)
+
     def __import_into_database(self, default_crs=None):
 
         try:
+            if self._input_data is not None and not self._input_data.empty:
+                # a focus can be on two pages if the layer changes during the download, only the first one is kept
+                duplicated=self._input_data["foco_id"].duplicated() | self._input_data["foco_id"].isin(self._staged_ids)
+                self._input_data=self._input_data[~duplicated]
+                self._staged_ids.update(self._input_data["foco_id"])
+
             if self._input_data is not None and not self._input_data.empty:
                 # force CRS default
                 self._input_data.set_crs(crs=default_crs, inplace=True, allow_override=True)
-                self._input_data.to_postgis(name=f"{self.tmp_output_table}", schema="public", con=self._engine, if_exists='replace')
+                metrics=getRunMetrics()
+                if self._archive_enabled:
+                    with metrics.timer("archive_write"):
+                        self._archive.write(self._input_data)
+                if self._biome_cache is not None:
+                    with metrics.timer("biome_assign"):
+                        self._biome_cache.assign(self._input_data)
+
+                start=time.time()
+                with metrics.timer("staging_load"):
+                    rows=self.__copy_into_staging(self._input_data)
+                elapsed=time.time()-start
+                metrics.add("rows_staged", rows)
+                print("Loaded {0} rows into the staging table in {1:.2f}s ({2:.0f} rows/s)".format(rows, elapsed, rows/elapsed if elapsed else rows))
 
         except Exception as e:
             print('Error on write data to database')
             print(e.__str__())
             raise e
         
+    def __get_source_query(self):
+        """
+        The staged focuses with the columns of the final table, and the biome resolved by the biome engine.
+        """
+        # the biome is read from the staging table, or resolved here by the subdivided biome table
+        biome="f.bioma_nb"
+        lateral=""
+        if self._biome_index is not None:
+            biome="b.bioma"
+            lateral=self._biome_index.getLateralJoin("f.geometry", alias="b")
+
+        source=f"SELECT f.foco_id AS uuid, f.datahora::date AS data, f.satelite, f.pais, f.estado, "
+        source=f"{source} f.municipio, {biome} AS bioma, f.bioma AS bioma_old, f.latitude, f.longitude, f.geometry AS geom "
+        source=f"{source} FROM public.{self.tmp_output_table} f {lateral}"
+        return source
+
     def __copy_to_final_table(self):
         """
         copy new data to final focuses table
@@ -84,26 +280,97 @@ class ImportData():
         try:
             insert=f"INSERT INTO public.{self.output_table}(uuid, data, satelite, pais, estado, "
             insert=f"{insert} municipio, bioma, bioma_old, latitude, longitude, geom) "
-            insert=f"{insert} SELECT foco_id, datahora::date, satelite, pais, estado, "
-            insert=f"{insert} municipio, bioma_nb, bioma as bioma_old, latitude, longitude, geometry "
-            insert=f"{insert} FROM public.{self.tmp_output_table} "
+            insert=f"{insert} {self.__get_source_query()} "
             insert=f"{insert} ON CONFLICT DO NOTHING;"
 
             self.db.execQuery(insert)
+            self._period_rows=self.db.cur.rowcount
+            getRunMetrics().add("rows_merged", self._period_rows)
         except Exception as e:
             print('Error on write data to final table')
             print(e.__str__())
             raise e
 
+    def __check_hash_column(self):
+        """
+        The upsert and sync merge modes need the row_hash column in the final table, see the README.
+        """
+        check="SELECT 1 FROM information_schema.columns WHERE table_schema='public' "
+        check=f"{check} AND table_name='{self.output_table}' AND column_name='row_hash';"
+        if not self.db.fetchData(check):
+            raise Exception("The {0} merge mode needs the row_hash column in the table public.{1}.".format(self.merge_mode, self.output_table))
+
+    def __merge_into_final_table(self, sync_period=None):
+        """
+        Merge the staged period into the final table by the hash of the attributes of each focus.
+        The new focuses are inserted and only the stored focuses whose hash changed are updated.
+
+        The focuses are matched by uuid only. A focus whose date changed in the source is deleted and inserted again,
+        so it is moved to the partition of its new date, and it is counted as updated.
+
+            - sync_period, optional - the start and end date of a complete period. The stored focuses of this period
+              that are not staged are deleted. Used only by the sync merge mode.
+        """
+        try:
+            merge_table=f"{self.tmp_output_table}_merge"
+            create=f"CREATE TEMP TABLE {merge_table} ON COMMIT DROP AS SELECT s.*, "
+            create=f"{create} md5(concat_ws('|', s.data, s.satelite, s.pais, s.estado, s.municipio, s.bioma, s.bioma_old, s.latitude, s.longitude)) AS row_hash "
+            create=f"{create} FROM ({self.__get_source_query()}) s;"
+            self.db.execQuery(create)
+            staged=self.db.cur.rowcount
+            self.db.execQuery(f"ANALYZE {merge_table};")
+
+            # the stored focuses whose date changed, inserted again with the new ones
+            move=f"DELETE FROM public.{self.output_table} t USING {merge_table} s WHERE t.uuid=s.uuid AND t.data IS DISTINCT FROM s.data;"
+            self.db.execQuery(move)
+            moved=self.db.cur.rowcount
+
+            # the stored focuses without hash are updated once, by the first merge of their period
+            update=f"UPDATE public.{self.output_table} t SET satelite=s.satelite, pais=s.pais, estado=s.estado, "
+            update=f"{update} municipio=s.municipio, bioma=s.bioma, bioma_old=s.bioma_old, latitude=s.latitude, "
+            update=f"{update} longitude=s.longitude, geom=s.geom, row_hash=s.row_hash, imported_at=now()::date "
+            update=f"{update} FROM {merge_table} s WHERE t.uuid=s.uuid AND t.row_hash IS DISTINCT FROM s.row_hash;"
+            self.db.execQuery(update)
+            updated=self.db.cur.rowcount
+
+            insert=f"INSERT INTO public.{self.output_table}(uuid, data, satelite, pais, estado, "
+            insert=f"{insert} municipio, bioma, bioma_old, latitude, longitude, geom, row_hash) "
+            insert=f"{insert} SELECT s.uuid, s.data, s.satelite, s.pais, s.estado, s.municipio, s.bioma, s.bioma_old, "
+            insert=f"{insert} s.latitude, s.longitude, s.geom, s.row_hash FROM {merge_table} s "
+            insert=f"{insert} WHERE NOT EXISTS (SELECT 1 FROM public.{self.output_table} t WHERE t.uuid=s.uuid);"
+            self.db.execQuery(insert)
+            # the moved focuses are inserted again, they are counted as updated
+            inserted=self.db.cur.rowcount-moved
+            updated=updated+moved
+
+            deleted=0
+            # an empty source is never taken as a period without focuses
+            if self.merge_mode=="sync" and sync_period is not None and staged>0:
+                delete=f"DELETE FROM public.{self.output_table} t WHERE t.data BETWEEN '{sync_period[0]}'::date AND '{sync_period[1]}'::date "
+                delete=f"{delete} AND NOT EXISTS (SELECT 1 FROM {merge_table} s WHERE s.uuid=t.uuid);"
+                self.db.execQuery(delete)
+                deleted=self.db.cur.rowcount
+
+            unchanged=staged-inserted-updated
+            self._period_rows=inserted+updated
+            metrics=getRunMetrics()
+            metrics.add("rows_merged", self._period_rows)
+            metrics.add("rows_inserted", inserted)
+            metrics.add("rows_updated", updated)
+            metrics.add("rows_unchanged", unchanged)
+            metrics.add("rows_deleted", deleted)
+            print("Merged {0} focuses: {1} inserted, {2} updated ({3} with a new date), {4} unchanged, {5} deleted.".format(
+                staged, inserted, updated, moved, unchanged, deleted))
+        except Exception as e:
+            print('Error on merge data to final table')
+            print(e.__str__())
+            raise e
 
     def __update_biome(self):
         """
         used to update the biome information on temporary table
         """
         try:
-            add_column=f"ALTER TABLE IF EXISTS public.{self.tmp_output_table} ADD COLUMN bioma_nb character varying;"
-            self.db.execQuery(add_column)
-
             update=f" UPDATE public.{self.tmp_output_table} SET bioma_nb=b.bioma "
             update=f"{update} FROM public.lm_bioma_250 as b"
             update=f"{update} WHERE ST_CoveredBy(public.{self.tmp_output_table}.geometry, b.geom);"
@@ -114,51 +381,318 @@ class ImportData():
             print(e.__str__())
             raise e
 
-    def __set_acquisition_data_control(self, reloaded_id=None):
+    def __set_acquisition_data_control(self, reloaded_id=None, period=None, origin=None):
         """
-        Store the control informations into database.
+        Store the control informations into database. Return the id of the new control row.
 
             - reloaded_id, used to identify when a specific period's dataset was reimported.
+            - period, optional - a tuple with the start and end date of the control row. If it is defined, the number
+              of rows is counted from the final table, because the staging table has only part of the period.
+            - origin, optional - stored in the origin_data column, to identify the process that imported the period.
         """
 
         try:
+            # these statements run once per period, so they are prepared once per connection
             if reloaded_id is not None:
-                update_info="UPDATE public.acquisition_data_control SET reloaded=true::boolean"
-                update_info=f"{update_info} WHERE id={reloaded_id}"
-                self.db.execQuery(update_info)
+                update_info="UPDATE public.acquisition_data_control SET reloaded=true::boolean WHERE id=%s"
+                self.db.execPrepared("acquisition_data_control_reloaded", update_info, (reloaded_id,))
 
-            insert_info="INSERT INTO public.acquisition_data_control(start_date, end_date, num_rows, reloaded) "
-            insert_info=f"{insert_info} SELECT MIN(datahora::date), MAX(datahora::date), count(*), false::boolean "
-            insert_info=f"{insert_info} FROM public.{self.tmp_output_table};"
-            self.db.execQuery(insert_info)
+            insert_info="INSERT INTO public.acquisition_data_control(start_date, end_date, num_rows, reloaded, origin_data) "
+            if period is None:
+                insert_info=f"{insert_info} SELECT MIN(datahora::date), MAX(datahora::date), count(*), false::boolean, %s "
+                insert_info=f"{insert_info} FROM public.{self.tmp_output_table} RETURNING id"
+                row=self.db.execPrepared(f"acquisition_data_control_from_{self.tmp_output_table}", insert_info, (origin,), fetch=True)
+            else:
+                insert_info=f"{insert_info} SELECT %s::date, %s::date, count(*), false::boolean, %s "
+                insert_info=f"{insert_info} FROM public.{self.output_table} WHERE data BETWEEN %s::date AND %s::date RETURNING id"
+                start_date, end_date=str(period[0]), str(period[1])
+                row=self.db.execPrepared(f"acquisition_data_control_from_{self.output_table}", insert_info, (start_date, end_date, origin, start_date, end_date), fetch=True)
+            return row[0][0]
 
         except Exception as e:
             print('Error on write acquisition data control')
             print(e.__str__())
             raise e
     
-    def importFile(self, file_name, default_crs=None, reloaded_id=None):
+    def __prepare_metrics_table(self):
         """
-        Import a shapefile into the database and update the biome column based on the biome table.
+        Create the metrics table once, if it is missing, outside the transaction of any period.
+        """
+        try:
+            row=self.db.fetchData("SELECT to_regclass('public.acquisition_data_metrics');")
+            if not row or row[0][0] is None:
+                create="CREATE TABLE IF NOT EXISTS public.acquisition_data_metrics ("
+                create=f"{create} id serial PRIMARY KEY, control_id integer REFERENCES public.acquisition_data_control(id), "
+                create=f"{create} duration double precision, num_rows integer, rows_per_second double precision, "
+                create=f"{create} bytes_downloaded bigint, created_at timestamp DEFAULT now());"
+                self.db.execQuery(create)
+                self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print('Error on create the metrics table')
+            print(e.__str__())
+            raise e
 
-        The biome table must be in the database.
+    def __mark_period_bytes(self):
+        metrics=getRunMetrics()
+        self._period_bytes_mark=(metrics, metrics.getReport()["counters"].get("bytes_downloaded", 0))
 
-            - file_name, is the path and full name of the desired shapefile.
-            - default_crs, is the default CRS of the input file. Used if the file reader fails to determine the CRS.
-            - reloaded_id, used to identify when a specific period's dataset was reimported.
+    def __get_period_bytes(self):
+        """
+        The bytes downloaded since the previous period ended. The counter of the run is a total of all its periods.
+        """
+        metrics=getRunMetrics()
+        run, mark=self._period_bytes_mark
+        downloaded=metrics.getReport()["counters"].get("bytes_downloaded", 0)
+        # a new run starts its counters from zero
+        return downloaded-mark if run is metrics else downloaded
+
+    def __set_acquisition_data_metrics(self, control_id):
+        """
+        Store the summary of the imported period next to its control row. The values are of this period only.
+        """
+        try:
+            duration=time.time()-self._period_started
+            insert="INSERT INTO public.acquisition_data_metrics(control_id, duration, num_rows, rows_per_second, bytes_downloaded) "
+            insert=f"{insert} VALUES (%s, %s, %s, %s, %s)"
+            self.db.execPrepared("acquisition_data_metrics_insert", insert, (control_id, round(duration, 3), self._period_rows,
+                round(self._period_rows/duration, 1) if duration else None, self.__get_period_bytes()))
+        except Exception as e:
+            print('Error on write acquisition data metrics')
+            print(e.__str__())
+            raise e
+
+    def __get_staged_period(self):
+        """
+        The first and last date of the staged focuses, or None if the staging table is empty.
+        """
+        row=self.db.fetchData(f"SELECT MIN(datahora::date), MAX(datahora::date) FROM public.{self.tmp_output_table};")
+        return (row[0][0], row[0][1]) if row and row[0][0] is not None else None
+
+    def getLastStagedTime(self):
+        """
+        The most recent datahora of the staged focuses, or None if the staging table is empty.
+        """
+        row=self.db.fetchData(f"SELECT MAX(datahora) FROM public.{self.tmp_output_table};")
+        return row[0][0] if row else None
+
+    def beginPeriod(self):
+        """
+        Start the import of one period. The staging table is emptied and receives all parts of the period.
         """
         try:
+            # build or refresh the subdivided biome table before any data is staged
+            if self._biome_index is not None:
+                self._biome_index.prepare()
+            self._staged_ids=set()
+            self._period_started=time.time()
+            self._period_rows=0
+            self.__prepare_staging_table()
+            if self._archive_enabled:
+                self._archive.begin()
+        except Exception as e:
+            print('Error on start the import of one period')
+            print(e.__str__())
+            raise e
+
+    def loadPart(self, file_name, default_crs=None):
+        """
+        Read one part of the period and append it to the staging table, without duplicated focuses.
+
+            - file_name, is the name of one downloaded part, with extension.
+            - default_crs, is the default CRS of the input file. Used if the file reader fails to determine the CRS.
+        """
+        metrics=getRunMetrics()
+        if not self._read_batch_size:
             # load shapefile to memory
-            self.__load_input_data(file_name=file_name)
+            with metrics.timer("parse"):
+                self.__load_input_data(file_name=file_name)
+            if self._input_data is not None:
+                metrics.add("features_parsed", len(self._input_data))
             # import into temporary table
             self.__import_into_database(default_crs=default_crs)
+            self._input_data=None
+        else:
+            # read and load one batch at a time, so the memory does not grow with the size of the part
+            batches=self.__iter_input_data(file_name=file_name)
+            while True:
+                with metrics.timer("parse"):
+                    self._input_data=next(batches, None)
+                if self._input_data is None:
+                    break
+                metrics.add("features_parsed", len(self._input_data))
+                self.__import_into_database(default_crs=default_crs)
+                self._input_data=None
+                self.__check_memory()
+        metrics.peak("peak_memory_mb", round(getPeakMemory(), 1))
+
+    def finishPeriod(self, reloaded_id=None, period=None, origin=None, complete=False, control=True, before_commit=None):
+        """
+        Assign the biome, copy the staged period to the final table, write one control row and commit.
 
-            # open transaction
-            self.__update_biome()
-            self.__copy_to_final_table()
-            self.__set_acquisition_data_control(reloaded_id=reloaded_id)
+            - reloaded_id, used to identify when a specific period's dataset was reimported.
+            - period, optional - the start and end date of the control row, used when only part of the period was staged.
+            - origin, optional - the value of the origin_data column of the control row.
+            - complete, True if every focus of the period was staged. Required by the sync merge mode to delete
+              the stored focuses that are not in the source anymore, in the period or in the staged dates.
+            - control, if False, no control row is written, like the focuses of the current day appended by the
+              incremental poller. The day is closed by the daily run.
+            - before_commit, optional - a function called after the merge, in the transaction of the period.
+        """
+        metrics=getRunMetrics()
+        # the months of the period must have their partitions before the copy, they are created in the transaction
+        # of the period, so the staged focuses and the partitions are committed together with the merge
+        months=None
+        if self._partitions.isPartitioned():
+            months=period if period is not None else self.__get_staged_period()
+        if months is not None:
+            with metrics.timer("partitions"):
+                self._partitions.ensurePartitions(months[0], months[1], commit=False)
+        if self.biome_engine=="database":
+            with metrics.timer("biome_update"):
+                self.__update_biome()
+        with metrics.timer("merge"):
+            if self.merge_mode=="insert":
+                self.__copy_to_final_table()
+            else:
+                sync_period=None
+                if complete and self.merge_mode=="sync":
+                    sync_period=period if period is not None else self.__get_staged_period()
+                self.__merge_into_final_table(sync_period=sync_period)
+        if control:
+            control_id=self.__set_acquisition_data_control(reloaded_id=reloaded_id, period=period, origin=origin)
+            self.__set_acquisition_data_metrics(control_id)
+        if months is not None and self._period_rows:
+            # only the statistics of the changed months are updated
+            with metrics.timer("analyze"):
+                self._partitions.analyzePartitions(months[0], months[1])
+        if before_commit is not None:
+            before_commit()
+        with metrics.timer("commit"):
+            self.db.commit()
+        self.__mark_period_bytes()
+        if self._archive_enabled:
+            try:
+                self._archive.commit(period=period, complete=complete)
+            except Exception as e:
+                # the period is already in the database, it is only missing in the archive
+                print("The period was imported but not archived, it will be downloaded again to be reimported.")
+                print(e.__str__())
+        print("Peak memory: {0:.0f}MB".format(getPeakMemory()))
+
+    def stagePeriod(self, period=None, complete=False):
+        """
+        Commit the staged period without merging it, so it is merged later by another process, see mergePeriod.
+        The archive of the period is written here, because the merge process never reads the parts.
+
+            - period, optional - the start and end date of the period, used by the archive.
+            - complete, True if every focus of the period was staged.
+        """
+        with getRunMetrics().timer("commit"):
+            self.db.commit()
+        if self._archive_enabled:
+            try:
+                self._archive.commit(period=period, complete=complete)
+            except Exception as e:
+                print("The period was staged but not archived.")
+                print(e.__str__())
+        print("Staged the period into {0}. Peak memory: {1:.0f}MB".format(self.tmp_output_table, getPeakMemory()))
+
+    def mergePeriod(self, reloaded_id=None, period=None, origin=None, complete=False):
+        """
+        Merge a period committed to the staging table by stagePeriod, write its control row and drop the staging table.
+        See finishPeriod for the parameters.
+        """
+        try:
+            if self._biome_index is not None:
+                self._biome_index.prepare()
+            self._period_started=time.time()
+            self._period_rows=0
+            self.finishPeriod(reloaded_id=reloaded_id, period=period, origin=origin, complete=complete)
+            self.db.execQuery(f"DROP TABLE IF EXISTS public.{self.tmp_output_table};")
             self.db.commit()
         except Exception as e:
+            self.rollback()
+            print('Error on merge the staged period')
+            print(e.__str__())
+            raise e
+
+    def rollback(self):
+        """
+        Discard the staged period and everything not committed yet.
+        """
+        self.db.rollback()
+        self.__mark_period_bytes()
+        # the partitions created in the discarded transaction do not exist anymore
+        self._partitions.forget()
+        self._archive.discard()
+
+    def importArchive(self, start_date, end_date, columns=None, filters=None, reloaded_id=None):
+        """
+        Import one period from the local GeoParquet archive, without the WFS. See ParquetArchive.read.
+
+            - start_date, end_date, the period, as YYYY-MM-DD. The control row is written for the whole period.
+            - columns, optional - the attributes to read. Default is the attributes of the staging table.
+            - filters, optional - the row filters, in the pyarrow format, applied while reading the archive.
+            - reloaded_id, used to identify when a specific period's dataset was reimported.
+        """
+        if columns is None:
+            columns=[c for c in self._staging_columns if c!="bioma_nb"]
+        # the focuses read from the archive are not written to it again
+        archive_enabled=self._archive_enabled
+        self._archive_enabled=False
+        metrics=getRunMetrics()
+        try:
+            self.beginPeriod()
+            batches=self._archive.read(start_date, end_date, columns=columns, filters=filters)
+            while True:
+                with metrics.timer("parse"):
+                    self._input_data=next(batches, None)
+                if self._input_data is None:
+                    break
+                metrics.add("features_parsed", len(self._input_data))
+                self.__import_into_database(default_crs=self._input_data.crs)
+                self._input_data=None
+            # the stored focuses are deleted by the sync merge mode only if nothing was filtered out
+            complete=filters is None and self._archive.covers(start_date, end_date)
+            self.finishPeriod(reloaded_id=reloaded_id, period=(start_date, end_date), origin="archive", complete=complete)
+        except Exception as e:
+            self.rollback()
+            print('Error on import the period from the archive')
+            print(e.__str__())
+            raise e
+        finally:
+            self._archive_enabled=archive_enabled
+
+    def importPeriod(self, file_names, default_crs=None, reloaded_id=None):
+        """
+        Import all parts of one period in one transaction and update the biome column based on the biome table.
+
+        Nothing is written to the final table if any part fails, so a period is never half imported.
+
+            - file_names, the names of the downloaded parts of the period.
+            - default_crs, is the default CRS of the input files. Used if the file reader fails to determine the CRS.
+            - reloaded_id, used to identify when a specific period's dataset was reimported.
+        """
+        try:
+            self.beginPeriod()
+            for file_name in file_names:
+                self.loadPart(file_name=file_name, default_crs=default_crs)
+            self.finishPeriod(reloaded_id=reloaded_id)
+        except Exception as e:
+            self.rollback()
             print('Error on perform the import data from shapefile to database')
             print(e.__str__())
-            raise e
\ No newline at end of file
+            raise e
+
+    def importFile(self, file_name, default_crs=None, reloaded_id=None):
+        """
+        Import a shapefile into the database and update the biome column based on the biome table.
+
+        The biome table must be in the database.
+
+            - file_name, is the path and full name of the desired shapefile.
+            - default_crs, is the default CRS of the input file. Used if the file reader fails to determine the CRS.
+            - reloaded_id, used to identify when a specific period's dataset was reimported.
+        """
+        self.importPeriod(file_names=[file_name], default_crs=default_crs, reloaded_id=reloaded_id)
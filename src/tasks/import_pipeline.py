@@ -0,0 +1,145 @@
+"""
+Import pipeline
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to overlap the download and the import of one period, so each part is loaded into
+    the staging table while the next parts are still being downloaded.
+"""
+import os
+import time
+import queue
+import threading
+from tasks.metrics import getRunMetrics
+
+"""
+    Producer/consumer pipeline between DownloadData and ImportData.
+
+    The download runs in a background thread and puts each part file name into a bounded queue.
+    The import reads the queue and loads each part as soon as it is on disk. When the queue is full
+    the download workers wait, so the number of parts waiting to be imported is bounded.
+"""
+class ImportPipeline:
+
+    def __init__(self, down, import_data, queue_size=None):
+        """
+        Constructor
+
+            - down, a DownloadData instance, with the period to download already defined or read from the database.
+            - import_data, an ImportData instance.
+            - queue_size, optional - the maximum number of parts downloaded but not imported yet.
+              Default is the PIPELINE_QUEUE_SIZE env var or 2.
+        """
+        self.down=down
+        self.import_data=import_data
+        self.queue_size=int(queue_size if queue_size else os.getenv("PIPELINE_QUEUE_SIZE", 2))
+
+        self.stats={}
+
+    def __printStats(self):
+        print("Download stage: busy {0:.2f}s, waiting for the import {1:.2f}s".format(self.stats["download_busy"], self.stats["download_idle"]))
+        print("Import stage: busy {0:.2f}s, waiting for the download {1:.2f}s".format(self.stats["import_busy"], self.stats["import_idle"]))
+        print("Pipeline total: {0:.2f}s".format(self.stats["total"]))
+
+    def run(self, reloaded_id=None, period=None, origin=None, stage_only=False):
+        """
+        Download and import one period. Return the number of rows reported by the download.
+
+            - reloaded_id, used to identify when a specific period's dataset was reimported.
+            - period, optional - the start and end date of the control row. If it is defined, the control row is
+              written even for a period without data, see ImportData.finishPeriod.
+            - origin, optional - the value of the origin_data column of the control row.
+            - stage_only, if True, the period is only committed to the staging table, to be merged later,
+              see ImportData.stagePeriod and ImportData.mergePeriod.
+        """
+        pages=queue.Queue(maxsize=max(self.queue_size,1))
+        result={}
+        # the time the download workers spent blocked on the full queue
+        blocked=[]
+
+        def on_page(file_name):
+            start=time.time()
+            pages.put(file_name)
+            blocked.append(time.time()-start)
+
+        def producer():
+            start=time.time()
+            try:
+                result["download"]=self.down.get(on_page=on_page)
+            finally:
+                result["download_time"]=time.time()-start
+                # the end of the download
+                pages.put(None)
+
+        start=time.time()
+        self.stats=dict.fromkeys(["download_busy","download_idle","import_busy","import_idle","total"], 0.0)
+        default_crs=self.down.wfs.getDefaultEPSG()
+
+        thread=threading.Thread(target=producer, daemon=True)
+        thread.start()
+
+        parts=0
+        error=None
+        while True:
+            wait=time.time()
+            file_name=pages.get()
+            self.stats["import_idle"]+=time.time()-wait
+            if file_name is None:
+                break
+            if error is not None:
+                # keep reading the queue, so the download is never blocked after an import failure
+                continue
+
+            busy=time.time()
+            try:
+                if parts==0:
+                    self.import_data.beginPeriod()
+                self.import_data.loadPart(file_name=file_name, default_crs=default_crs)
+                parts+=1
+            except Exception as e:
+                error=e
+            self.stats["import_busy"]+=time.time()-busy
+
+        thread.join()
+        self.stats["download_idle"]=sum(blocked)
+        self.stats["download_busy"]=max(result.get("download_time", 0.0)-self.stats["download_idle"], 0.0)
+
+        try:
+            download=result.get("download")
+            if error is not None:
+                raise error
+            if download is None:
+                raise Exception("The download of the period has failed.")
+
+            num_rows, base_file_name, total_files, default_crs=download
+            if num_rows>0 and parts!=total_files-1:
+                raise Exception("Only {0} of {1} parts were downloaded.".format(parts, total_files-1))
+
+            if parts>0 or period is not None:
+                busy=time.time()
+                if parts==0:
+                    self.import_data.beginPeriod()
+                if stage_only:
+                    self.import_data.stagePeriod(period=period, complete=True)
+                else:
+                    self.import_data.finishPeriod(reloaded_id=reloaded_id, period=period, origin=origin, complete=True)
+                self.stats["import_busy"]+=time.time()-busy
+                # the committed pages are never reused, a new download of the period starts from the first page
+                if base_file_name is not None:
+                    self.down.wfs.removeManifest(base_file_name)
+
+            return num_rows
+        except Exception as e:
+            self.import_data.rollback()
+            print('Error on the download and import pipeline')
+            print(e.__str__())
+            raise e
+        finally:
+            self.stats["total"]=time.time()-start
+            self.__printStats()
+            metrics=getRunMetrics()
+            for name, value in self.stats.items():
+                metrics.add(f"pipeline_{name}_seconds", round(value, 3))
+
+# end of class
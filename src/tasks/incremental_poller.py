@@ -0,0 +1,172 @@
+"""
+Incremental poller
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to append the newest focuses of the current day between the daily runs.
+
+    cd src
+    python3 -m tasks.incremental_poller
+    python3 -m tasks.incremental_poller --loop --interval 300 --overlap 30
+
+    Each poll downloads only the focuses with datahora after the watermark, minus an overlap window, and merges
+    them into the final table. The watermark is stored in public.acquisition_data_watermark, in the same
+    transaction as the focuses. No control row is written, each day is still closed by the daily run.
+"""
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+from tasks.download_data import DownloadData
+from tasks.import_data import ImportData
+from tasks.metrics import resetRunMetrics
+
+"""
+    The incremental poller keeps a datahora watermark and imports the focuses newer than it.
+
+    The focuses inside the overlap window are downloaded again on the next poll, so the detections published
+    late by the service are not lost. They are dropped by the merge, like any other stored focus.
+"""
+class IncrementalPoller:
+
+    def __init__(self, overlap_minutes=None, interval=None, name="focos"):
+        """
+        Constructor
+
+            - overlap_minutes, optional - the minutes before the watermark that are read again on each poll.
+              Default is the POLL_OVERLAP_MINUTES env var or 30.
+            - interval, optional - the seconds between two polls of the loop. Default is the POLL_INTERVAL_SECONDS env var or 300.
+            - name, the name of the watermark row.
+
+        Optional env var:
+            - POLL_KEEP_REPORTS, the number of run reports of the poller kept in the metrics directory. Default is 288,
+              one day of polls every 5 minutes.
+        """
+        self.overlap=timedelta(minutes=float(overlap_minutes if overlap_minutes is not None else os.getenv("POLL_OVERLAP_MINUTES", 30)))
+        self.interval=float(interval if interval is not None else os.getenv("POLL_INTERVAL_SECONDS", 300))
+        self.name=name
+        self.keep_reports=int(os.getenv("POLL_KEEP_REPORTS", 288))
+
+        self.down=DownloadData()
+        self.wfs=self.down.wfs
+        # the poller has its own staging table, so it can run while the daily run imports a period
+        self.import_data=ImportData(tmp_output_table="focuses_poller")
+        self.db=self.import_data.db
+        self.__prepareWatermarkTable()
+
+    def __prepareWatermarkTable(self):
+        try:
+            create="CREATE TABLE IF NOT EXISTS public.acquisition_data_watermark ("
+            create=f"{create} name character varying(80) PRIMARY KEY, last_datahora timestamp NOT NULL, "
+            create=f"{create} updated_at timestamp DEFAULT now());"
+            self.db.execQuery(create)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print('Error on create the watermark table')
+            print(e.__str__())
+            raise e
+
+    def getWatermark(self):
+        """
+        The datahora of the newest imported focus. Without a watermark, it is the start of the day after the last
+        period closed by the daily run, or the start of the current day.
+        """
+        row=self.db.fetchData(f"SELECT last_datahora FROM public.acquisition_data_watermark WHERE name='{self.name}';")
+        if row:
+            return row[0][0]
+        row=self.db.fetchData("SELECT MAX(end_date) FROM public.acquisition_data_control;")
+        if row and row[0][0] is not None:
+            return datetime.combine(row[0][0]+timedelta(days=1), datetime.min.time())
+        return datetime.combine(datetime.today().date(), datetime.min.time())
+
+    def __setWatermark(self, last_datahora):
+        update="INSERT INTO public.acquisition_data_watermark(name, last_datahora) VALUES (%s, %s) "
+        update=f"{update} ON CONFLICT (name) DO UPDATE SET updated_at=now(), "
+        update=f"{update} last_datahora=GREATEST(public.acquisition_data_watermark.last_datahora, EXCLUDED.last_datahora)"
+        self.db.execPrepared("acquisition_data_watermark_update", update, (self.name, last_datahora))
+
+    def __removeParts(self, base_file_name, total_files):
+        """
+        Remove the downloaded parts and the manifest of one poll, each poll has a new filter and new files.
+        """
+        file_names=[self.wfs.getPartFileName(base_file_name, n) for n in range(1, total_files)]+[f"{base_file_name}_manifest.json"]
+        for file_name in file_names:
+            file_path=f"{self.down.DATA_DIR}{os.sep}{file_name}"
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def poll(self):
+        """
+        Download and merge the focuses newer than the watermark, minus the overlap. Return the number of downloaded focuses.
+        """
+        metrics=resetRunMetrics("incremental_poll")
+        try:
+            watermark=self.getWatermark()
+            after=watermark-self.overlap
+            today=datetime.today().date()
+
+            self.wfs.setPeriod(start_date=after.strftime('%Y-%m-%d'), end_date=today.strftime('%Y-%m-%d'))
+            self.wfs.setFilter("{0} >= {1}".format(self.wfs.CQL_DATE_ATTRIBUTE, after.isoformat()))
+            try:
+                rows, base_file_name, total_files=self.wfs.download(output_dir=self.down.DATA_DIR)
+            finally:
+                self.wfs.setFilter(None)
+
+            if rows==0:
+                self.__removeParts(base_file_name, total_files)
+                print("No focuses after {0}.".format(after.isoformat()))
+                return 0
+
+            self.import_data.beginPeriod()
+            for file_number in range(1, total_files):
+                self.import_data.loadPart(file_name=self.wfs.getPartFileName(base_file_name, file_number), default_crs=self.wfs.getDefaultEPSG())
+            last_datahora=self.import_data.getLastStagedTime()
+
+            def setWatermark():
+                # written after the merge, in the transaction of the focuses, so the watermark never moves past focuses not committed
+                if last_datahora is not None:
+                    self.__setWatermark(last_datahora)
+            self.import_data.finishPeriod(complete=False, control=False, before_commit=setWatermark)
+            self.__removeParts(base_file_name, total_files)
+            print("Polled {0} focuses after {1}, the watermark is {2}.".format(rows, after.isoformat(), last_datahora))
+            return rows
+        except Exception as e:
+            self.import_data.rollback()
+            print('Error on poll the newest focuses')
+            print(e.__str__())
+            raise e
+        finally:
+            metrics.write(keep=self.keep_reports)
+
+    def run(self, loop=False):
+        """
+        Poll once, or poll every interval seconds until interrupted. In the loop, a failed poll is tried again on the
+        next interval, with a new database connection, since the failure may be a dropped connection.
+        """
+        if not loop:
+            return self.poll()
+        while True:
+            started=time.time()
+            try:
+                self.poll()
+            except Exception:
+                print("The poll failed, trying again in {0:.0f}s.".format(self.interval))
+                try:
+                    self.db.reconnect()
+                except Exception as e:
+                    print('Error on reconnect to the database')
+                    print(e.__str__())
+            time.sleep(max(self.interval-(time.time()-started), 0))
+
+# end of class
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Append the focuses newer than the datahora watermark.")
+    parser.add_argument("--loop", action="store_true", help="poll until interrupted, instead of once")
+    parser.add_argument("--interval", type=float, default=None, help="the seconds between two polls, see POLL_INTERVAL_SECONDS")
+    parser.add_argument("--overlap", type=float, default=None, help="the minutes read again before the watermark, see POLL_OVERLAP_MINUTES")
+    args=parser.parse_args()
+
+    IncrementalPoller(overlap_minutes=args.overlap, interval=args.interval).run(loop=args.loop)
@@ -0,0 +1,188 @@
+"""
+Run metrics
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to measure where a run spends its time, and to write the run report.
+
+    from tasks.metrics import getRunMetrics
+    with getRunMetrics().timer("staging_load"):
+        ...
+    getRunMetrics().add("rows_staged", rows)
+"""
+import os
+import json
+import time
+import resource
+import threading
+from glob import glob
+from contextlib import contextmanager
+from datetime import datetime
+
+# the metrics of the current run, shared by every task of the process
+_RUN=None
+_RUN_LOCK=threading.Lock()
+
+def getRunMetrics():
+    """
+    The metrics of the current run, created on the first call.
+    """
+    global _RUN
+    with _RUN_LOCK:
+        if _RUN is None:
+            _RUN=RunMetrics()
+        return _RUN
+
+def getMemoryUsage():
+    """
+    The resident set size of this process in MB. Read from /proc on Linux, or the peak size on other systems.
+    """
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/(1024.0*1024.0)
+    except (OSError, ValueError, IndexError):
+        return getPeakMemory()
+
+def getPeakMemory():
+    """
+    The peak resident set size of this process in MB.
+    """
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def resetRunMetrics(name="run"):
+    """
+    Start the metrics of a new run and return them.
+    """
+    global _RUN
+    with _RUN_LOCK:
+        _RUN=RunMetrics(name)
+        return _RUN
+
+"""
+    The timers and counters of one run.
+
+    Each stage has the number of calls and the sum of the time of each call, so a stage that runs in many threads,
+    like the page download, can sum more time than the run itself. The counters are totals, like bytes and rows,
+    or peaks, like the memory.
+"""
+class RunMetrics:
+
+    # the rates of the report, as (name, counter, stage)
+    RATES=[
+        ("download_bytes_per_second", "bytes_downloaded", "page_download"),
+        ("parse_features_per_second", "features_parsed", "parse"),
+        ("staging_rows_per_second", "rows_staged", "staging_load"),
+        ("merge_rows_per_second", "rows_merged", "merge"),
+    ]
+
+    def __init__(self, name="run"):
+        self.name=name
+        self.started_at=time.time()
+        self.stages={}
+        self.counters={}
+        self.__lock=threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Measure the time of one call of a stage.
+        """
+        start=time.time()
+        try:
+            yield
+        finally:
+            elapsed=time.time()-start
+            with self.__lock:
+                seconds, calls=self.stages.get(stage, (0.0, 0))
+                self.stages[stage]=(seconds+elapsed, calls+1)
+
+    def add(self, counter, value=1):
+        with self.__lock:
+            self.counters[counter]=self.counters.get(counter, 0)+value
+
+    def peak(self, counter, value):
+        """
+        Keep the maximum value of a counter, like the peak memory.
+        """
+        with self.__lock:
+            self.counters[counter]=max(self.counters.get(counter, value), value)
+
+    def getReport(self):
+        """
+        The report of the run as a dictionary, with the stages, the counters and the rates.
+        """
+        with self.__lock:
+            stages={stage:{"seconds":round(seconds, 3), "calls":calls} for stage,(seconds, calls) in self.stages.items()}
+            counters=dict(self.counters)
+        duration=time.time()-self.started_at
+        rates={}
+        for name, counter, stage in self.RATES:
+            seconds=stages.get(stage, {}).get("seconds", 0)
+            if counter in counters and seconds>0:
+                rates[name]=round(counters[counter]/seconds, 1)
+        if duration>0 and "rows_merged" in counters:
+            rates["rows_per_second"]=round(counters["rows_merged"]/duration, 1)
+        return {
+            "name":self.name,
+            "started_at":datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "duration":round(duration, 3),
+            "stages":stages,
+            "counters":counters,
+            "rates":rates
+        }
+
+    def __toPrometheus(self, report):
+        lines=[]
+        def metric(name, help, kind, values):
+            lines.append("# HELP fires_task_{0} {1}".format(name, help))
+            lines.append("# TYPE fires_task_{0} {1}".format(name, kind))
+            for labels, value in values:
+                lines.append("fires_task_{0}{1} {2}".format(name, labels, value))
+
+        run='run="{0}"'.format(self.name)
+        metric("duration_seconds", "The duration of the last run.", "gauge", [("{"+run+"}", report["duration"])])
+        metric("stage_seconds", "The time spent on each stage in the last run.", "gauge",
+               [('{{{0},stage="{1}"}}'.format(run, stage), v["seconds"]) for stage, v in report["stages"].items()])
+        metric("stage_calls", "The number of calls of each stage in the last run.", "gauge",
+               [('{{{0},stage="{1}"}}'.format(run, stage), v["calls"]) for stage, v in report["stages"].items()])
+        metric("counter", "The totals of the last run, like bytes and rows.", "gauge",
+               [('{{{0},name="{1}"}}'.format(run, name), value) for name, value in report["counters"].items()])
+        metric("rate", "The throughput of the stages of the last run.", "gauge",
+               [('{{{0},name="{1}"}}'.format(run, name), value) for name, value in report["rates"].items()])
+        metric("last_run_timestamp_seconds", "The end time of the last run.", "gauge", [("{"+run+"}", round(time.time()))])
+        return "\n".join(lines)+"\n"
+
+    def write(self, output_dir=None, keep=None):
+        """
+        Write the JSON run report and the Prometheus textfile. Return the report.
+
+            - output_dir, optional - the directory of the report files. Default is the METRICS_DIR env var or data/metrics.
+              The JSON report of each run is kept, the textfile {name}.prom is replaced on each run.
+            - keep, optional - the number of JSON reports of runs with the same name to keep, the older ones are removed.
+              Used by the frequent runs, like the incremental poller. Default is to keep all reports.
+        """
+        data_dir=os.getenv("DATA_DIR", os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data')
+        output_dir=output_dir if output_dir else os.getenv("METRICS_DIR", f"{data_dir}/metrics")
+        os.makedirs(output_dir, exist_ok=True)
+
+        report=self.getReport()
+        report_file="{0}/{1}_{2}.json".format(output_dir, self.name, datetime.fromtimestamp(self.started_at).strftime('%Y%m%d%H%M%S'))
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        if keep:
+            # the timestamp in the file name sorts the reports from the oldest to the newest
+            for old_file in sorted(glob("{0}/{1}_{2}.json".format(output_dir, self.name, "[0-9]"*14)))[:-keep]:
+                os.remove(old_file)
+
+        # the textfile collector may read the file at any time, so it is replaced only when complete
+        prom_file="{0}/fires_task_{1}.prom".format(output_dir, self.name)
+        with open(f"{prom_file}.tmp", 'w') as f:
+            f.write(self.__toPrometheus(report))
+        os.replace(f"{prom_file}.tmp", prom_file)
+
+        print("Run report: {0}".format(report_file))
+        return report
+
+# end of class
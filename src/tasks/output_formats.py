@@ -0,0 +1,198 @@
+"""
+WFS output formats
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+  Drivers for the GetFeature output formats supported by the download and import tasks.
+  The streaming drivers parse the features incrementally, chunk by chunk, as they are read.
+"""
+
+import os, re, csv, json, codecs, struct, zipfile
+
+"""
+    Base driver. Each driver defines the WFS output format name and the extension of the part files.
+"""
+class OutputFormat:
+
+    output_format=None
+    extension=None
+    # True if the features can be parsed by the iterFeatures method
+    streaming=False
+
+    @staticmethod
+    def readChunks(file_path, chunk_size=1024*1024):
+        """
+        Read a file as a sequence of byte chunks, the same way the response stream is read.
+        """
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    def iterFeatures(self, chunks):
+        """
+        Parse a sequence of byte chunks and yield the features as GeoJSON-like dictionaries.
+        """
+        raise NotImplementedError("The {0} output format can not be parsed as a stream.".format(self.output_format))
+
+    def countFeatures(self, file_path):
+        """
+        Return the number of features in one downloaded page. Raise an exception if the page is invalid.
+        """
+        return sum(1 for _ in self.iterFeatures(self.readChunks(file_path)))
+
+    def getLastValue(self, file_path, attribute):
+        """
+        Return the value of one attribute of the last feature in one downloaded page, used by the keyset paging.
+        """
+        last=None
+        for last in self.iterFeatures(self.readChunks(file_path)):
+            pass
+        if last is None or attribute not in last["properties"]:
+            raise Exception("The page {0} has no value of the {1} attribute.".format(file_path, attribute))
+        return last["properties"][attribute]
+
+class ShapeZipFormat(OutputFormat):
+
+    output_format="SHAPE-ZIP"
+    extension="zip"
+
+    def countFeatures(self, file_path):
+        """
+        Read the number of features from the DBF header inside the SHAPE-ZIP file.
+        """
+        with zipfile.ZipFile(file_path, "r") as zip_ref:
+            dbf_name=[name for name in zip_ref.namelist() if name.lower().endswith(".dbf")][0]
+            with zip_ref.open(dbf_name) as dbf:
+                header=dbf.read(8)
+        return struct.unpack("<I", header[4:8])[0]
+
+    def getLastValue(self, file_path, attribute):
+        """
+        Read the value of one attribute of the last record of the DBF file inside the SHAPE-ZIP file.
+        """
+        with zipfile.ZipFile(file_path, "r") as zip_ref:
+            dbf_name=[name for name in zip_ref.namelist() if name.lower().endswith(".dbf")][0]
+            dbf=zip_ref.read(dbf_name)
+
+        records, header_size, record_size=struct.unpack("<IHH", dbf[4:12])
+        # the field descriptors, 32 bytes each, start after the file header and end with 0x0D
+        offset, position=1, 32
+        while position<header_size and dbf[position]!=0x0D:
+            name=dbf[position:position+11].split(b"\x00")[0].decode("ascii", errors="ignore")
+            size=dbf[position+16]
+            if name.lower()==attribute.lower()[:10] and records>0:
+                start=header_size+(records-1)*record_size+offset
+                return dbf[start:start+size].decode("utf-8", errors="ignore").strip()
+            offset+=size
+            position+=32
+        raise Exception("The page {0} has no value of the {1} attribute.".format(file_path, attribute))
+
+class GeoJSONFormat(OutputFormat):
+
+    output_format="application/json"
+    extension="json"
+    streaming=True
+
+    __separators=re.compile(r'[\s,]*')
+
+    def iterFeatures(self, chunks):
+        """
+        Yield each item of the "features" array as soon as it is complete in the stream.
+        """
+        decoder=json.JSONDecoder()
+        text=codecs.getincrementaldecoder("utf-8")()
+        buffer=""
+        in_features=False
+        for chunk in chunks:
+            buffer+=text.decode(chunk)
+            if not in_features:
+                start=buffer.find('"features"')
+                start=buffer.find('[', start) if start>=0 else -1
+                if start<0:
+                    continue
+                buffer=buffer[start+1:]
+                in_features=True
+
+            pos=0
+            while True:
+                pos=self.__separators.match(buffer, pos).end()
+                if pos>=len(buffer):
+                    break
+                if buffer[pos]==']':
+                    return
+                try:
+                    feature, pos=decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    # the feature is not complete yet, wait for the next chunk
+                    break
+                yield feature
+            buffer=buffer[pos:]
+
+        raise ValueError("Incomplete GeoJSON document, the features array was not closed.")
+
+    def countFeatures(self, file_path):
+        """
+        Read the number of features from the "numberReturned" member written by GeoServer after the features array.
+        """
+        size=os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            f.seek(max(size-4096, 0))
+            tail=f.read().decode("utf-8", errors="ignore")
+        match=re.search(r'"numberReturned"\s*:\s*(\d+)', tail)
+        if match:
+            return int(match.group(1))
+        return super().countFeatures(file_path)
+
+class CSVFormat(OutputFormat):
+
+    output_format="csv"
+    extension="csv"
+    streaming=True
+
+    __wkt_types=("POINT", "MULTIPOINT", "LINESTRING", "MULTILINESTRING", "POLYGON", "MULTIPOLYGON", "GEOMETRYCOLLECTION")
+
+    def __iterLines(self, chunks):
+        text=codecs.getincrementaldecoder("utf-8")()
+        rest=""
+        for chunk in chunks:
+            lines=(rest+text.decode(chunk)).splitlines(keepends=True)
+            rest=lines.pop() if lines and not lines[-1].endswith(("\n","\r")) else ""
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+    def iterFeatures(self, chunks):
+        """
+        Yield each CSV row as a feature. The geometry column is written by GeoServer as WKT.
+        """
+        # shapely is only needed to parse the geometry, so it is loaded on demand
+        from shapely import wkt
+        from shapely.geometry import mapping
+
+        geometry_column=None
+        for row in csv.DictReader(self.__iterLines(chunks)):
+            if geometry_column is None:
+                geometry_column=next((k for k,v in row.items() if v and v.upper().startswith(self.__wkt_types)), "")
+            geometry=row.pop(geometry_column, None)
+            yield {
+                "type":"Feature",
+                "properties":row,
+                "geometry":mapping(wkt.loads(geometry)) if geometry else None
+            }
+
+    def countFeatures(self, file_path):
+        with open(file_path, 'r', newline='', encoding="utf-8") as f:
+            return max(sum(1 for _ in csv.reader(f))-1, 0)
+
+__formats=[ShapeZipFormat, GeoJSONFormat, CSVFormat]
+
+def getOutputFormat(name):
+    """
+    Return the driver for an output format name or for a part file extension.
+    """
+    for output_format in __formats:
+        if name and name.lower() in (output_format.output_format.lower(), output_format.extension):
+            return output_format()
+    raise Exception("Unsupported output format: {0}".format(name))
@@ -0,0 +1,286 @@
+"""
+GeoParquet archive
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to keep the downloaded focuses in a local GeoParquet archive, partitioned by day, so a period can be
+    imported again without the WFS.
+
+    cd src
+    python3 -m tasks.parquet_archive list
+    python3 -m tasks.parquet_archive import 2024-01-01 2024-12-31 --chunk month
+
+    The archive is written by the import task when the ARCHIVE_ENABLED env var is true. Each day is a directory,
+    date=YYYY-MM-DD, with the GeoParquet files of that day, and catalog.json has the archived days and periods.
+    The focuses without datahora are kept apart, in the date=unknown directory, and are never read by a period.
+"""
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import argparse
+from glob import glob
+from datetime import datetime, timedelta
+import pandas as pd
+import geopandas as gpd
+
+"""
+    The archive of the downloaded focuses.
+
+    The focuses of a period are written to a pending directory while the period is staged, and are moved into
+    the archive only when the period is committed. A complete period replaces the archived days, a partial
+    one, like the focuses completed by the reconciler, is added to them without the focuses already archived.
+"""
+class ParquetArchive:
+
+    CATALOG="catalog.json"
+    # the directory of the focuses without datahora, that belong to no day
+    UNKNOWN_DAY="unknown"
+
+    def __init__(self, archive_dir=None, id_column="foco_id"):
+        """
+        Constructor
+
+            - archive_dir, optional - the directory of the archive. Default is the ARCHIVE_DIR env var or data/archive.
+            - id_column, the column that identifies each focus, used to skip the focuses already archived.
+        """
+        data_dir=os.getenv("DATA_DIR", os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data')
+        self.archive_dir=archive_dir if archive_dir else os.getenv("ARCHIVE_DIR", f"{data_dir}/archive")
+        self.id_column=id_column
+        self.__pending=None
+        # the number of focuses of each pending day
+        self.__pending_days={}
+        # the number of pending focuses without datahora
+        self.__pending_unknown=0
+
+    def __getDayDir(self, base_dir, day):
+        return f"{base_dir}{os.sep}date={day}"
+
+    def __readCatalog(self):
+        catalog_file=f"{self.archive_dir}{os.sep}{self.CATALOG}"
+        if not os.path.exists(catalog_file):
+            return {"days":{}, "periods":[], "unknown":{"rows":0}}
+        with open(catalog_file, 'r') as f:
+            catalog=json.load(f)
+        catalog.setdefault("unknown", {"rows":0})
+        return catalog
+
+    def __writeCatalog(self, catalog):
+        catalog_file=f"{self.archive_dir}{os.sep}{self.CATALOG}"
+        with open(f"{catalog_file}.{os.getpid()}.tmp", 'w') as f:
+            json.dump(catalog, f, indent=2, sort_keys=True)
+        os.replace(f"{catalog_file}.{os.getpid()}.tmp", catalog_file)
+
+    def getCatalog(self):
+        return self.__readCatalog()
+
+    def getDays(self, start_date, end_date):
+        """
+        The archived days of a period, with the number of focuses of each day.
+        """
+        days=self.__readCatalog()["days"]
+        return {day:info for day, info in sorted(days.items()) if str(start_date)<=day<=str(end_date)}
+
+    def covers(self, start_date, end_date):
+        """
+        True if a complete period of the archive includes every day of the given period.
+        """
+        start, end=str(start_date), str(end_date)
+        periods=sorted((p["start_date"], p["end_date"]) for p in self.__readCatalog()["periods"])
+        day=start
+        for period_start, period_end in periods:
+            if period_start<=day<=period_end:
+                day=(datetime.strptime(period_end,'%Y-%m-%d')+timedelta(days=1)).strftime('%Y-%m-%d')
+            if day>end:
+                return True
+        return day>end
+
+    def __addToDay(self, source, target):
+        """
+        Move the pending files of one day into an archived day, without the focuses already archived in that day.
+        Return the number of added focuses.
+        """
+        archived=set()
+        for file_path in glob(f"{target}{os.sep}*.parquet"):
+            archived.update(pd.read_parquet(file_path, columns=[self.id_column])[self.id_column])
+        rows=0
+        for file_path in glob(f"{source}{os.sep}*.parquet"):
+            data=gpd.read_parquet(file_path)
+            data=data[~data[self.id_column].isin(archived)]
+            if not data.empty:
+                data.to_parquet(f"{target}{os.sep}{os.path.basename(file_path)}", index=False)
+                archived.update(data[self.id_column])
+                rows+=len(data)
+        return rows
+
+    def begin(self):
+        """
+        Start the archive of one period. The focuses written before are discarded if they were not committed.
+        """
+        self.discard()
+        self.__pending=f"{self.archive_dir}{os.sep}.pending_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.__pending, exist_ok=True)
+        self.__pending_days={}
+        self.__pending_unknown=0
+
+    def write(self, data):
+        """
+        Write a GeoDataFrame of focuses to the pending directory, one file for each day of the datahora attribute.
+        The focuses without a valid datahora are written to the unknown directory, so no focus is left out.
+        """
+        if self.__pending is None:
+            self.begin()
+        data=data.copy()
+        data["datahora"]=pd.to_datetime(data["datahora"], errors="coerce")
+        unknown=data["datahora"].isna()
+        if unknown.any():
+            print("{0} focuses without datahora are archived in the {1} directory.".format(int(unknown.sum()), self.UNKNOWN_DAY))
+            unknown_dir=self.__getDayDir(self.__pending, self.UNKNOWN_DAY)
+            os.makedirs(unknown_dir, exist_ok=True)
+            data[unknown].to_parquet(f"{unknown_dir}{os.sep}part-{uuid.uuid4().hex[:12]}.parquet", index=False)
+            self.__pending_unknown+=int(unknown.sum())
+            data=data[~unknown]
+        for day, rows in data.groupby(data["datahora"].dt.strftime('%Y-%m-%d')):
+            day_dir=self.__getDayDir(self.__pending, day)
+            os.makedirs(day_dir, exist_ok=True)
+            rows.to_parquet(f"{day_dir}{os.sep}part-{uuid.uuid4().hex[:12]}.parquet", index=False)
+            self.__pending_days[day]=self.__pending_days.get(day, 0)+len(rows)
+
+    def commit(self, period=None, complete=False):
+        """
+        Move the pending days into the archive and update the catalog.
+
+            - period, optional - the start and end date of the period. Default is the first and last pending day.
+            - complete, True if every focus of the period was written. The archived days of the period are
+              replaced and the period is added to the catalog. Otherwise the focuses are added to the archived days.
+        """
+        if self.__pending is None:
+            return
+        pending_days=self.__pending_days
+        if period is None and pending_days:
+            period=(min(pending_days), max(pending_days))
+
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            # the backfill workers share the archive, so the catalog is updated by one process at a time
+            with open(f"{self.archive_dir}{os.sep}.lock", 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                catalog=self.__readCatalog()
+                if complete and period is not None:
+                    # the days of the period without focuses are archived as empty days
+                    for day, info in self.getDays(period[0], period[1]).items():
+                        if day not in pending_days:
+                            shutil.rmtree(self.__getDayDir(self.archive_dir, day), ignore_errors=True)
+                            catalog["days"][day]={"rows":0}
+
+                for day, rows in pending_days.items():
+                    source=self.__getDayDir(self.__pending, day)
+                    target=self.__getDayDir(self.archive_dir, day)
+                    if complete or not os.path.isdir(target):
+                        shutil.rmtree(target, ignore_errors=True)
+                        os.replace(source, target)
+                        catalog["days"][day]={"rows":rows}
+                    else:
+                        rows=self.__addToDay(source, target)
+                        pending_days[day]=rows
+                        catalog["days"][day]={"rows":catalog["days"].get(day, {}).get("rows", 0)+rows}
+
+                # the focuses without datahora are only added, a complete period never replaces them
+                if self.__pending_unknown:
+                    target=self.__getDayDir(self.archive_dir, self.UNKNOWN_DAY)
+                    os.makedirs(target, exist_ok=True)
+                    rows=self.__addToDay(self.__getDayDir(self.__pending, self.UNKNOWN_DAY), target)
+                    catalog["unknown"]={"rows":catalog["unknown"]["rows"]+rows}
+
+                if complete and period is not None:
+                    start, end=str(period[0]), str(period[1])
+                    periods=[p for p in catalog["periods"] if not (start<=p["start_date"] and p["end_date"]<=end)]
+                    periods.append({"start_date":start, "end_date":end, "rows":sum(pending_days.values()),
+                                    "archived_at":datetime.now().isoformat(timespec="seconds")})
+                    catalog["periods"]=sorted(periods, key=lambda p: p["start_date"])
+                self.__writeCatalog(catalog)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            print("Archived {0} focuses of {1} days".format(sum(pending_days.values()), len(pending_days)))
+        except Exception as e:
+            print('Error on write the archive')
+            print(e.__str__())
+            raise e
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Remove the pending focuses of the current period.
+        """
+        if self.__pending is not None:
+            shutil.rmtree(self.__pending, ignore_errors=True)
+        self.__pending=None
+        self.__pending_days={}
+        self.__pending_unknown=0
+
+    def read(self, start_date, end_date, columns=None, filters=None):
+        """
+        Read the archived focuses of a period, one GeoDataFrame for each file.
+
+        Only the files of the days of the period are opened, the other days are never read.
+
+            - columns, optional - the attributes to read. The geometry is always read.
+            - filters, optional - the row filters, in the pyarrow format, like [("satelite", "=", "AQUA_M-T")].
+              They are applied while reading, and skip the row groups whose statistics do not match.
+        """
+        if columns is not None and "geometry" not in columns:
+            columns=list(columns)+["geometry"]
+        try:
+            for day in self.getDays(start_date, end_date):
+                for file_path in sorted(glob(f"{self.__getDayDir(self.archive_dir, day)}{os.sep}*.parquet")):
+                    data=gpd.read_parquet(file_path, columns=columns, filters=filters)
+                    if not data.empty:
+                        yield data
+        except Exception as e:
+            print('Error on read the archive')
+            print(e.__str__())
+            raise e
+
+# end of class
+
+def _getChunks(start_date, end_date, chunk):
+    start=datetime.strptime(start_date,'%Y-%m-%d').date()
+    end=datetime.strptime(end_date,'%Y-%m-%d').date()
+    chunks=[]
+    while start<=end:
+        if chunk=="day":
+            last=start
+        else:
+            next_month=(start.replace(day=28)+timedelta(days=4)).replace(day=1)
+            last=min(next_month-timedelta(days=1), end)
+        chunks.append((start.strftime('%Y-%m-%d'), min(last, end).strftime('%Y-%m-%d')))
+        start=last+timedelta(days=1)
+    return chunks
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="List the local GeoParquet archive or import a period from it.")
+    parser.add_argument("command", choices=["list", "import"])
+    parser.add_argument("start_date", nargs="?", help="the first day of the period to import, YYYY-MM-DD")
+    parser.add_argument("end_date", nargs="?", help="the last day of the period to import, YYYY-MM-DD")
+    parser.add_argument("--chunk", default="month", choices=["day", "month"], help="the period imported in each transaction")
+    parser.add_argument("--satellite", default=None, help="import only the focuses of this satellite")
+    args=parser.parse_args()
+
+    archive=ParquetArchive()
+    if args.command=="list":
+        catalog=archive.getCatalog()
+        for period in catalog["periods"]:
+            print("{start_date} to {end_date}: {rows} focuses, archived at {archived_at}".format(**period))
+        print("{0} days, {1} focuses".format(len(catalog["days"]), sum(d["rows"] for d in catalog["days"].values())))
+        if catalog["unknown"]["rows"]:
+            print("{0} focuses without datahora".format(catalog["unknown"]["rows"]))
+    else:
+        if not args.start_date or not args.end_date:
+            parser.error("the import command needs the start and end date")
+        from tasks.import_data import ImportData
+        import_data=ImportData()
+        filters=[("satelite", "=", args.satellite)] if args.satellite else None
+        for start_date, end_date in _getChunks(args.start_date, args.end_date, args.chunk):
+            import_data.importArchive(start_date, end_date, filters=filters)
@@ -0,0 +1,205 @@
+"""
+Partition manager
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+    Used to keep the final table of focuses partitioned by month on the data column.
+
+    cd src
+    python3 -m tasks.partition_manager migrate
+    python3 -m tasks.partition_manager ensure 2024-01-01 2024-12-31
+
+    The migrate command replaces a regular table by a partitioned one with the same columns and copies the rows,
+    month by month. The previous table is kept as {table}_unpartitioned, with the rows without date, that are
+    not copied. The ensure command creates the monthly partitions of a period, as the import task does before
+    copying each period.
+"""
+import os
+import argparse
+from datetime import date, datetime
+from tasks.psqldb import PsqlDB
+
+"""
+    The monthly range partitions of the final table.
+
+    Each partition is named {table}_yYYYYmMM. The unique key is (uuid, data), so it is checked inside one
+    partition only, and the primary key is (fid, data), so the data column is required. There is no default
+    partition, the partitions of each period are created before its rows are copied, see ensurePartitions.
+"""
+class PartitionManager:
+
+    def __init__(self, db, table="focos_aqua_referencia"):
+        """
+        Constructor
+
+            - db, a connected PsqlDB instance.
+            - table, the name of the final table in the public schema.
+        """
+        self.db=db
+        self.table=table
+        self.__partitioned=None
+        # the months that already have a partition, as (year, month)
+        self.__months=set()
+
+    @staticmethod
+    def getMonths(start_date, end_date):
+        """
+        The (year, month) tuples from the month of the start date to the month of the end date.
+        """
+        start=datetime.strptime(str(start_date)[:10],'%Y-%m-%d').date()
+        end=datetime.strptime(str(end_date)[:10],'%Y-%m-%d').date()
+        months=[]
+        year, month=start.year, start.month
+        while (year, month)<=(end.year, end.month):
+            months.append((year, month))
+            year, month=(year+1, 1) if month==12 else (year, month+1)
+        return months
+
+    def getPartitionName(self, year, month):
+        return "{0}_y{1:04d}m{2:02d}".format(self.table, year, month)
+
+    def isPartitioned(self):
+        """
+        True if the final table is a partitioned table. The answer is read once.
+        """
+        if self.__partitioned is None:
+            row=self.db.fetchData(f"SELECT relkind FROM pg_class WHERE oid=to_regclass('public.{self.table}');")
+            self.__partitioned=bool(row) and row[0][0]=='p'
+        return self.__partitioned
+
+    def __getExistingMonths(self):
+        existing=f"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid=i.inhrelid "
+        existing=f"{existing} WHERE i.inhparent=to_regclass('public.{self.table}')"
+        months=set()
+        for row in self.db.fetchData(existing):
+            name=row[0][len(self.table):]
+            if len(name)==9 and name.startswith("_y") and name[6]=="m":
+                months.add((int(name[2:6]), int(name[7:9])))
+        return months
+
+    def __createPartition(self, year, month):
+        start=date(year, month, 1)
+        end=date(year+1, 1, 1) if month==12 else date(year, month+1, 1)
+        create=f"CREATE TABLE IF NOT EXISTS public.{self.getPartitionName(year, month)} "
+        create=f"{create} PARTITION OF public.{self.table} FOR VALUES FROM ('{start}') TO ('{end}');"
+        self.db.execQuery(create)
+
+    def ensurePartitions(self, start_date, end_date, commit=True):
+        """
+        Create the missing monthly partitions of a period. Return the names of the partitions of the period.
+
+        The partitions are created under an advisory lock, so concurrent imports, like the backfill workers, do
+        not create the same partition twice. If any partition is created and commit is True, the transaction is
+        committed. The import task uses commit False, so the partitions are committed with the period and the
+        lock is held until then.
+        """
+        months=self.getMonths(start_date, end_date)
+        if not self.isPartitioned():
+            return []
+
+        if not set(months)<=self.__months:
+            self.__months=self.__getExistingMonths()
+        missing=[m for m in months if m not in self.__months]
+        if missing:
+            try:
+                self.db.execQuery(f"SELECT pg_advisory_xact_lock(hashtext('public.{self.table}_partitions'));")
+                for year, month in missing:
+                    print("Creating the partition {0}".format(self.getPartitionName(year, month)))
+                    self.__createPartition(year, month)
+                if commit:
+                    self.db.commit()
+                self.__months.update(missing)
+            except Exception as e:
+                print('Error on create the partitions')
+                print(e.__str__())
+                raise e
+
+        return [self.getPartitionName(year, month) for year, month in months]
+
+    def forget(self):
+        """
+        Forget the known partitions, used after a rollback of partitions created without commit.
+        """
+        self.__months=set()
+
+    def analyzePartitions(self, start_date, end_date):
+        """
+        Update the planner statistics of the partitions of a period only.
+        """
+        for name in self.ensurePartitions(start_date, end_date, commit=False):
+            self.db.execQuery(f"ANALYZE public.{name};")
+
+    def migrate(self):
+        """
+        Replace the regular final table by a partitioned one and copy the rows month by month, in one transaction.
+        The previous table is renamed to {table}_unpartitioned and is not dropped. The rows without date can not be
+        in the partitioned table, so they are only counted and kept in the previous table.
+        """
+        if self.isPartitioned():
+            print("The table {0} is already partitioned.".format(self.table))
+            return
+
+        old=f"{self.table}_unpartitioned"
+        try:
+            self.db.execQuery(f"ALTER TABLE public.{self.table} RENAME TO {old};")
+
+            # the same columns and defaults, the fid default still uses the sequence of the previous table
+            create=f"CREATE TABLE public.{self.table} (LIKE public.{old} INCLUDING DEFAULTS, "
+            create=f"{create} CONSTRAINT {self.table}_fid_data_pkey PRIMARY KEY (fid, data), "
+            create=f"{create} CONSTRAINT {self.table}_uuid_data_unique UNIQUE (uuid, data)) PARTITION BY RANGE (data);"
+            self.db.execQuery(create)
+            self.db.execQuery(f"CREATE INDEX IF NOT EXISTS {self.table}_geom_part_idx ON public.{self.table} USING gist (geom);")
+
+            # the sequence is dropped with the table that owns it, so it is moved to the new table
+            row=self.db.fetchData(f"SELECT pg_get_serial_sequence('public.{old}', 'fid');")
+            if row and row[0][0]:
+                self.db.execQuery(f"ALTER SEQUENCE {row[0][0]} OWNED BY public.{self.table}.fid;")
+
+            self.__partitioned=True
+            self.__months=set()
+            row=self.db.fetchData(f"SELECT MIN(data), MAX(data) FROM public.{old};")
+            if row and row[0][0] is not None:
+                for year, month in self.getMonths(row[0][0], row[0][1]):
+                    self.__createPartition(year, month)
+                    name=self.getPartitionName(year, month)
+                    copy=f"INSERT INTO public.{name} SELECT * FROM public.{old} "
+                    copy=f"{copy} WHERE data>='{date(year, month, 1)}' AND data<'{date(year+1, 1, 1) if month==12 else date(year, month+1, 1)}';"
+                    self.db.execQuery(copy)
+                    print("Copied the month {0:04d}-{1:02d} to {2}".format(year, month, name))
+            row=self.db.fetchData(f"SELECT count(*) FROM public.{old} WHERE data IS NULL;")
+            if row and row[0][0]:
+                print("{0} rows without date were not copied, they are kept in {1}.".format(row[0][0], old))
+            self.db.execQuery(f"ANALYZE public.{self.table};")
+            self.db.commit()
+            print("The table {0} is partitioned by month, the previous table is {1}.".format(self.table, old))
+        except Exception as e:
+            self.db.rollback()
+            self.__partitioned=None
+            print('Error on migrate to the partitioned table')
+            print(e.__str__())
+            raise e
+
+# end of class
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Manage the monthly partitions of the final table of focuses.")
+    parser.add_argument("command", choices=["migrate", "ensure"])
+    parser.add_argument("start_date", nargs="?", help="the first day of the period of the ensure command, YYYY-MM-DD")
+    parser.add_argument("end_date", nargs="?", help="the last day of the period of the ensure command, YYYY-MM-DD")
+    parser.add_argument("--table", default="focos_aqua_referencia")
+    args=parser.parse_args()
+
+    db_conf_file = os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data/config/'
+    db = PsqlDB(db_conf_file,'db.cfg','raw_fires_data')
+    db.connect()
+    try:
+        manager=PartitionManager(db, args.table)
+        if args.command=="migrate":
+            manager.migrate()
+        else:
+            if not args.start_date or not args.end_date:
+                parser.error("the ensure command needs the start and end date")
+            print(manager.ensurePartitions(args.start_date, args.end_date))
+    finally:
+        db.close()
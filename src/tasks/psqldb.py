@@ -1,8 +1,17 @@
 #!/usr/bin/python3
 import os
+import re
+import uuid
+import threading
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from tasks.config_loader import ConfigLoader
 
+# one connection pool per connection string, shared by all PsqlDB instances of the process, with a semaphore
+# of the pool size, so a caller waits for a free connection instead of failing when all of them are in use
+_POOLS={}
+_POOLS_LOCK=threading.Lock()
+
 class ConnectionError(BaseException):
     """
     Exception raised for errors in the DB connection.
@@ -54,9 +63,19 @@ class PsqlDB:
         To support the secrets from swarm mode, you can set the user and password to Geoserver:
             - POSTGRES_USER_FILE, user, the location of secret file on memory in runtime;
             - POSTGRES_PASS_FILE, password, the location of secret file on memory in runtime;
+
+        The connections are taken from a process-wide pool. Optional settings, from the configuration file or env vars:
+            - pool_size or POSTGRES_POOL_SIZE, the maximum number of connections in the pool. Default is 5.
+            - pool_timeout or POSTGRES_POOL_TIMEOUT, the seconds to wait for a free connection of the pool. Default is 300.
+            - prepare_statements or POSTGRES_PREPARE_STATEMENTS, use server-side prepared statements. Default is true.
+              Set it to false behind a pgbouncer in transaction mode, which does not keep prepared statements.
         """
         self.conn = None
         self.cur = None
+        self.__pool = None
+        self.__slots = None
+        # the names of the statements already prepared in the current connection
+        self.__prepared = set()
 
         try:
             conf = ConfigLoader(config_path, filename, section)
@@ -77,6 +96,9 @@ class PsqlDB:
         self.db_name=self.params["dbname"] if self.params["dbname"] else os.getenv("POSTGRES_DBNAME", "postgres")
         self.db_host=self.params["host"] if self.params["host"] else os.getenv("POSTGRES_HOST", "localhost")
         self.db_port=self.params["port"] if self.params["port"] else os.getenv("POSTGRES_PORT", 5432)
+        self.pool_size=int(self.params.get("pool_size") or os.getenv("POSTGRES_POOL_SIZE", 5))
+        self.pool_timeout=float(self.params.get("pool_timeout") or os.getenv("POSTGRES_POOL_TIMEOUT", 300))
+        self.prepare_statements=str(self.params.get("prepare_statements") or os.getenv("POSTGRES_PREPARE_STATEMENTS", "true")).lower()=="true"
 
     def getDBParameters(self):
         """
@@ -93,11 +115,28 @@ class PsqlDB:
         return db
 
     def connect(self):
+        if self.conn is not None:
+            return
         try:
             # connect to the PostgreSQL server
             str_conn=f"dbname={self.db_name} user={self.db_user} password={self.db_pass} host={self.db_host} port={self.db_port}"
-            self.conn = psycopg2.connect(str_conn)
+            with _POOLS_LOCK:
+                if str_conn not in _POOLS:
+                    _POOLS[str_conn]=(ThreadedConnectionPool(1, self.pool_size, str_conn), threading.BoundedSemaphore(self.pool_size))
+                self.__pool, self.__slots=_POOLS[str_conn]
+            if not self.__slots.acquire(timeout=self.pool_timeout):
+                raise Exception("No free connection in the pool after {0:.0f}s.".format(self.pool_timeout))
+            try:
+                self.conn = self.__pool.getconn()
+            except Exception:
+                self.__slots.release()
+                raise
             self.cur = self.conn.cursor()
+            # a pooled connection can already have prepared statements
+            self.__prepared=set()
+            if self.prepare_statements:
+                self.cur.execute("SELECT name FROM pg_prepared_statements;")
+                self.__prepared=set(row[0] for row in self.cur.fetchall())
         except (Exception, psycopg2.DatabaseError) as error:
             raise ConnectionError('Missing connection:', str(error))
     
@@ -106,9 +145,32 @@ class PsqlDB:
         if self.cur is not None:
             self.cur.close()
             self.cur = None
-        # disconnect from the PostgreSQL server
+        # give the connection back to the pool, an open transaction is rolled back
+        if self.conn is not None:
+            try:
+                self.__pool.putconn(self.conn)
+            finally:
+                self.conn = None
+                self.__slots.release()
+
+    def reconnect(self):
+        """
+        Discard the current connection, that may be broken, and connect again. Used by long-running tasks.
+        """
+        if self.cur is not None:
+            try:
+                self.cur.close()
+            except Exception:
+                pass
+            self.cur = None
         if self.conn is not None:
-            self.conn.close()
+            # the connection is closed instead of given back, so the pool never hands it out again
+            try:
+                self.__pool.putconn(self.conn, close=True)
+            finally:
+                self.conn = None
+                self.__slots.release()
+        self.connect()
 
     def commit(self):
         # if is connected
@@ -145,6 +207,84 @@ class PsqlDB:
             raise QueryError('Query execute issue', error)
             
 
+    def execPrepared(self, name, query, params=None, fetch=False):
+        """
+        Execute a statement that is repeated many times, as a server-side prepared statement.
+
+            - name, the name of the prepared statement.
+            - query, the statement with the psycopg2 placeholders (%s), in the same order as the params.
+            - params, the values of the placeholders.
+            - fetch, if True, return all rows of the result.
+        """
+        params=list(params) if params else []
+        try:
+            if self.cur is None:
+                raise ConnectionError('Missing cursor:', 'Has no valid database cursor ({0})'.format(query))
+
+            if not self.prepare_statements:
+                self.cur.execute(query, params)
+            else:
+                if name not in self.__prepared:
+                    counter=iter(range(1, len(params)+1))
+                    self.cur.execute("PREPARE {0} AS {1}".format(name, re.sub(r"%s", lambda m: "${0}".format(next(counter)), query)))
+                    self.__prepared.add(name)
+                placeholders="({0})".format(", ".join(["%s"]*len(params))) if params else ""
+                self.cur.execute("EXECUTE {0} {1}".format(name, placeholders), params)
+
+            if fetch:
+                return self.cur.fetchall()
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.rollback()
+            raise QueryError('Query execute issue', error)
+        except (BaseException) as error:
+            self.rollback()
+            raise QueryError('Query execute issue', error)
+
+    def fetchBatches(self, query, batch_size=10000):
+        """
+        Read the result of a query in batches, using a server-side (named) cursor, so only one batch is in memory.
+
+        Yield each batch as a list of rows.
+        """
+        if self.conn is None:
+            raise ConnectionError('Missing connection:', 'Has no valid database connection ({0})'.format(query))
+
+        cur=self.conn.cursor(name="psqldb_{0}".format(uuid.uuid4().hex))
+        cur.itersize=batch_size
+        try:
+            cur.execute(query)
+            while True:
+                rows=cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.rollback()
+            raise QueryError('Query execute issue', error)
+        finally:
+            try:
+                cur.close()
+            except psycopg2.Error:
+                # the cursor is already gone with the aborted transaction
+                pass
+
+    def copyFrom(self, query, data):
+        """
+        Run a COPY ... FROM STDIN statement reading the rows from a file-like object.
+        """
+        try:
+            if self.cur is None:
+                raise ConnectionError('Missing cursor:', 'Has no valid database cursor ({0})'.format(query))
+            self.cur.copy_expert(query, data)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.rollback()
+            raise QueryError('Query execute issue', error)
+        except (BaseException) as error:
+            self.rollback()
+            raise QueryError('Query execute issue', error)
+
     def fetchData(self, query):
         data = None
         try:
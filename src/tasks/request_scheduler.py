@@ -0,0 +1,171 @@
+"""
+Request scheduler
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+  Used by the WFS client to send each request with retries and an adaptive number of concurrent requests.
+"""
+
+import time, random, threading
+import requests
+
+"""
+    An error in the content of a response that is worth a new request, like an incomplete page.
+"""
+class RetryableError(Exception):
+    pass
+
+"""
+    Send requests over a shared session with retries, jittered exponential backoff and an AIMD concurrency limit.
+
+    The limit of concurrent requests starts at the maximum. It grows by about one request for each limit successful
+    requests (additive increase) and is halved on a 429 or 503 response, on a timeout or when the latency per feature
+    is much higher than its moving average (multiplicative decrease). The latency is only a signal after a few
+    responses of the same kind and when the response is slower than expected by more than an absolute delay, so the
+    jitter of a fast server never decreases the limit. The decrease happens at most once per cooldown,
+    so a burst of failures of the requests already running counts as one signal.
+"""
+class RequestScheduler:
+
+    # the responses that mean the server is overloaded
+    THROTTLE_STATUS=(429, 503)
+    # the responses worth a new request
+    RETRY_STATUS=(429, 500, 502, 503, 504)
+
+    def __init__(self, session, max_concurrency=4, max_retries=4, backoff=1.0, timeout=300, latency_factor=4.0, latency_weight=0.2,
+                 latency_samples=5, latency_delay=1.0):
+        """
+        Constructor
+
+            - session, the requests session used to send the requests.
+            - max_concurrency, the maximum number of concurrent requests.
+            - max_retries, the number of new requests after a failed one.
+            - backoff, the base delay in seconds before a new request. It doubles on each retry and has a random jitter.
+            - timeout, the timeout in seconds to connect and to read each piece of the response.
+            - latency_factor, a response with a latency per feature this many times higher than the moving average of
+              the same kind of request is a sign of overload.
+            - latency_weight, the weight of each response in the exponentially weighted moving average of the latency.
+            - latency_samples, the number of responses of a kind of request before its latency is compared.
+            - latency_delay, the minimum time in seconds that a response is slower than expected to be a sign of overload.
+        """
+        self.session=session
+        self.max_concurrency=max(int(max_concurrency),1)
+        self.max_retries=max(int(max_retries),0)
+        self.backoff=float(backoff)
+        self.timeout=float(timeout)
+        self.latency_factor=float(latency_factor)
+        self.latency_weight=float(latency_weight)
+        self.latency_samples=max(int(latency_samples),1)
+        self.latency_delay=float(latency_delay)
+
+        self.__condition=threading.Condition()
+        self.__active=0
+        self.__limit=float(self.max_concurrency)
+        self.__last_decrease=0.0
+        # the moving average of the latency per feature of each kind of request, and its number of responses
+        self.__avg_latency={}
+        self.__samples={}
+        self.stats={"requests":0, "retries":0, "throttled":0, "timeouts":0, "decreases":0}
+
+    def __acquire(self):
+        with self.__condition:
+            while self.__active>=int(self.__limit):
+                self.__condition.wait()
+            self.__active+=1
+            self.stats["requests"]+=1
+
+    def __release(self):
+        with self.__condition:
+            self.__active-=1
+            self.__condition.notify_all()
+
+    def __count(self, name):
+        with self.__condition:
+            self.stats[name]+=1
+
+    def __increase(self, kind, latency, units=1):
+        with self.__condition:
+            # a short last page is not compared with the full pages, only the time of each feature is
+            units=max(units,1)
+            avg_latency=self.__avg_latency.get(kind, latency/units)
+            samples=self.__samples.get(kind, 0)
+            self.__avg_latency[kind]=avg_latency+self.latency_weight*(latency/units-avg_latency)
+            self.__samples[kind]=samples+1
+            expected=avg_latency*units
+            if samples>=self.latency_samples and latency>expected*self.latency_factor and latency-expected>=self.latency_delay:
+                self.__decrease(locked=True)
+                return
+            self.__limit=min(self.__limit+1.0/self.__limit, float(self.max_concurrency))
+            self.__condition.notify_all()
+
+    def __decrease(self, locked=False):
+        if not locked:
+            with self.__condition:
+                return self.__decrease(locked=True)
+        now=time.time()
+        if now-self.__last_decrease>=max(self.backoff,1.0):
+            self.__limit=max(self.__limit/2.0, 1.0)
+            self.__last_decrease=now
+            self.stats["decreases"]+=1
+
+    def __wait(self, attempt, retry_after=None):
+        delay=self.backoff*(2**attempt)
+        delay=random.uniform(delay/2.0, delay)
+        if retry_after and retry_after.isdigit():
+            delay=max(delay, float(retry_after))
+        self.__count("retries")
+        time.sleep(delay)
+
+    def call(self, url, handler, stream=False, kind="default", units=None):
+        """
+        Send a GET request and return the result of the handler, called with the response while the request holds
+        its concurrency slot. The request is sent again on a connection error, a timeout, a retryable HTTP status or
+        a RetryableError raised by the handler. Other responses are given to the handler, that checks response.ok.
+        Raise an exception when the retries are exhausted.
+
+            - kind, the name of the kind of request, the latency is only compared between requests of the same kind.
+            - units, optional - a function called with the result, that returns the number of features of the response.
+              The latency is divided by it. Default is one unit for each response.
+        """
+        error=retry_after=None
+        for attempt in range(self.max_retries+1):
+            if attempt>0:
+                self.__wait(attempt-1, retry_after)
+                retry_after=None
+            self.__acquire()
+            try:
+                start=time.time()
+                with self.session.get(url, stream=stream, timeout=self.timeout) as response:
+                    latency=time.time()-start
+                    if response.status_code in self.RETRY_STATUS:
+                        retry_after=response.headers.get("Retry-After")
+                        if response.status_code in self.THROTTLE_STATUS:
+                            self.__count("throttled")
+                            self.__decrease()
+                        raise RetryableError("HTTP Error: {0}".format(response.status_code))
+                    result=handler(response)
+                self.__increase(kind, latency, units(result) if units is not None else 1)
+                return result
+            except requests.exceptions.Timeout as e:
+                self.__count("timeouts")
+                self.__decrease()
+                error=e
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, RetryableError) as e:
+                error=e
+            finally:
+                self.__release()
+            print("Request failed, attempt {0} of {1}: {2}".format(attempt+1, self.max_retries+1, error))
+
+        raise Exception("The request has failed after {0} attempts: {1}".format(self.max_retries+1, error))
+
+    def getStats(self):
+        """
+        The number of requests, retries, throttled responses, timeouts and concurrency decreases, and the current limit.
+        """
+        with self.__condition:
+            stats=dict(self.stats)
+            stats["limit"]=int(self.__limit)
+            return stats
+
+# end of class
@@ -8,42 +8,56 @@ Usage:
 """
 from tasks.data_checker import DataChecker
 from tasks.download_data import DownloadData
-from tasks.import_data import ImportData
+from tasks.metrics import resetRunMetrics
 
 class UpdateDatabase:
     """
         The Update Previous is used to perform the update of previously imported data to complete the series.
+
+        The import modules load the geographic libraries (geopandas, GDAL), so they are only imported, and
+        their database connections opened, when there is something to import.
     """
 
     def __init__(self):
         self.dc=DataChecker()
         self.down=DownloadData()
-        self.import_data=ImportData()
+        self.import_data=None
+        self.reconciler=None
+
+    def __getImportData(self):
+        if self.import_data is None:
+            from tasks.import_data import ImportData
+            self.import_data=ImportData()
+        return self.import_data
+
+    def __getReconciler(self):
+        if self.reconciler is None:
+            from tasks.data_reconciler import DataReconciler
+            self.reconciler=DataReconciler(self.down, self.__getImportData())
+        return self.reconciler
 
     def updateCurrentData(self):
-        # download data
-        num_rows, base_file_name, total_files, default_crs=self.down.get()
-        if num_rows>0 and total_files>=1:
-            # import to database
-            file_number=1
-            while file_number<total_files:
-                file_name="{0}_part{1}.zip".format(base_file_name, file_number)
-                self.import_data.importFile(file_name=file_name, default_crs=default_crs)
-                file_number+=1
+        metrics=resetRunMetrics("update_current_data")
+        try:
+            if self.down.START_DATE is None and self.down.isUpToDate():
+                print("Nothing to download, the data is up to date.")
+                return
+
+            from tasks.import_pipeline import ImportPipeline
+            # download data and import each part to database while the next ones are downloaded
+            ImportPipeline(self.down, self.__getImportData()).run()
+        finally:
+            metrics.write()
 
     def updateLastData(self):
-
-        update_data=self.dc.check()
-
-        for aData in update_data:
-            self.down.setPeriod(start_date=aData["start_date"],end_date=aData["end_date"])
-            num_rows, base_file_name, total_files, default_crs=self.down.get()
-            if num_rows==aData["num_rows"]:
-                # import to database
-                file_number=1
-                while file_number<total_files:
-                    file_name="{0}_part{1}.zip".format(base_file_name, file_number)
-                    self.import_data.importFile(file_name=file_name, default_crs=default_crs, reloaded_id=aData["id"])
-                    file_number+=1
+        metrics=resetRunMetrics("update_last_data")
+        try:
+            update_data=self.dc.check()
+
+            for aData in update_data:
+                # download only the focuses missing in the period
+                self.__getReconciler().reconcile(aData)
+        finally:
+            metrics.write()
 
 # end class
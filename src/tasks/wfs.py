@@ -7,10 +7,19 @@ Usage:
   Basic WFS client functions to get count and download data
 """
 
-import requests, os, io
+import requests, os, io, hashlib
+from functools import partial
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from xml.etree import ElementTree as xmlTree
 from tasks.config_loader import ConfigLoader
+from tasks.download_manifest import DownloadManifest
+from tasks.metrics import getRunMetrics
+from tasks.output_formats import getOutputFormat
+from tasks.request_scheduler import RequestScheduler, RetryableError
+from tasks.wfs_cache import WFSCache
 
 """
     WFS client with basic functions.
@@ -40,6 +49,22 @@ class WFS:
             - output_dir, to define the location where the output files will be stored.
             - user, the user name used to authentication on the server.
             - password, the password value used to authentication on the server.
+            - download_workers, the number of pages downloaded, or periods counted, in parallel. Default is 4.
+            - output_format, the GetFeature output format: SHAPE-ZIP, application/json or csv. Default is SHAPE-ZIP.
+            - id_attribute, the column name that identifies each feature. Default is foco_id.
+            - cache_dir, the directory of the persistent cache of WFS responses. Default is the data/cache directory.
+            - cache_ttl, the time in seconds that the capabilities and the feature type description are cached. Default is 86400.
+            - hits_ttl, the time in seconds that the number of results of a not frozen period is cached. Default is 0.
+            - frozen_after_days, the number of days after the end date to consider a period as frozen. The number of
+              results of a frozen period is always read from the cache. Default is 30.
+            - max_retries, the number of new requests after a failed one. Default is 4.
+            - retry_backoff, the base delay in seconds before a new request, doubled on each retry. Default is 1.
+            - request_timeout, the timeout in seconds to connect and to read each piece of a response. Default is 300.
+            - paging_mode, how the period is split into pages. Default is offset.
+                offset, pages of the whole period by startIndex;
+                window, the period is split into time windows that fit in one page, using the number of results;
+                keyset, as window, and the pages of a window larger than the server limit are read after the
+                last sort value of the previous page, instead of by startIndex.
 
         From configuration file:
             - config_path = 'the/path/to/config/file/'
@@ -75,62 +100,159 @@ class WFS:
             if os.path.exists(self.GEOSERVER_PASS):
                 self.GEOSERVER_PASS = open(self.GEOSERVER_PASS, 'r').read()
 
+            self.DOWNLOAD_WORKERS=int(self.__getParam("download_workers", "DOWNLOAD_WORKERS", 4))
+            self.OUTPUT_FORMAT=getOutputFormat(self.__getParam("output_format", "OUTPUT_FORMAT", "SHAPE-ZIP"))
+            self.ID_ATTRIBUTE=self.__getParam("id_attribute", "ID_ATTRIBUTE", "foco_id")
+            data_dir=os.getenv("DATA_DIR", os.path.realpath(os.path.dirname(__file__) + '/../../') + '/data')
+            self.CACHE_DIR=self.__getParam("cache_dir", "CACHE_DIR", f"{data_dir}/cache")
+            self.CACHE_TTL=int(self.__getParam("cache_ttl", "CACHE_TTL", 86400))
+            self.HITS_TTL=int(self.__getParam("hits_ttl", "HITS_TTL", 0))
+            self.FROZEN_AFTER_DAYS=int(self.__getParam("frozen_after_days", "FROZEN_AFTER_DAYS", 30))
+            self.MAX_RETRIES=int(self.__getParam("max_retries", "MAX_RETRIES", 4))
+            self.RETRY_BACKOFF=float(self.__getParam("retry_backoff", "RETRY_BACKOFF", 1))
+            self.REQUEST_TIMEOUT=float(self.__getParam("request_timeout", "REQUEST_TIMEOUT", 300))
+            self.PAGING_MODE=self.__getParam("paging_mode", "PAGING_MODE", "offset").lower()
+            if self.PAGING_MODE not in ("offset", "window", "keyset"):
+                raise Exception("Unsupported paging mode: {0}".format(self.PAGING_MODE))
+
         except Exception as configError:
             raise configError
 
         self.serverLimitByTarget=10000
+        # a time window is not split below this width, its pages are read by startIndex or keyset
+        self.minWindowSeconds=60
+        # the size of each piece read from the response stream and written to disk
+        self.chunkSize=1024*1024
         self.CQL_START_DATE=None
         self.CQL_END_DATE=None
+        self.CQL_EXTRA_FILTER=None
+        # if False, the pages listed by the manifest of a previous download of the period are never reused
+        self.RESUME_PAGES=True
+        self.cache=WFSCache("{0}/wfs_cache.json".format(self.CACHE_DIR))
 
         self.AUTH=None
         if self.GEOSERVER_USER and self.GEOSERVER_PASS:
             self.AUTH=HTTPBasicAuth(self.GEOSERVER_USER, self.GEOSERVER_PASS)
 
+        # one keep-alive session shared by all requests, with a connection pool sized to the download workers
+        self.session=requests.Session()
+        adapter=HTTPAdapter(pool_connections=1, pool_maxsize=max(self.DOWNLOAD_WORKERS,1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if self.AUTH:
+            self.session.auth=self.AUTH
+        # every request is sent by the scheduler, that retries the failed ones and adapts the number of concurrent requests
+        self.scheduler=RequestScheduler(self.session, max_concurrency=self.DOWNLOAD_WORKERS, max_retries=self.MAX_RETRIES,
+                                        backoff=self.RETRY_BACKOFF, timeout=self.REQUEST_TIMEOUT)
+
+    def __getParam(self, name, env_name, default):
+        """
+        Read an optional parameter from the configuration file, or from the environment if it is missing.
+        """
+        value=self.params.get(name)
+        return value if value else os.getenv(env_name, default)
+
     def __buildBaseURL(self):
 
         return "{0}/{1}/{2}/wfs".format(self.GEOSERVER_BASE_URL,self.GEOSERVER_BASE_PATH,self.WORKSPACE_NAME)
 
-    def __buildQueryString(self, OUTPUTFORMAT=None):
+    def __buildFilter(self, period=None, window=None, after=None, extra=None):
+        """
+        The CQL filter of the period. The default is the period defined by setPeriod.
+
+            - window, optional - a tuple with the start and end timestamp of a time window inside the period,
+              the end is not included.
+            - after, optional - the last sort value of the previous page, used by the keyset paging.
+            - extra, optional - a CQL filter of one request, combined with the filter defined by setFilter.
+        """
+        start_date, end_date=period if period else (self.CQL_START_DATE, self.CQL_END_DATE)
+        cql="{0} between {1} AND {2}".format(self.CQL_DATE_ATTRIBUTE,start_date,end_date)
+        if window:
+            cql="{0} AND {1} >= {2} AND {1} < {3}".format(cql,self.CQL_DATE_ATTRIBUTE,window[0],window[1])
+        if after is not None:
+            cql="{0} AND {1} > {2}".format(cql,self.SORT_ATTRIBUTE,self.__literal(after))
+        if self.CQL_EXTRA_FILTER:
+            cql="{0} AND ({1})".format(cql,self.CQL_EXTRA_FILTER)
+        if extra:
+            cql="{0} AND ({1})".format(cql,extra)
+        return cql
+
+    def __literal(self, value):
+        """
+        A CQL literal of a sort value, numbers are not quoted.
+        """
+        try:
+            float(value)
+            return str(value)
+        except (TypeError, ValueError):
+            return "'{0}'".format(str(value).replace("'","''"))
+
+    def __buildQueryString(self, OUTPUTFORMAT=None, period=None, window=None, after=None, extra=None):
         """
         Building the query string to call the WFS service.
 
         The parameter: OUTPUTFORMAT, the output format for the WFS GetFeature operation described
         in the AllowedValues section in the capabilities document.
+        The parameter: period, optional - a tuple with the start and end date used instead of the period defined by setPeriod.
+        The parameters: window, after and extra, optional - see __buildFilter.
         """
         # WFS parameters
         SERVICE="WFS"
         REQUEST="GetFeature"
         VERSION="2.0.0"
-        # if OUTPUTFORMAT is changed, check the output file extension within the get method in this class.
-        OUTPUTFORMAT=("SHAPE-ZIP" if not OUTPUTFORMAT else OUTPUTFORMAT)
+        # the output file extension is defined by the output format driver, see getPartFileName
+        OUTPUTFORMAT=(self.OUTPUT_FORMAT.output_format if not OUTPUTFORMAT else OUTPUTFORMAT)
         exceptions="text/xml"
         # define the output projection. We use the layer default projection. (Geography/SIRGAS2000)
         srsName=self.getDefaultEPSG()
         # the layer definition
         TYPENAME=self.LAYER_NAME  #{0}:{1}".format(self.WORKSPACE_NAME,self.LAYER_NAME)
 
-        CQL_FILTER="{0} between {1} AND {2}".format(self.CQL_DATE_ATTRIBUTE,self.CQL_START_DATE,self.CQL_END_DATE)
+        CQL_FILTER=self.__buildFilter(period, window, after, extra)
 
         allLocalParams=locals()
         allLocalParams.pop("self",None)
+        allLocalParams.pop("period",None)
+        allLocalParams.pop("window",None)
+        allLocalParams.pop("after",None)
+        allLocalParams.pop("extra",None)
         PARAMS="&".join("{}={}".format(k,v) for k,v in allLocalParams.items())
 
         return PARAMS
 
-    def __xmlRequest(self, url):
+    def __xmlRequest(self, url, cache_ttl=None, frozen=False):
+        """
+        Request a XML document and return its root element.
+
+            - cache_ttl, optional - if it is defined, the response is read from and stored in the cache with this TTL.
+            - frozen, if True the stored response never expires.
+        """
         root=None
-        if self.AUTH:
-            response=requests.get(url, auth=self.AUTH)
+        content=self.cache.get(url, ttl=cache_ttl) if cache_ttl is not None else None
+
+        if content is not None:
+            root=xmlTree.fromstring(content)
         else:
-            response=requests.get(url)
+            content=self.scheduler.call(url, lambda response: response.content if response.ok else None, kind="xml")
 
-        if response.ok:
-            xmlInMemory = io.BytesIO(response.content)
-            tree = xmlTree.parse(xmlInMemory)
-            root = tree.getroot()
+            if content is not None:
+                xmlInMemory = io.BytesIO(content)
+                tree = xmlTree.parse(xmlInMemory)
+                root = tree.getroot()
+                # the service exceptions are never cached
+                if cache_ttl is not None and not root.tag.endswith("ExceptionReport"):
+                    self.cache.put(url, content.decode("utf-8"), ttl=cache_ttl, frozen=frozen)
 
         return root
 
+    def __isFrozen(self, period=None):
+        """
+        A period is frozen when its end date is older than frozen_after_days, so its data no longer changes.
+        """
+        end_date=period[1] if period else self.CQL_END_DATE
+        end_date=datetime.strptime(str(end_date)[:10],'%Y-%m-%d').date()
+        return (date.today()-end_date).days>self.FROZEN_AFTER_DAYS
+
     def __getServerLimit(self):
         """
         Read the data download service limit via WFS
@@ -140,7 +262,8 @@ class WFS:
         serverLimit=self.serverLimitByTarget
         url="{0}?{1}".format(self.__buildBaseURL(),"service=wfs&version=2.0.0&request=GetCapabilities")
 
-        XML=self.__xmlRequest(url)
+        with getRunMetrics().timer("capabilities"):
+            XML=self.__xmlRequest(url, cache_ttl=self.CACHE_TTL)
 
         if XML is not None and '{http://www.opengis.net/wfs/2.0}WFS_Capabilities'==XML.tag:
             for p in XML.findall(".//{http://www.opengis.net/ows/1.1}Operation/[@name='GetFeature']"):
@@ -149,41 +272,259 @@ class WFS:
 
         return int(serverLimit)
 
-    def __getPageFeature(self, pagination="startIndex=0", pagNumber=1):
-        url="{0}?{1}&{2}".format(self.__buildBaseURL(), self.__buildQueryString(), pagination)
+    def __getPageFeature(self, pagination="startIndex=0", pagNumber=1, on_page=None, window=None, after=None, extra=None):
+        """
+        Download one page and return the path of the part file and its number of features. Raise an exception if
+        the page can not be downloaded after the retries, see RequestScheduler.
 
-        # the extension of output file is ".zip" because the OUTPUTFORMAT is defined as "SHAPE-ZIP"
-        output_file="{0}/{1}_part{2}.zip".format(self.DATA_DIR, self.OUTPUT_FILENAME, pagNumber)
-        if self.AUTH:
-            response=requests.get(url, auth=self.AUTH)
-        else:
-            response=requests.get(url)
+            - window, after and extra, optional - see __buildFilter.
+        """
+        url="{0}?{1}&{2}".format(self.__buildBaseURL(), self.__buildQueryString(window=window, after=after, extra=extra), pagination)
+
+        output_file="{0}/{1}".format(self.DATA_DIR, self.getPartFileName(self.OUTPUT_FILENAME, pagNumber))
+        query_hash=DownloadManifest.queryHash(url)
+
+        # the downloads without a manifest, like the download by identifiers, are never resumed
+        if self.manifest is not None and self.manifest.isComplete(pagNumber, query_hash, output_file):
+            print("Skipping the page {0}, it was already downloaded.".format(pagNumber))
+            if on_page is not None:
+                on_page(os.path.basename(output_file))
+            return output_file, self.manifest.pages[str(pagNumber)]["features"]
+
+        # stream the response into a temporary file and rename it only when it is complete
+        tmp_file="{0}.tmp".format(output_file)
+
+        def save(response):
+            if not response.ok:
+                raise Exception("Download fail with HTTP Error: {0}".format(response.status_code))
+
+            sha=hashlib.sha256()
+            size=0
+            with open(tmp_file, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunkSize):
+                    f.write(chunk)
+                    sha.update(chunk)
+                    size+=len(chunk)
+
+            try:
+                features=self.OUTPUT_FORMAT.countFeatures(tmp_file)
+            except Exception as e:
+                os.remove(tmp_file)
+                # a truncated or an error page, the page is requested again
+                raise RetryableError("Download fail with an invalid page {0}: {1}".format(pagNumber, e))
+            return size, sha.hexdigest(), features
+
+        metrics=getRunMetrics()
+        with metrics.timer("page_download"):
+            size, checksum, features=self.scheduler.call(url, save, stream=True, kind="page", units=lambda result: result[2])
+        metrics.add("pages_downloaded")
+        metrics.add("bytes_downloaded", size)
+        metrics.add("features_downloaded", features)
+        os.replace(tmp_file, output_file)
+        if self.manifest is not None:
+            self.manifest.add(pagNumber, query_hash, output_file, size, checksum, features)
+        if on_page is not None:
+            on_page(os.path.basename(output_file))
+        return output_file, features
+
+    def __getKeysetPages(self, pages, window, on_page=None):
+        """
+        Download the pages of one window in sequence, each one filtered after the last sort value of the previous page.
+        Every page has the same cost, since the server never skips rows by startIndex.
+        """
+        after=None
+        for paginationParams, pagNumber in pages:
+            output_file, features=self.__getPageFeature(paginationParams, pagNumber, on_page=on_page, window=window, after=after)
+            after=self.OUTPUT_FORMAT.getLastValue(output_file, self.SORT_ATTRIBUTE)
 
-        if response.ok:
-            with open(output_file, 'wb') as f:
-                f.write(response.content)
-        else:
-            print("Download fail with HTTP Error: {0}".format(response.status_code))
+    def __planWindows(self, sl):
+        """
+        Split the period into time windows with at most sl results, by recursive bisection.
+
+        The number of results of the windows of each level is read with concurrent hits requests.
+        A window narrower than minWindowSeconds is kept even if it has more results than sl.
+        Return a sorted list of ((start, end), hits) without the empty windows.
+        """
+        start=datetime.strptime(str(self.CQL_START_DATE)[:10],'%Y-%m-%d')
+        end=datetime.strptime(str(self.CQL_END_DATE)[:10],'%Y-%m-%d') + timedelta(days=1)
+        pending=[(start, end)]
+        windows=[]
+        while pending:
+            counts=self.countPeriods([(self.CQL_START_DATE, self.CQL_END_DATE, w[0].isoformat(), w[1].isoformat()) for w in pending])
+            split=[]
+            for w in pending:
+                hits=counts[(self.CQL_START_DATE, self.CQL_END_DATE, w[0].isoformat(), w[1].isoformat())]
+                if hits<=sl or (w[1]-w[0]).total_seconds()<=self.minWindowSeconds:
+                    if hits>0:
+                        windows.append(((w[0].isoformat(), w[1].isoformat()), hits))
+                else:
+                    middle=w[0] + timedelta(seconds=int((w[1]-w[0]).total_seconds()//2))
+                    split.extend([(w[0], middle), (middle, w[1])])
+            pending=split
+        windows.sort()
+        print("The period was split into {0} time windows.".format(len(windows)))
+        return windows
+
+    def __planPages(self, sl, rr):
+        """
+        The download plan. Return the number of results, the number of pages and a list of tasks, where each
+        task is a function, called with the on_page argument, that downloads one or more pages. The page number defines the part file name,
+        so the output is the same in any download order.
+        """
+        pagNumber=1
+        tasks=[]
+        sortBy=self.SORT_ATTRIBUTE
+        if self.PAGING_MODE=="offset":
+            # pages of the whole period by startIndex, using the server limit to each download
+            for startIndex in range(0, rr, sl):
+                paginationParams="count={0}&sortBy={1}&startIndex={2}".format(sl,sortBy,startIndex)
+                tasks.append(partial(self.__getPageFeature, paginationParams, pagNumber))
+                pagNumber=pagNumber+1
+            return rr, pagNumber, tasks
+
+        keyset=self.PAGING_MODE=="keyset"
+        if keyset and self.SORT_ATTRIBUTE not in self.getAttributes():
+            print("The layer has no {0} attribute to filter by, using the window paging.".format(self.SORT_ATTRIBUTE))
+            keyset=False
+
+        rr=0
+        for window, hits in self.__planWindows(sl):
+            rr=rr+hits
+            pages=[]
+            for startIndex in range(0, hits, sl):
+                paginationParams="count={0}&sortBy={1}".format(sl,sortBy)
+                if not keyset:
+                    paginationParams="{0}&startIndex={1}".format(paginationParams,startIndex)
+                pages.append((paginationParams,pagNumber))
+                pagNumber=pagNumber+1
+            if keyset and len(pages)>1:
+                tasks.append(partial(self.__getKeysetPages, pages, window))
+            else:
+                tasks.extend(partial(self.__getPageFeature, *page, window=window) for page in pages)
+        return rr, pagNumber, tasks
+
+    def removeManifest(self, base_file_name):
+        """
+        Remove the download manifest of one period, after the period was committed to the database.
+        """
+        DownloadManifest("{0}/{1}_manifest.json".format(self.DATA_DIR, base_file_name)).remove()
 
     def getDefaultEPSG(self):
         return f"EPSG:{self.DEFAULT_EPSG}"
         
+    def getPartFileName(self, base_file_name, pagNumber):
+        """
+        The name of one downloaded part, with the file extension of the configured output format.
+        """
+        return "{0}_part{1}.{2}".format(base_file_name, pagNumber, self.OUTPUT_FORMAT.extension)
+
     def setPeriod(self, start_date, end_date):
         # used to filter data
         self.CQL_START_DATE=start_date
         self.CQL_END_DATE=end_date
         
-    def countMax(self):
+    def getAttributes(self):
         """
-        Read the number of lines of results expected in the download using the defined filters.
+        Read the attribute names of the layer from the DescribeFeatureType document.
+        """
+        url="{0}?service=wfs&version=2.0.0&request=DescribeFeatureType&typeNames={1}".format(self.__buildBaseURL(),self.LAYER_NAME)
+        with getRunMetrics().timer("describe"):
+            XML=self.__xmlRequest(url, cache_ttl=self.CACHE_TTL)
+        if XML is None:
+            raise Exception("Failed to read the description of the layer {0}.".format(self.LAYER_NAME))
+        return [e.get("name") for e in XML.findall(".//{http://www.w3.org/2001/XMLSchema}sequence/{http://www.w3.org/2001/XMLSchema}element")]
+
+    def getCacheStats(self):
+        """
+        The number of requests answered by the cache (hits) and by the server (misses).
+        """
+        return self.cache.getStats()
+
+    def setFilter(self, cql_filter=None):
+        """
+        Define an extra CQL filter, combined with the period filter. Use None to remove it.
+        """
+        self.CQL_EXTRA_FILTER=cql_filter
+
+    def setResume(self, resume=True):
+        """
+        Define if the next downloads reuse the pages of a previous download of the same period. Use False to
+        always download all pages, like the reload of a period whose data changed in the source.
+        """
+        self.RESUME_PAGES=resume
+
+    def getFeatureIds(self, period):
+        """
+        Read only the identifiers (see id_attribute) of the features of one period, page by page, as GeoJSON.
+
+            - period, a tuple with the start and end date.
+        """
+        json_format=getOutputFormat("application/json")
+        sl=self.__getServerLimit()
+        rr=self.countMax(period=period)
+        ids=[]
+        for startIndex in range(0, rr, sl):
+            url="{0}?{1}".format(self.__buildBaseURL(), self.__buildQueryString(OUTPUTFORMAT=json_format.output_format, period=period))
+            url="{0}&propertyName={1}&count={2}&sortBy={3}&startIndex={4}".format(url,self.ID_ATTRIBUTE,sl,self.SORT_ATTRIBUTE,startIndex)
+            ids.extend(self.scheduler.call(url, self.__readFeatureIds, stream=True, kind="ids", units=len))
+        return ids
+
+    def __readFeatureIds(self, response):
+        if not response.ok:
+            raise Exception("Failed to read the feature identifiers with HTTP Error: {0}".format(response.status_code))
+        json_format=getOutputFormat("application/json")
+        try:
+            return [feature["properties"][self.ID_ATTRIBUTE] for feature in json_format.iterFeatures(response.iter_content(chunk_size=self.chunkSize))]
+        except ValueError as e:
+            raise RetryableError(e.__str__())
+
+    def downloadByIds(self, ids, output_dir, ids_per_request=100, on_page=None):
+        """
+        Download the features of the period with the given identifiers (see id_attribute), one page for each batch
+        of identifiers. There is no hits request and no manifest, the number of features of each page is known.
+        Return the number of downloaded features, the base file name and the number of parts plus one, like download.
+
+            - ids, a list of identifiers.
+            - ids_per_request, the number of identifiers in the filter of each page.
         """
         if self.CQL_START_DATE is None or self.CQL_END_DATE is None:
             raise Exception("Missing period to filter data. Call the setPeriod to do that.")
-        
-        url="{0}?{1}".format(self.__buildBaseURL(), self.__buildQueryString())
+
+        self.DATA_DIR=output_dir
+        os.makedirs(self.DATA_DIR, exist_ok=True)
+        self.OUTPUT_FILENAME="{0}_{1}_{2}_ids".format(self.LAYER_NAME,self.CQL_START_DATE,self.CQL_END_DATE)
+        self.manifest=None
+
+        tasks=[]
+        for pagNumber, start in enumerate(range(0, len(ids), max(ids_per_request,1)), start=1):
+            batch=ids[start:start+ids_per_request]
+            extra="{0} IN ({1})".format(self.ID_ATTRIBUTE, ",".join(self.__literal(id) for id in batch))
+            paginationParams="count={0}&sortBy={1}".format(len(batch),self.SORT_ATTRIBUTE)
+            tasks.append(partial(self.__getPageFeature, paginationParams, pagNumber, on_page=on_page, extra=extra))
+
+        with ThreadPoolExecutor(max_workers=max(self.DOWNLOAD_WORKERS,1)) as executor:
+            pages=list(executor.map(lambda task: task(), tasks))
+
+        return sum(features for output_file, features in pages), self.OUTPUT_FILENAME, len(tasks)+1
+
+    def countMax(self, period=None):
+        """
+        Read the number of lines of results expected in the download using the defined filters.
+
+            - period, optional - a tuple with the start and end date to count, instead of the period defined by setPeriod.
+              It can also have the start and end timestamp of a time window inside the period, see __buildFilter.
+        """
+        if period is None and (self.CQL_START_DATE is None or self.CQL_END_DATE is None):
+            raise Exception("Missing period to filter data. Call the setPeriod to do that.")
+
+        window=None
+        if period is not None and len(period)==4:
+            period, window=period[:2], period[2:]
+        url="{0}?{1}".format(self.__buildBaseURL(), self.__buildQueryString(period=period, window=window))
         url="{0}&{1}".format(url,"resultType=hits")
         numberMatched=0
-        XML=self.__xmlRequest(url)
+        with getRunMetrics().timer("count"):
+            XML=self.__xmlRequest(url, cache_ttl=self.HITS_TTL, frozen=self.__isFrozen(period))
         if XML is not None and '{http://www.opengis.net/wfs/2.0}FeatureCollection'==XML.tag:
             numberMatched=XML.find('[@numberMatched]').get('numberMatched')
         else:
@@ -192,9 +533,26 @@ class WFS:
 
         return int(numberMatched)
 
-    def download(self, output_dir):
+    def countPeriods(self, periods):
+        """
+        Read the number of results of many periods at once, with concurrent requests.
+
+        The period defined by setPeriod is not changed. Return a dictionary where the key is the
+        (start_date, end_date) tuple of each period and the value is the number of results.
+
+            - periods, a list of (start_date, end_date) tuples.
+        """
+        periods=list(periods)
+        with ThreadPoolExecutor(max_workers=max(self.DOWNLOAD_WORKERS,1)) as executor:
+            counts=list(executor.map(lambda period: self.countMax(period=period), periods))
+        return dict(zip(periods, counts))
+
+    def download(self, output_dir, on_page=None):
         """
         Perform the download and return the number of rows in the data.
+
+            - on_page, optional - a function called with the part file name as soon as each page is on disk.
+              It is called from the download workers, so a blocking call holds back the next downloads.
         """
         if self.CQL_START_DATE is None or self.CQL_END_DATE is None:
             raise Exception("Missing period to filter data. Call the setPeriod to do that.")
@@ -204,26 +562,27 @@ class WFS:
         # create the base directory to store downloaded data
         os.makedirs(self.DATA_DIR, exist_ok=True) # create the output directory if it not exists
 
-        # The output file name (layer_name_start_date_end_date)
+        # The output file name (layer_name_start_date_end_date), with a hash of the extra filter if it is defined
         self.OUTPUT_FILENAME="{0}_{1}_{2}".format(self.LAYER_NAME,self.CQL_START_DATE,self.CQL_END_DATE)
+        if self.CQL_EXTRA_FILTER:
+            self.OUTPUT_FILENAME="{0}_{1}".format(self.OUTPUT_FILENAME,hashlib.sha1(self.CQL_EXTRA_FILTER.encode("utf-8")).hexdigest()[:8])
+        # the pages completed in a previous run of this period are listed here
+        self.manifest=DownloadManifest("{0}/{1}_manifest.json".format(self.DATA_DIR, self.OUTPUT_FILENAME))
+        if not self.RESUME_PAGES:
+            self.manifest.remove()
 
         # get server limit and count max number of results
         sl=self.__getServerLimit()
         rr=self.countMax()
-        # define the start page number
-        pagNumber=1
-        # define the start index of data
-        startIndex=0
-        # define the attribute to sort data
-        sortBy=self.SORT_ATTRIBUTE
-        # using the server limit to each download
-        count=sl
-        # pagination iteraction
-        while(startIndex<rr):
-            paginationParams="count={0}&sortBy={1}&startIndex={2}".format(count,sortBy,startIndex)
-            self.__getPageFeature(paginationParams,pagNumber)
-            startIndex=startIndex+count
-            pagNumber=pagNumber+1
+        # pagination plan, see paging_mode
+        rr, pagNumber, tasks=self.__planPages(sl, rr) if rr>0 else (rr, 1, [])
+        # the pages of a previous run are reused only if the source still matches the same features
+        self.manifest.setPlan(rr, pagNumber)
+
+        # download the pages in parallel over the shared session, a page that fails after the retries aborts the download
+        with ThreadPoolExecutor(max_workers=max(self.DOWNLOAD_WORKERS,1)) as executor:
+            list(executor.map(lambda task: task(on_page=on_page), tasks))
+        print("Requests: {requests}, retries: {retries}, throttled: {throttled}, timeouts: {timeouts}, concurrency limit: {limit}".format(**self.scheduler.getStats()))
         
         return rr, self.OUTPUT_FILENAME, pagNumber
 
@@ -0,0 +1,107 @@
+"""
+WFS response cache
+
+Copyright 2024 TerraBrasilis
+
+Usage:
+  Persistent cache of WFS responses, used to avoid asking the server again for metadata
+  and for the number of results of periods that no longer change.
+"""
+
+import os, json, time, fcntl, threading
+from urllib.parse import urlsplit, parse_qsl
+
+"""
+    Persistent cache of WFS responses, stored as a JSON file.
+
+    Each entry is keyed by the normalized request URL. An entry is valid while it is younger than the
+    given TTL, or forever if it was stored as frozen. The number of hits and misses is counted.
+
+    The cache file may be shared by many processes, like the workers of a backfill. Each write reads the file
+    again under a file lock and adds the new entry to it, so the entries stored by the other processes are kept,
+    and the expired entries are removed.
+"""
+class WFSCache:
+
+    def __init__(self, cache_file):
+        """
+        Constructor
+
+            - cache_file, the path and full name of the cache file. It is created on the first stored entry.
+        """
+        self.cache_file=cache_file
+        self.__lock=threading.Lock()
+        self.entries=self.__read()
+        self.stats={"hits":0, "misses":0}
+
+    def __read(self):
+        entries={}
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    entries=json.load(f).get("entries", {})
+            except ValueError:
+                print("Ignoring an unreadable WFS cache: {0}".format(self.cache_file))
+        return entries
+
+    @staticmethod
+    def __isExpired(entry, now):
+        # the entries written before the expiration time was stored are expired
+        return not entry["frozen"] and entry.get("expires_at", entry["stored_at"])<now
+
+    def __write(self, key, entry):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open("{0}.lock".format(self.cache_file), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            now=time.time()
+            entries=self.__read()
+            entries[key]=entry
+            self.entries={k:e for k,e in entries.items() if not self.__isExpired(e, now)}
+            tmp_file="{0}.{1}.tmp".format(self.cache_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump({"entries":self.entries}, f)
+            os.replace(tmp_file, self.cache_file)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def normalize(url):
+        """
+        The cache key of a request URL. The parameter names are case insensitive and their order does not matter.
+        """
+        parts=urlsplit(url)
+        params=sorted((k.lower(), v) for k,v in parse_qsl(parts.query, keep_blank_values=True))
+        return "{0}://{1}{2}?{3}".format(parts.scheme, parts.netloc.lower(), parts.path, "&".join("{0}={1}".format(k,v) for k,v in params))
+
+    def get(self, url, ttl=0):
+        """
+        Return the cached value of a request, or None if it is missing or expired.
+
+            - ttl, the maximum age in seconds of a not frozen entry.
+        """
+        with self.__lock:
+            entry=self.entries.get(self.normalize(url))
+            if entry is not None and (entry["frozen"] or time.time()-entry["stored_at"]<=ttl):
+                self.stats["hits"]+=1
+                return entry["value"]
+            self.stats["misses"]+=1
+            return None
+
+    def put(self, url, value, ttl=0, frozen=False):
+        """
+        Store the value of a request and persist the cache.
+
+            - ttl, the time in seconds that the entry is valid. An entry that is not frozen and has no TTL could
+              never be read, so it is not stored.
+            - frozen, if True the entry never expires.
+        """
+        if not frozen and ttl<=0:
+            return
+        with self.__lock:
+            stored_at=time.time()
+            self.__write(self.normalize(url), {"value":value, "stored_at":stored_at, "expires_at":stored_at+ttl, "frozen":frozen})
+
+    def getStats(self):
+        with self.__lock:
+            return dict(self.stats)
+
+# end of class
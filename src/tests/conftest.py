@@ -0,0 +1,80 @@
+"""
+Shared fixtures of the offline tests, a local stub GeoServer and a WFS client configured for it.
+
+Usage:
+    cd src
+    python3 -m pytest -q tests
+"""
+import os
+import sys
+from datetime import date, timedelta
+import pytest
+
+sys.path.insert(0, os.path.realpath(os.path.dirname(__file__) + '/../'))
+
+from benchmarks.synthetic_data import generateFocuses
+from benchmarks.stub_geoserver import StubGeoServer
+
+GEOSERVER_CFG="""[geoserver]
+geoserver_base_url: {base_url}
+geoserver_base_path: geoserver
+workspace: terrabrasilis
+layer: focos
+default_epsg: 4674
+sort_attribute: fid
+date_attribute: datahora
+user: test
+password: test
+download_workers: {workers}
+output_format: {output_format}
+paging_mode: {paging_mode}
+cache_dir: {work_dir}/cache
+hits_ttl: 0
+frozen_after_days: {frozen_after_days}
+max_retries: {max_retries}
+retry_backoff: 0.01
+"""
+
+# a recent period, so its number of results is never read from the cache of a frozen period
+RECENT_START=(date.today()-timedelta(days=2)).strftime('%Y-%m-%d')
+RECENT_END=date.today().strftime('%Y-%m-%d')
+
+@pytest.fixture
+def stub_server():
+    """
+    Start a stub GeoServer with the given focuses and stop it at the end of the test.
+    """
+    servers=[]
+
+    def start(focuses, **kwargs):
+        server=StubGeoServer(focuses, **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def make_wfs(tmp_path):
+    """
+    Build a WFS client of a stub server, with its configuration, cache and download directory in tmp_path.
+    """
+    from tasks.wfs import WFS
+
+    def build(server, output_format="SHAPE-ZIP", paging_mode="offset", workers=4, frozen_after_days=30, max_retries=4):
+        with open(f"{tmp_path}/geoserver.cfg", 'w') as f:
+            f.write(GEOSERVER_CFG.format(base_url=server.base_url, workers=workers, output_format=output_format,
+                                         paging_mode=paging_mode, work_dir=tmp_path, frozen_after_days=frozen_after_days,
+                                         max_retries=max_retries))
+        return WFS(f"{tmp_path}/", 'geoserver.cfg', 'geoserver')
+
+    return build
+
+@pytest.fixture
+def focuses():
+    return generateFocuses(620, start_date="2024-08-01", end_date="2024-08-03", seed=7)
+
+@pytest.fixture
+def recent_focuses():
+    return generateFocuses(620, start_date=RECENT_START, end_date=RECENT_END, seed=11)
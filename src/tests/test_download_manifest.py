@@ -0,0 +1,52 @@
+"""
+The download manifest: the resume of an interrupted download and the discard of the pages of a changed source.
+"""
+import os
+import json
+from tasks.metrics import resetRunMetrics
+from tests.conftest import RECENT_START, RECENT_END
+
+def _download(wfs, tmp_path):
+    metrics=resetRunMetrics("test")
+    wfs.setPeriod(start_date=RECENT_START, end_date=RECENT_END)
+    rows, base_file_name, total_files=wfs.download(output_dir=str(tmp_path))
+    return rows, base_file_name, total_files, metrics.getReport()["counters"].get("pages_downloaded", 0)
+
+def test_resume_downloads_only_missing_and_corrupt_pages(stub_server, make_wfs, recent_focuses, tmp_path):
+    wfs=make_wfs(stub_server(recent_focuses, page_limit=100))
+    rows, base_file_name, total_files, pages=_download(wfs, tmp_path)
+    assert (rows, total_files, pages)==(620, 8, 7)
+
+    os.remove(f"{tmp_path}/{wfs.getPartFileName(base_file_name, 2)}")
+    with open(f"{tmp_path}/{wfs.getPartFileName(base_file_name, 5)}", 'r+b') as f:
+        f.truncate(100)
+
+    rows, base_file_name, total_files, pages=_download(wfs, tmp_path)
+    assert (rows, total_files, pages)==(620, 8, 2)
+    manifest=json.load(open(f"{tmp_path}/{base_file_name}_manifest.json"))
+    assert sorted(int(n) for n in manifest["pages"])==list(range(1, 8))
+    assert sum(page["features"] for page in manifest["pages"].values())==620
+
+def test_changed_source_discards_the_pages(stub_server, make_wfs, recent_focuses, tmp_path):
+    wfs=make_wfs(stub_server(recent_focuses[:500], page_limit=100))
+    assert _download(wfs, tmp_path)[3]==5
+
+    # late focuses published for the same period
+    wfs=make_wfs(stub_server(recent_focuses, page_limit=100))
+    rows, base_file_name, total_files, pages=_download(wfs, tmp_path)
+    assert (rows, pages)==(620, 7)
+
+    # the source did not change again, so every page is reused
+    assert _download(wfs, tmp_path)[3]==0
+
+def test_no_resume_and_remove(stub_server, make_wfs, recent_focuses, tmp_path):
+    wfs=make_wfs(stub_server(recent_focuses, page_limit=100))
+    base_file_name=_download(wfs, tmp_path)[1]
+
+    wfs.setResume(False)
+    assert _download(wfs, tmp_path)[3]==7
+    wfs.setResume(True)
+
+    wfs.removeManifest(base_file_name)
+    assert not os.path.exists(f"{tmp_path}/{base_file_name}_manifest.json")
+    assert _download(wfs, tmp_path)[3]==7
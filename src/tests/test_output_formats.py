@@ -0,0 +1,74 @@
+"""
+The output format drivers, read against the pages written by the stub GeoServer.
+"""
+import pytest
+from tasks.output_formats import getOutputFormat
+
+FORMATS=["SHAPE-ZIP", "application/json", "csv"]
+
+def _download(stub_server, make_wfs, focuses, tmp_path, output_format, page_limit=250):
+    server=stub_server(focuses, page_limit=page_limit)
+    wfs=make_wfs(server, output_format=output_format)
+    wfs.setPeriod(start_date="2024-08-01", end_date="2024-08-03")
+    rows, base_file_name, total_files=wfs.download(output_dir=str(tmp_path))
+    return wfs, rows, [f"{tmp_path}/{wfs.getPartFileName(base_file_name, n)}" for n in range(1, total_files)]
+
+@pytest.mark.parametrize("output_format", FORMATS)
+def test_count_and_last_value(stub_server, make_wfs, focuses, tmp_path, output_format):
+    wfs, rows, files=_download(stub_server, make_wfs, focuses, tmp_path, output_format)
+    driver=getOutputFormat(output_format)
+    fids=sorted(f["fid"] for f in focuses)
+
+    assert rows==len(focuses)
+    assert len(files)==3
+    assert sum(driver.countFeatures(file_path) for file_path in files)==len(focuses)
+    # the pages are sorted by fid, so the last value of each page is the fid at the end of that page
+    for page, file_path in enumerate(files):
+        assert str(driver.getLastValue(file_path, "fid"))==str(fids[min((page+1)*250, len(fids))-1])
+
+def test_shape_zip_last_value_of_text_attribute(stub_server, make_wfs, focuses, tmp_path):
+    wfs, rows, files=_download(stub_server, make_wfs, focuses, tmp_path, "SHAPE-ZIP", page_limit=1000)
+    last=sorted(focuses, key=lambda f: f["fid"])[-1]
+
+    assert getOutputFormat("zip").getLastValue(files[0], "foco_id")==last["foco_id"]
+    with pytest.raises(Exception):
+        getOutputFormat("zip").getLastValue(files[0], "missing")
+
+@pytest.mark.parametrize("output_format", ["application/json", "csv"])
+@pytest.mark.parametrize("chunk_size", [7, 1024*1024])
+def test_streaming_features(stub_server, make_wfs, focuses, tmp_path, output_format, chunk_size):
+    wfs, rows, files=_download(stub_server, make_wfs, focuses, tmp_path, output_format, page_limit=1000)
+    driver=getOutputFormat(output_format)
+
+    # small chunks split the features, the numbers and the UTF-8 characters across the chunk boundaries
+    features=list(driver.iterFeatures(driver.readChunks(files[0], chunk_size=chunk_size)))
+    by_id={f["foco_id"]:f for f in focuses}
+
+    assert len(features)==len(focuses)
+    for feature in features:
+        focus=by_id[feature["properties"]["foco_id"]]
+        assert feature["geometry"]["type"]=="Point"
+        assert feature["geometry"]["coordinates"][0]==pytest.approx(focus["longitude"], abs=1e-5)
+        assert feature["properties"]["municipio"]==focus["municipio"]
+
+def test_geojson_incomplete_document(tmp_path):
+    driver=getOutputFormat("application/json")
+    document=b'{"type":"FeatureCollection","features":[{"type":"Feature","properties":{"fid":1},"geometry":null},{"type":"Fea'
+
+    with pytest.raises(ValueError):
+        list(driver.iterFeatures(iter([document])))
+
+def test_csv_geometry_column_is_detected():
+    driver=getOutputFormat("csv")
+    document=b'FID,fid,the_geom,municipio\nfocos.1,1,POINT (-50.5 -10.25),"A, B"\nfocos.2,2,POINT (-51 -11),C\n'
+
+    features=list(driver.iterFeatures(iter([document[:20], document[20:]])))
+
+    assert [f["properties"]["fid"] for f in features]==["1", "2"]
+    assert "the_geom" not in features[0]["properties"]
+    assert features[0]["properties"]["municipio"]=="A, B"
+    assert features[0]["geometry"]["coordinates"]==(-50.5, -10.25)
+
+def test_unsupported_format():
+    with pytest.raises(Exception):
+        getOutputFormat("kml")
@@ -0,0 +1,142 @@
+"""
+The request scheduler: retries, the back-off on throttling and timeouts, and the latency signal.
+"""
+import time
+import random
+import pytest
+import requests
+from tasks.request_scheduler import RequestScheduler, RetryableError
+from tasks.metrics import resetRunMetrics
+from tests.conftest import RECENT_START, RECENT_END
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, headers=None):
+        self.status_code=status_code
+        self.headers=headers or {}
+        self.ok=status_code<400
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class FakeSession:
+    """
+    Answer each request with the next item of the script: a status code, an exception or a (status code, delay) tuple.
+    """
+
+    def __init__(self, script):
+        self.script=list(script)
+        self.calls=0
+
+    def get(self, url, stream=False, timeout=None):
+        self.calls+=1
+        item=self.script.pop(0) if self.script else 200
+        if isinstance(item, Exception):
+            raise item
+        status, delay=item if isinstance(item, tuple) else (item, 0)
+        if delay:
+            time.sleep(delay)
+        return FakeResponse(status)
+
+def _scheduler(script, **kwargs):
+    kwargs.setdefault("backoff", 0.001)
+    session=FakeSession(script)
+    return RequestScheduler(session, **kwargs), session
+
+def test_retry_after_server_error():
+    scheduler, session=_scheduler([500, 502, 200])
+
+    assert scheduler.call("url", lambda response: response.status_code)==200
+    stats=scheduler.getStats()
+    assert session.calls==3
+    assert (stats["retries"], stats["throttled"], stats["decreases"])==(2, 0, 0)
+
+def test_retryable_error_of_the_handler():
+    scheduler, session=_scheduler([200, 200])
+    calls=[]
+
+    def handler(response):
+        calls.append(response)
+        if len(calls)==1:
+            raise RetryableError("truncated page")
+        return "page"
+
+    assert scheduler.call("url", handler)=="page"
+    assert scheduler.getStats()["retries"]==1
+
+def test_retries_are_exhausted():
+    scheduler, session=_scheduler([503]*3, max_retries=2)
+
+    with pytest.raises(Exception):
+        scheduler.call("url", lambda response: response)
+    assert session.calls==3
+
+def test_throttle_halves_the_limit_once_per_cooldown():
+    scheduler, session=_scheduler([429, 503, 200], max_concurrency=8, backoff=0.001)
+
+    scheduler.call("url", lambda response: response.status_code)
+    stats=scheduler.getStats()
+    assert stats["throttled"]==2
+    # the second throttled response is inside the cooldown of the first decrease
+    assert (stats["decreases"], stats["limit"])==(1, 4)
+
+def test_timeout_decreases_the_limit():
+    scheduler, session=_scheduler([requests.exceptions.Timeout("read timeout"), 200], max_concurrency=4)
+
+    assert scheduler.call("url", lambda response: response.status_code)==200
+    stats=scheduler.getStats()
+    assert (stats["timeouts"], stats["decreases"], stats["limit"])==(1, 1, 2)
+
+def test_latency_jitter_is_not_an_overload_signal():
+    random.seed(3)
+    # a healthy server, a few milliseconds per response with a large relative jitter and a short last page
+    script=[(200, random.uniform(0.0005, 0.02)) for _ in range(30)]
+    scheduler, session=_scheduler(script, max_concurrency=4)
+
+    for n in range(30):
+        units=250 if n<29 else 3
+        scheduler.call("url", lambda response: units, kind="page", units=lambda result: result)
+    assert scheduler.getStats()["decreases"]==0
+    assert scheduler.getStats()["limit"]==4
+
+def test_latency_is_compared_after_a_few_samples():
+    # the first responses of a kind are never compared, they only build the moving average
+    scheduler, session=_scheduler([(200, 0.001), (200, 0.3)], max_concurrency=4, latency_delay=0.1)
+
+    for _ in range(2):
+        scheduler.call("url", lambda response: 100, kind="page", units=lambda result: result)
+    assert scheduler.getStats()["decreases"]==0
+
+def test_slow_responses_decrease_the_limit():
+    script=[(200, 0.01)]*6+[(200, 0.3)]
+    scheduler, session=_scheduler(script, max_concurrency=4, latency_delay=0.1)
+
+    for _ in range(7):
+        scheduler.call("url", lambda response: 100, kind="page", units=lambda result: result)
+    stats=scheduler.getStats()
+    assert (stats["decreases"], stats["limit"])==(1, 2)
+
+def test_stub_download_keeps_the_limit(stub_server, make_wfs, recent_focuses, tmp_path):
+    # the download of a healthy server, many pages without latency or errors, never decreases the limit
+    wfs=make_wfs(stub_server(recent_focuses, page_limit=25))
+    resetRunMetrics("test")
+    wfs.setPeriod(start_date=RECENT_START, end_date=RECENT_END)
+    rows, base_file_name, total_files=wfs.download(output_dir=str(tmp_path))
+
+    stats=wfs.scheduler.getStats()
+    assert rows==620
+    assert (stats["throttled"], stats["timeouts"], stats["decreases"], stats["limit"])==(0, 0, 0, 4)
+
+def test_stub_download_with_errors(stub_server, make_wfs, recent_focuses, tmp_path):
+    random.seed(5)
+    wfs=make_wfs(stub_server(recent_focuses, page_limit=100, error_rate=0.2), max_retries=8)
+    resetRunMetrics("test")
+    wfs.setPeriod(start_date=RECENT_START, end_date=RECENT_END)
+    rows, base_file_name, total_files=wfs.download(output_dir=str(tmp_path))
+
+    stats=wfs.scheduler.getStats()
+    assert rows==620
+    assert stats["throttled"]>0 and stats["retries"]>=stats["throttled"]
@@ -0,0 +1,45 @@
+"""
+The persistent cache of WFS responses.
+"""
+import json
+import time
+from tasks.wfs_cache import WFSCache
+
+def test_normalized_key():
+    assert WFSCache.normalize("http://Host/wfs?B=2&a=1")==WFSCache.normalize("http://host/wfs?a=1&b=2")
+
+def test_ttl_and_frozen_entries(tmp_path):
+    cache=WFSCache(f"{tmp_path}/cache.json")
+    cache.put("http://host/wfs?a=1", "metadata", ttl=60)
+    cache.put("http://host/wfs?hits=1", "hits", frozen=True)
+    # an entry that is not frozen and has no TTL could never be read, so it is not stored
+    cache.put("http://host/wfs?hits=2", "hits", ttl=0)
+
+    assert cache.get("http://host/wfs?a=1", ttl=60)=="metadata"
+    assert cache.get("http://host/wfs?hits=1")=="hits"
+    assert cache.get("http://host/wfs?hits=2", ttl=60) is None
+    assert sorted(WFSCache(f"{tmp_path}/cache.json").entries)==[WFSCache.normalize("http://host/wfs?a=1"), WFSCache.normalize("http://host/wfs?hits=1")]
+    assert cache.getStats()=={"hits":2, "misses":1}
+
+def test_expired_entries_are_pruned(tmp_path):
+    cache_file=f"{tmp_path}/cache.json"
+    with open(cache_file, 'w') as f:
+        json.dump({"entries":{
+            "old":{"value":"1", "stored_at":time.time()-100, "expires_at":time.time()-40, "frozen":False},
+            "legacy":{"value":"2", "stored_at":time.time()-100, "frozen":False},
+            "frozen":{"value":"3", "stored_at":0, "frozen":True}
+        }}, f)
+
+    WFSCache(cache_file).put("http://host/wfs?a=1", "metadata", ttl=60)
+    assert sorted(WFSCache(cache_file).entries)==["frozen", WFSCache.normalize("http://host/wfs?a=1")]
+
+def test_processes_keep_the_entries_of_each_other(tmp_path):
+    # two instances read the file before any write, like two backfill processes
+    first=WFSCache(f"{tmp_path}/cache.json")
+    second=WFSCache(f"{tmp_path}/cache.json")
+    first.put("http://host/wfs?a=1", "first", ttl=60)
+    second.put("http://host/wfs?b=1", "second", frozen=True)
+
+    entries=WFSCache(f"{tmp_path}/cache.json").entries
+    assert len(entries)==2
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,44 @@
+"""
+The paging modes of the WFS download, each one must read every focus of the period exactly once.
+"""
+import json
+import pytest
+from tasks.metrics import resetRunMetrics
+
+def _download_fids(wfs, tmp_path):
+    resetRunMetrics("test")
+    wfs.setPeriod(start_date="2024-08-01", end_date="2024-08-03")
+    rows, base_file_name, total_files=wfs.download(output_dir=str(tmp_path))
+    fids=[]
+    for n in range(1, total_files):
+        with open(f"{tmp_path}/{wfs.getPartFileName(base_file_name, n)}") as f:
+            fids.extend(feature["properties"]["fid"] for feature in json.load(f)["features"])
+    return rows, total_files, fids
+
+@pytest.mark.parametrize("paging_mode", ["offset", "window", "keyset"])
+def test_every_focus_once(stub_server, make_wfs, focuses, tmp_path, paging_mode):
+    wfs=make_wfs(stub_server(focuses, page_limit=100), output_format="application/json", paging_mode=paging_mode)
+    rows, total_files, fids=_download_fids(wfs, tmp_path)
+
+    assert rows==len(focuses)
+    assert sorted(fids)==sorted(f["fid"] for f in focuses)
+
+def test_windows_have_at_most_one_page(stub_server, make_wfs, focuses, tmp_path):
+    wfs=make_wfs(stub_server(focuses, page_limit=100), output_format="application/json", paging_mode="window")
+    rows, total_files, fids=_download_fids(wfs, tmp_path)
+
+    # each window is split until it fits one page, so no page is read by startIndex
+    windows=wfs._WFS__planWindows(100)
+    assert all(hits<=100 for window, hits in windows)
+    assert sum(hits for window, hits in windows)==len(focuses)
+    assert total_files-1==len(windows)
+
+def test_narrow_window_is_paged(stub_server, make_wfs, focuses, tmp_path):
+    # every focus at the same time, the window can not be split below minWindowSeconds
+    same_time=[dict(f, datahora=focuses[0]["datahora"]) for f in focuses]
+    wfs=make_wfs(stub_server(same_time, page_limit=100), output_format="application/json", paging_mode="keyset")
+    rows, total_files, fids=_download_fids(wfs, tmp_path)
+
+    assert rows==len(focuses)
+    assert total_files-1==7
+    assert sorted(fids)==sorted(f["fid"] for f in focuses)